@@ -0,0 +1,279 @@
+#!/usr/local/bin/python3
+# -*- coding: utf-8 -*-
+#
+# CS207 Group Project Part 7
+# Created by Team 2 (Jonne Seleva, Nathaniel Burbank, Nicholas Ruta, Rohan Thavarajah) for Team 4
+
+# Persistent metadata table for the REST API, with indexes for the /timeseries filters.
+#
+# The table is an append-only file of JSON lines, one per stored time series (a later line for the
+# same TSid replaces the earlier one), so storing a series costs one appended line. TSmean and TSstd
+# each get an ordered index in a cs207rbtree DBDB, keyed on the value with a JSON list of the TSids
+# that have it, so a range filter costs O(log n + matches). TSlevel gets a hash index that is kept
+# in memory only, unlike the ordered indexes: opening the table reads every record into memory
+# anyway (the table file is the source of truth), and the level index is built from the records
+# read, so persisting it would add a write per stored series without saving any reads.
+#
+# Listings come a page at a time: every record has a sequence number (the order its TSid was first
+# stored), scans and level lookups run in that order and range lookups in (value, sequence number)
+# order, so an opaque cursor naming the last record returned resumes exactly where a page stopped.
+#
+# The ordered indexes are committed before the table line is appended, so after a crash they can
+# only hold extra entries; every index hit is checked against its table record.
+
+import os
+import sys
+import json
+import heapq
+import base64
+import bisect
+import threading
+
+# Hacky solution to import the red-black tree DB from the sister directory, as tsbtreedb/settings.py does
+from os.path import dirname, abspath
+d = dirname(dirname(abspath(__file__)))
+sys.path.insert(0, d + '/timeseries')
+import cs207rbtree
+
+# Global variables
+
+METADATA_FILE = "metadata.jsonl" #Metadata table, one JSON record per line
+ORDERED_FIELDS = ['TSmean', 'TSstd'] #Fields with an ordered index
+INDEX_FILES = {'TSmean': "metadata_mean.dbdb", 'TSstd': "metadata_std.dbdb"} #Ordered index of each field
+SCAN_BATCH = 1000 #Records read per page (and per lock hold) by MetadataTable.scan
+
+class MetadataTable(object):
+    """
+    Metadata records of the time series (dicts with TSid, TSmean, TSstd, TSblarg, TSlevel and
+    TSfilepath), stored in directory and indexed for the /timeseries filters.
+
+    Safe to share between threads: every operation holds the table's lock.
+
+    Args:
+        directory: directory the table and its indexes are stored in (created if needed)
+    """
+
+    def __init__(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._records = {}
+        # TSids in the order they were first stored, and the position (sequence number) of each
+        self._order = []
+        self._seq = {}
+        # sorted sequence numbers of the records at each level (built from the records read below)
+        self._levels = {}
+        table_path = os.path.join(directory, METADATA_FILE)
+        if os.path.isfile(table_path):
+            with open(table_path) as f:
+                for line in f:
+                    if line.strip():
+                        record = json.loads(line)
+                        if record['TSid'] not in self._seq:
+                            self._seq[record['TSid']] = len(self._order)
+                            self._order.append(record['TSid'])
+                        self._records[record['TSid']] = record
+        for ts_id in self._order:
+            self._levels.setdefault(self._records[ts_id]['TSlevel'], []).append(self._seq[ts_id])
+
+        self._indexes = {}
+        for field in ORDERED_FIELDS:
+            index_path = os.path.join(directory, INDEX_FILES[field])
+            rebuild = not os.path.isfile(index_path)
+            self._indexes[field] = cs207rbtree.connect(index_path)
+            if rebuild and self._records:
+                self._rebuild(field, self._records.values())
+        self._table = open(table_path, 'a')
+
+    def __len__(self):
+        return len(self._records)
+
+    def __contains__(self, ts_id):
+        return ts_id in self._records
+
+    def ids(self):
+        "TSids of every record"
+        with self._lock:
+            return list(self._records)
+
+    def get(self, ts_id):
+        "the record of ts_id (raises KeyError if there is none)"
+        return dict(self._records[ts_id])
+
+    def add(self, record):
+        "store one record, replacing any earlier record of its TSid"
+        self.add_many([record])
+
+    def add_many(self, records):
+        "store records, replacing any earlier records of their TSids; indexes are committed once"
+        # a TSid given twice counts once, with its last record
+        records = list({record['TSid']: dict(record) for record in records}.values())
+        if not records:
+            return
+        with self._lock:
+            old = {r['TSid']: self._records[r['TSid']] for r in records if r['TSid'] in self._records}
+            for field in ORDERED_FIELDS:
+                self._index_many(field, records, old)
+            for record in records:
+                self._table.write(json.dumps(record) + "\n")
+            self._table.flush()
+            for ts_id, record in old.items():
+                self._levels[record['TSlevel']].remove(self._seq[ts_id])
+            for record in records:
+                ts_id = record['TSid']
+                if ts_id not in self._seq:
+                    self._seq[ts_id] = len(self._order)
+                    self._order.append(ts_id)
+                self._records[ts_id] = record
+                bisect.insort(self._levels.setdefault(record['TSlevel'], []), self._seq[ts_id])
+
+    def _index_many(self, field, records, old):
+        "add records to the ordered index of field (moving TSids out of their old keys) and commit"
+        db = self._indexes[field]
+        if len(records) > len(self._records):
+            # cheaper to rewrite the whole index as a balanced tree than to insert one key at a time
+            merged = dict(self._records)
+            merged.update((record['TSid'], record) for record in records)
+            self._rebuild(field, merged.values())
+            return
+        changes = {}
+        def entry(key):
+            if key not in changes:
+                try:
+                    changes[key] = json.loads(db.get(float(key)))
+                except KeyError:
+                    changes[key] = []
+            return changes[key]
+        for ts_id, record in old.items():
+            ids = entry(record[field])
+            if ts_id in ids:
+                ids.remove(ts_id)
+        for record in records:
+            ids = entry(record[field])
+            if record['TSid'] not in ids:
+                ids.append(record['TSid'])
+        for key in sorted(changes):
+            db.set(float(key), json.dumps(changes[key]))
+        db.commit()
+
+    def _rebuild(self, field, records):
+        "replace the ordered index of field with one built from records"
+        keys = {}
+        for record in records:
+            keys.setdefault(float(record[field]), []).append(record['TSid'])
+        self._indexes[field].bulk_load((key, json.dumps(ids)) for key, ids in keys.items())
+
+    def page(self, mean_in=None, std_in=None, levels=None, filepath=None, cursor=None, limit=None):
+        """
+        One page of the records matching every given filter.
+
+        Args:
+            mean_in: (lo, hi) range of TSmean, inclusive
+            std_in: (lo, hi) range of TSstd, inclusive
+            levels: collection of TSlevel values
+            filepath: prefix of TSfilepath
+            cursor: cursor returned with the previous page of the same query (None for the first)
+            limit: largest number of records to return (None for every match)
+        Returns:
+            (records, cursor) tuple: the matching records, and the cursor of the next page (None
+            when this is the last). Candidates come from an ordered index when there is a range
+            filter, else from the level hash index when there is a level filter; the other filters
+            are checked on the candidates. Only a filepath filter on its own (or no filter) scans
+            the whole table.
+        Raises:
+            ValueError: if cursor is malformed or belongs to a different kind of query, or limit is
+                not positive
+        """
+        if limit is not None and limit < 1:
+            raise ValueError("limit must be positive (got %s)" % limit)
+        ranges = {field: bounds for field, bounds in [('TSmean', mean_in), ('TSstd', std_in)] if bounds is not None}
+
+        def matches(record):
+            return (all(lo <= record[field] <= hi for field, (lo, hi) in ranges.items())
+                    and (levels is None or record['TSlevel'] in levels)
+                    and (filepath is None or record['TSfilepath'].startswith(filepath)))
+
+        after = _decode_cursor(cursor, sorted(ranges)[0] if ranges else 'seq')
+        records = []
+        last = None
+        with self._lock:
+            for position, ts_id in self._candidates(ranges, levels, after):
+                record = self._records.get(ts_id)
+                if record is None or not matches(record):
+                    continue
+                if limit is not None and len(records) == limit:
+                    # another match exists, so the page ends at the last record returned
+                    return records, _encode_cursor(last)
+                records.append(dict(record))
+                last = position
+        return records, None
+
+    def _candidates(self, ranges, levels, after):
+        "(position, TSid) of the candidates of a query, in position order from just after position after"
+        if ranges:
+            field, (lo, hi) = sorted(ranges.items())[0]
+            if after is not None:
+                lo = max(float(lo), after[1])
+            for key, ids in self._indexes[field].range(float(lo), float(hi)):
+                for seq, ts_id in sorted((self._seq[ts_id], ts_id) for ts_id in json.loads(ids) if ts_id in self._seq):
+                    if after is None or [key, seq] > after[1:]:
+                        yield [field, key, seq], ts_id
+        else:
+            start = after[1] + 1 if after is not None else 0
+            if levels is not None:
+                seqs = heapq.merge(*[_from(self._levels.get(level, []), start) for level in set(levels)])
+            else:
+                seqs = range(start, len(self._order))
+            for seq in seqs:
+                yield ['seq', seq], self._order[seq]
+
+    def scan(self, batch=SCAN_BATCH, **query):
+        """
+        Iterates over the records matching a query (the arguments of page) a page at a time, so
+        neither memory use nor the time the lock is held grow with the number of matches.
+
+        The first page is read before returning (a malformed cursor raises ValueError here);
+        later ones as the iterator reaches them, so records stored meanwhile may be included.
+        """
+        records, cursor = self.page(limit=batch, **query)
+
+        def pages(records, cursor):
+            while True:
+                yield from records
+                if cursor is None:
+                    return
+                records, cursor = self.page(limit=batch, **dict(query, cursor=cursor))
+        return pages(records, cursor)
+
+    def select(self, **query):
+        "list of every record matching a query (the arguments of page, except limit)"
+        return list(self.scan(**query))
+
+    def close(self):
+        with self._lock:
+            self._table.close()
+            for db in self._indexes.values():
+                db.close()
+
+def _from(seqs, start):
+    "items of the sorted list seqs from the first one at least start"
+    for i in range(bisect.bisect_left(seqs, start), len(seqs)):
+        yield seqs[i]
+
+def _encode_cursor(position):
+    "opaque, URL safe cursor of a position in a listing"
+    return base64.urlsafe_b64encode(json.dumps(position).encode('utf-8')).decode('ascii').rstrip('=')
+
+def _decode_cursor(cursor, kind):
+    "position of a cursor from a listing of the given kind ('seq' or the ranged field), or None"
+    if cursor is None:
+        return None
+    try:
+        position = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('utf-8'))
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError("Invalid cursor '%s'" % cursor)
+    shape = [str, int] if kind == 'seq' else [str, float, int]
+    if (not isinstance(position, list) or [type(item) for item in position] != shape
+            or position[0] != kind or position[-1] < 0):
+        raise ValueError("Invalid cursor '%s' for this query" % cursor)
+    return position
@@ -0,0 +1,614 @@
+#!/usr/local/bin/python3
+# -*- coding: utf-8 -*-
+#
+# CS207 Group Project Part 7
+# Created by Team 2 (Jonne Seleva, Nathaniel Burbank, Nicholas Ruta, Rohan Thavarajah) for Team 4
+
+# asyncio HTTP server for the routes in REST_API_Specs.py. The storage manager, metadata and
+# similarity indexes are loaded once and kept in memory. Kernel distance work (the /simquery routes)
+# runs on a bounded pool of worker processes (or threads), so slow similarity queries never hold up
+# the event loop that answers the cheap /timeseries requests. Their answers are cached until the
+# indexes change (see cache.index_generation).
+
+import sys
+import re
+import json
+import random
+import hashlib
+import asyncio
+import multiprocessing
+import numpy as np
+from http import HTTPStatus
+from urllib.parse import urlsplit, parse_qsl, unquote, urlencode
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+# Hacky solution to import the similarity search modules from the sister directory (which in turn
+# puts the time series library on the path), as tsbtreedb/settings.py does
+from os.path import dirname, abspath
+TSBTREEDB_DIR = dirname(dirname(abspath(__file__))) + '/tsbtreedb/'
+sys.path.insert(0, TSBTREEDB_DIR)
+
+from simserver import SearchIndex, grid
+from simsearch import load_nparray, resample, open_curves
+from ingest import add_light_curve
+from cache import LRUCache
+from settings import LIGHT_CURVES_DIR, DB_DIR, ats
+from FileStorageManager import FileStorageManager
+from metadata import MetadataTable
+
+HELP_MESSAGE = \
+"""
+Time Series REST API Server
+
+Serves the /timeseries and /simquery routes described in REST_API_Specs.py over HTTP, keeping the
+storage manager and similarity indexes in memory. Build the indexes with tsbtreedb/genvpdbs.py first.
+
+Usage: ./restserver  [optional flags]
+
+Optional flags:
+  -h, --help        Show this help message and exit.
+  --host HOST       Address to listen on (Defaults to localhost)
+  --port N          Port to listen on (Defaults to 5001)
+  -w, --workers N   Worker processes for similarity queries (Defaults to every core)
+  --threads         Run similarity queries on worker threads instead of processes
+  --cache-mb N      Memory bound of the similarity query result cache in MB (Defaults to 16)
+  --lc-dir PATH     Light curve directory (Defaults to tsbtreedb/light_curves/)
+  --db-dir PATH     Vantage point DB directory (Defaults to tsbtreedb/vp_dbs/)
+  --sm-dir PATH     Storage manager directory for posted time series (Defaults to tsbtreedb/SM_TS_data/)
+"""
+
+# Global variables
+
+REST_ADDRESS = ("localhost", 5001) #Default address of the REST server
+SIMQUERY_K = 5 #Number of similar time series returned by /simquery
+SIMQUERY_CACHE_BYTES = 16 * 1024 * 1024 #Memory bound of the /simquery result cache
+LEVELS = "ABCDEF" #Values of the TSlevel metadata field
+MAX_BODY_BYTES = 16 * 1024 * 1024 #Largest request body accepted
+SERVER_BACKLOG = 1024 #Connections queued by the listening socket
+METADATA_BLOCK = 65536 #Light curves summarized per block when the metadata is built
+METADATA_FIELDS = ['TSid', 'TSmean', 'TSstd', 'TSblarg', 'TSlevel', 'TSfilepath'] #Fields of a metadata record
+MAX_PAGE_SIZE = 10000 #Largest page of a /timeseries listing (larger limits are cut to it)
+STREAM_CHUNK = 1000 #Records read and encoded per chunk of a streamed /timeseries listing
+
+# A float, for the floatfloor-floatceiling ranges of mean_in and std_in (either end may be negative)
+_FLOAT = r'[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?'
+_RANGE = re.compile(r'\s*(%s)\s*-\s*(%s)\s*' % (_FLOAT, _FLOAT))
+# A TSid, which names files in the storage manager and light curve directories
+_TSID = re.compile(r'[A-Za-z0-9._-]+')
+
+class TimeSeriesNotFound(Exception):
+    """No time series is stored under the requested TSid"""
+
+def make_metadata(ts_id, mean, std, filepath):
+    """
+    Metadata record of a time series. TSblarg and TSlevel are placeholders drawn from a
+    generator seeded with the id, so a series gets the same values every time it is summarized.
+    """
+    rng = random.Random(ts_id)
+    return {'TSid': ts_id, 'TSmean': float(mean), 'TSstd': float(std), 'TSblarg': rng.random(),
+            'TSlevel': rng.choice(LEVELS), 'TSfilepath': filepath}
+
+def parse_filters(query):
+    """
+    Parses the /timeseries query string into filters for MetadataTable.select.
+
+    Args:
+        query: query string, e.g. "mean_in=0.1-0.5&level_in=A,B"
+    Returns:
+        Dict of keyword arguments for MetadataTable.select (mean_in, std_in, levels, filepath).
+        A filter given twice must match both times.
+    Raises:
+        ValueError: on an unknown parameter, a malformed range or two fullfilepath prefixes
+            that are not nested
+    """
+    filters = {}
+    for name, value in parse_qsl(query, keep_blank_values=True):
+        value = value.strip().strip('"\'')
+        if name in ('mean_in', 'std_in'):
+            match = _RANGE.fullmatch(value)
+            if match is None:
+                raise ValueError("%s must be floatfloor-floatceiling (got '%s')" % (name, value))
+            lo, hi = float(match.group(1)), float(match.group(2))
+            if name in filters:
+                lo, hi = max(lo, filters[name][0]), min(hi, filters[name][1])
+            filters[name] = (lo, hi)
+        elif name in ('level', 'level_in'):
+            levels = set(level.strip() for level in value.split(',')) if name == 'level_in' else {value}
+            filters['levels'] = filters['levels'] & levels if 'levels' in filters else levels
+        elif name == 'fullfilepath':
+            # a directory matches every file in it; of two nested prefixes the longer one decides
+            old = filters.get('filepath', '')
+            if not (value.startswith(old) or old.startswith(value)):
+                raise ValueError("fullfilepath '%s' and '%s' cannot both match a file" % (old, value))
+            filters['filepath'] = max(old, value, key=len)
+        else:
+            raise ValueError("Unknown filter '%s'" % name)
+    return filters
+
+def parse_listing(query):
+    """
+    Parses the /timeseries query string: the filters of parse_filters, plus the listing options
+    limit (page size), cursor (returned with the previous page) and fields (comma separated
+    fields to return).
+
+    Args:
+        query: query string, e.g. "level=A&limit=100&fields=TSid,TSmean"
+    Returns:
+        (filters, fields, limit, cursor) tuple; fields, limit and cursor are None when not given
+    Raises:
+        ValueError: on an unknown parameter or field, a malformed range or a limit below 1
+    """
+    options = {'limit': None, 'cursor': None, 'fields': None}
+    filters = []
+    for name, value in parse_qsl(query, keep_blank_values=True):
+        if name in options:
+            options[name] = value.strip().strip('"\'')
+        else:
+            filters.append((name, value))
+    limit, fields = options['limit'], options['fields']
+    if limit is not None:
+        if not limit.isdigit() or int(limit) < 1:
+            raise ValueError("limit must be a positive integer (got '%s')" % limit)
+        limit = min(int(limit), MAX_PAGE_SIZE)
+    if fields is not None:
+        fields = [field.strip() for field in fields.split(',')]
+        unknown = [field for field in fields if field not in METADATA_FIELDS]
+        if unknown:
+            raise ValueError("Unknown field '%s'" % unknown[0])
+    return parse_filters(urlencode(filters)), fields, limit, options['cursor']
+
+class TimeSeriesService(object):
+    """
+    The data behind the REST routes: the light curve collection and its similarity indexes,
+    a FileStorageManager holding the time series posted to the API as they were read, and
+    a MetadataTable with a record for every time series (kept in lc_dir, so a regenerated
+    collection starts a new table).
+
+    Posted time series are also resampled onto the collection's grid and added to the similarity
+    indexes under their TSid, so they can be searched on and found by /simquery.
+
+    Args:
+        lc_dir: light curve directory (with the indexes built by genvpdbs)
+        db_dir: vantage point DB directory
+        sm_dir: storage manager directory for posted time series
+    """
+
+    def __init__(self, lc_dir=TSBTREEDB_DIR + LIGHT_CURVES_DIR, db_dir=TSBTREEDB_DIR + DB_DIR,
+                 sm_dir=TSBTREEDB_DIR + 'SM_TS_data'):
+        self.lc_dir = lc_dir
+        self.db_dir = db_dir
+        self.index = SearchIndex(lc_dir, db_dir)
+        self.sm = FileStorageManager(directory=sm_dir)
+        self.sm_dir = sm_dir
+        self.metadata = MetadataTable(lc_dir)
+        # Records are written as series are stored; only series stored without one (e.g. before
+        # the table existed) are summarized here, from the statistics in the storage manager's index
+        records = []
+        for ts_id in [ts_id for ts_id in self.sm.ids() if ts_id not in self.metadata]:
+            stats = self.sm.stats(ts_id)
+            records.append(make_metadata(ts_id, stats['mean'], stats['std'], sm_dir + '/ts_' + ts_id + '.npy'))
+        self.metadata.add_many(records)
+        self._summarize_collection()
+
+    def _summarize_collection(self):
+        "metadata records for the light curves in the collection without one, a block of rows at a time"
+        curves = open_curves(self.lc_dir)
+        if curves is None:
+            raise ValueError("No packed light curve store in %s; pack it with tsbtreedb/lcstore.py" % self.lc_dir)
+        ids = curves.ids
+        rows = np.array([row for row, ts_id in enumerate(ids) if ts_id not in self.metadata], dtype=np.int64)
+        for start in range(0, len(rows), METADATA_BLOCK):
+            block = rows[start:start + METADATA_BLOCK]
+            values = curves.values_at(block)
+            self.metadata.add_many(make_metadata(ids[row], mean, std, self.lc_dir + ids[row])
+                                   for row, mean, std in zip(block.tolist(), values.mean(axis=1), values.std(axis=1)))
+
+    def list_metadata(self, query=''):
+        """
+        Metadata of the time series matching a /timeseries query string (see parse_listing).
+
+        Returns:
+            (records, cursor) tuple: an iterator over the matching records, projected onto the
+            requested fields, and the cursor of the next page (None on the last page, and when
+            there is no limit). Without a limit the records are read from the table a chunk at
+            a time as the iterator is consumed.
+        """
+        filters, fields, limit, cursor = parse_listing(query)
+        if limit is None:
+            records = self.metadata.scan(batch=STREAM_CHUNK, cursor=cursor, **filters)
+        else:
+            records, cursor = self.metadata.page(limit=limit, cursor=cursor, **filters)
+        if fields is not None:
+            records = ({field: record[field] for field in fields} for record in records)
+        return records, cursor
+
+    def timeseries(self, ts_id):
+        "a time series as stored: from the storage manager if it was posted, else from the collection"
+        if ts_id in self.sm:
+            return self.sm.get(ts_id)
+        curves = open_curves(self.lc_dir)
+        if ts_id not in self.metadata or ts_id not in curves:
+            raise TimeSeriesNotFound(ts_id)
+        return curves.timeseries(ts_id)
+
+    def get(self, ts_id):
+        "metadata, times and values of a time series"
+        ts = self.timeseries(ts_id)
+        return dict(self.metadata.get(ts_id), Times=ts.times().tolist(), Values=ts.values().tolist())
+
+    def on_grid(self, times, values):
+        "values of a time series resampled onto the collection's time grid"
+        times, values = np.asarray(times, dtype=np.float64), np.asarray(values, dtype=np.float64)
+        if times.ndim != 1 or len(times) == 0 or times.shape != values.shape:
+            raise ValueError("Times and Values must be equal length, non-empty lists of numbers")
+        return resample(times, values, grid(self.index.store.length))
+
+    def query_values(self, ts_id):
+        "values on the collection's grid of a stored time series, to search on"
+        curves = open_curves(self.lc_dir)
+        if ts_id in curves:
+            return np.array(curves.values(ts_id))
+        ts = self.timeseries(ts_id)
+        return self.on_grid(ts.times(), ts.values())
+
+    def add(self, ts_id, filepath):
+        """
+        Reads a two column (time, value) text file and adds it to the storage manager, the
+        similarity indexes and the metadata under ts_id (a new id is generated when it is None).
+        Returns the stored times and values.
+
+        Everything that can be checked is checked before anything is written, and the storage
+        manager (which can be rolled back) is written before the similarity indexes (which cannot),
+        so a rejected add leaves the service unchanged.
+        """
+        if ts_id is None:
+            ts_id = str(self.sm._autogenerate_id())
+        ts_id = str(ts_id)
+        if _TSID.fullmatch(ts_id) is None or '..' in ts_id:
+            raise ValueError("TSid may only hold letters, digits and single '.', '_' or '-' characters (got '%s')" % ts_id)
+        if ts_id in self.metadata or ts_id in self.sm or ts_id in self.index.store:
+            raise ValueError("Time series %s already exists" % ts_id)
+        times, values = load_nparray(filepath, usecols=(0, 1)).T
+        order = np.argsort(times, kind='stable')
+        times, values = times[order], values[order]
+        keep = np.concatenate(([True], times[1:] != times[:-1]))
+        ts = ats.ArrayTimeSeries(times=times[keep], values=values[keep])
+        length = self.index.store.length
+        on_grid = ats.ArrayTimeSeries(times=grid(length), values=self.on_grid(ts.times(), ts.values()))
+
+        self.sm.store(ts_id, ts)
+        try:
+            add_light_curve(on_grid, self.lc_dir, self.db_dir, ts_fn=ts_id)
+        except Exception:
+            self.sm.remove(ts_id)
+            raise
+        stats = self.sm.stats(ts_id)
+        self.metadata.add(make_metadata(ts_id, stats['mean'], stats['std'], filepath))
+        # add_light_curve bumped the index generation, which workers and the result cache key on
+        self.index.reload()
+        return {'TSid': ts_id, 'Times': ts.times().tolist(), 'Values': ts.values().tolist()}
+
+    def close(self):
+        "close the metadata table"
+        self.metadata.close()
+
+# The SearchIndex of a worker process
+_worker_index = None
+
+def _init_worker(lc_dir, db_dir):
+    global _worker_index
+    _worker_index = SearchIndex(lc_dir, db_dir)
+
+def _worker_knn(values, k, generation):
+    "k nearest light curves in a worker process, reloading the indexes first if they have changed"
+    if generation != _worker_index.generation:
+        _worker_index.reload()
+    return _worker_index.knn(values, k)
+
+def content_key(values):
+    """Result cache key of a query posted by content: a hash of its values on the grid"""
+    return ('values', hashlib.sha1(np.ascontiguousarray(values, dtype=np.float64).tobytes()).hexdigest())
+
+def results_size(results):
+    """Approximate size in bytes of a list of (distance, filename) search results"""
+    return sys.getsizeof(results) + sum(sys.getsizeof(r) + sys.getsizeof(r[0]) + sys.getsizeof(r[1]) for r in results)
+
+class JSONStream(object):
+    """
+    A JSON array response sent with chunked transfer encoding, encoding STREAM_CHUNK items at a
+    time, so neither the items nor the encoded array need to be held in memory at once.
+
+    Args:
+        items: iterator over the JSON-serializable items of the array
+        headers: dict of extra response headers
+    """
+
+    def __init__(self, items, headers=None):
+        self.items = items
+        self.headers = headers or {}
+
+    def chunks(self):
+        "the encoded array, as a sequence of non-empty byte strings"
+        separator = '['
+        batch = []
+        for item in self.items:
+            batch.append(item)
+            if len(batch) == STREAM_CHUNK:
+                # one dumps call per chunk: the brackets of each chunk's array are swapped for separators
+                yield (separator + json.dumps(batch)[1:-1]).encode('utf-8')
+                separator, batch = ', ', []
+        if batch:
+            yield (separator + json.dumps(batch)[1:]).encode('utf-8')
+        else:
+            yield b'[]' if separator == '[' else b']'
+
+class HTTPError(Exception):
+    """An error answered with an HTTP status code"""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+class RestServer(object):
+    """
+    asyncio HTTP/1.1 server (with keep-alive) for a TimeSeriesService.
+
+    Args:
+        service: TimeSeriesService to answer from
+        workers: size of the similarity query pool (Defaults to every core)
+        threads: run similarity queries on threads instead of processes. Worker processes each
+            open the indexes once and sidestep the GIL; threads share the service's indexes.
+        cache_bytes: memory bound of the similarity query result cache. Results are keyed by
+            (TSid or content hash, k, index generation); the cache is emptied when the generation
+            changes, i.e. after genvpdbs rebuilds the indexes or a time series is added.
+    """
+
+    def __init__(self, service, workers=None, threads=False, cache_bytes=SIMQUERY_CACHE_BYTES):
+        self.service = service
+        self.threads = threads
+        self.results = LRUCache(cache_bytes, sizeof=results_size)
+        self._results_generation = service.index.generation
+        if threads:
+            self.pool = ThreadPoolExecutor(workers)
+        else:
+            self.pool = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'),
+                                            initializer=_init_worker, initargs=(service.lc_dir, service.db_dir))
+        self._write_lock = asyncio.Lock()
+        self._refresh_lock = asyncio.Lock()
+        self.server = None
+
+    async def start(self, host=REST_ADDRESS[0], port=REST_ADDRESS[1]):
+        "start listening; returns the asyncio server"
+        self.server = await asyncio.start_server(self.handle_connection, host, port, backlog=SERVER_BACKLOG)
+        return self.server
+
+    def close(self):
+        if self.server is not None:
+            self.server.close()
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+    async def knn(self, values, k):
+        "k nearest light curves to values on the grid, computed on the pool"
+        loop = asyncio.get_running_loop()
+        if self.threads:
+            return await loop.run_in_executor(self.pool, self.service.index.knn, values, k)
+        return await loop.run_in_executor(self.pool, _worker_knn, list(values), k, self.service.index.generation)
+
+    async def cached_knn(self, key, values, k):
+        """
+        k nearest light curves to a query, from the result cache when it was answered at the
+        current index generation.
+
+        Args:
+            key: ('id', TSid) or content_key(values) of the query
+            values: function returning the query's values on the grid (only called on a miss)
+            k: number of results
+        """
+        # picks up indexes rebuilt by genvpdbs while the server runs, as well as its own adds.
+        # Reopening the indexes is slow, so it runs off the event loop, and one at a time so
+        # concurrent misses after a rebuild don't each reload them
+        async with self._refresh_lock:
+            loop = asyncio.get_running_loop()
+            generation = await loop.run_in_executor(None, self.service.index.refresh)
+        if generation != self._results_generation:
+            self.results.clear()
+            self._results_generation = generation
+        results = self.results.get(key + (k, generation))
+        if results is None:
+            results = [tuple(r) for r in await self.knn(values(), k)]
+            # a result that raced a change of generation is never looked up again
+            if generation == self._results_generation:
+                self.results.put(key + (k, generation), results)
+        return results
+
+    def stats(self):
+        "result cache counters and the index generation they are for"
+        return {'SimQueryCache': self.results.stats(), 'IndexGeneration': self._results_generation}
+
+    async def handle_connection(self, reader, writer):
+        "answer requests on one connection until the client closes it or asks to"
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                keep_alive = False
+                try:
+                    method, target, version = request_line.decode('latin-1').split()
+                    headers = {}
+                    while True:
+                        line = await reader.readline()
+                        if line in (b'\r\n', b'\n', b''):
+                            break
+                        name, _, value = line.decode('latin-1').partition(':')
+                        headers[name.strip().lower()] = value.strip()
+                    connection = headers.get('connection', '').lower()
+                    wants_keep_alive = connection == 'keep-alive' or (version == 'HTTP/1.1' and connection != 'close')
+                    # a body that is not read in full would be parsed as the next request, so the
+                    # connection is closed after any error raised before the body is consumed
+                    if 'transfer-encoding' in headers:
+                        raise HTTPError(411, "Request bodies must be sent with a Content-Length")
+                    try:
+                        length = int(headers.get('content-length', 0))
+                    except ValueError:
+                        raise HTTPError(400, "Invalid Content-Length '%s'" % headers['content-length'])
+                    if length < 0:
+                        raise HTTPError(400, "Invalid Content-Length '%s'" % headers['content-length'])
+                    if length > MAX_BODY_BYTES:
+                        raise HTTPError(413, "Request body is larger than %d bytes" % MAX_BODY_BYTES)
+                    body = await reader.readexactly(length)
+                    keep_alive = wants_keep_alive
+                    status, payload = 200, await self.dispatch(method, target, body)
+                except HTTPError as e:
+                    status, payload = e.status, {'error': str(e)}
+                except TimeSeriesNotFound as e:
+                    status, payload = 404, {'error': "No time series %s" % e}
+                except (ValueError, OSError) as e:
+                    status, payload = 400, {'error': str(e)}
+                except Exception as e:
+                    status, payload = 500, {'error': "%s: %s" % (type(e).__name__, e)}
+                if isinstance(payload, JSONStream):
+                    # HTTP/1.0 clients get the body unchunked, ended by closing the connection
+                    chunked = version == 'HTTP/1.1'
+                    keep_alive = keep_alive and chunked
+                    if not await self.stream(writer, payload, keep_alive, chunked):
+                        break
+                else:
+                    writer.write(http_response(status, payload, keep_alive))
+                    await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def stream(self, writer, payload, keep_alive, chunked):
+        "send a JSONStream, waiting for each chunk to drain; returns False if it failed part way"
+        writer.write(streamed_head(payload.headers, keep_alive, chunked))
+        try:
+            for chunk in payload.chunks():
+                writer.write(b'%x\r\n%s\r\n' % (len(chunk), chunk) if chunked else chunk)
+                await writer.drain()
+        except ConnectionError:
+            raise
+        except Exception:
+            # too late for an error response: the client sees the body end early
+            return False
+        if chunked:
+            writer.write(b'0\r\n\r\n')
+            await writer.drain()
+        return True
+
+    async def dispatch(self, method, target, body):
+        "route one request; returns the JSON payload (a JSONStream for listings)"
+        url = urlsplit(target)
+        parts = [unquote(part) for part in url.path.strip('/').split('/')]
+        route = parts[0]
+        if route not in ('timeseries', 'simquery', 'stats') or len(parts) > 2:
+            raise HTTPError(404, "Unknown route %s" % url.path)
+        ts_id = parts[1] if len(parts) == 2 else None
+        if method == 'GET' and route == 'stats' and ts_id is None:
+            return self.stats()
+        if method == 'GET' and route == 'timeseries':
+            if ts_id is None:
+                records, cursor = self.service.list_metadata(url.query)
+                return JSONStream(records, {'X-Next-Cursor': cursor} if cursor is not None else None)
+            return self.service.get(ts_id)
+        if method == 'POST' and route == 'timeseries' and ts_id is None:
+            request = parse_json(body)
+            if 'TSfilepath' not in request:
+                raise ValueError("TSfilepath is required")
+            # Adding writes to the indexes on disk, so adds run one at a time
+            async with self._write_lock:
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(None, self.service.add, request.get('TSid'), request['TSfilepath'])
+        if method == 'GET' and route == 'simquery' and ts_id is not None:
+            # the series itself is not returned as similar to itself
+            results = await self.cached_knn(('id', ts_id), lambda: self.service.query_values(ts_id), SIMQUERY_K + 1)
+            return {'SortedSimTS': [fn for dist, fn in results if fn != ts_id][:SIMQUERY_K]}
+        if method == 'POST' and route == 'simquery' and ts_id is None:
+            request = parse_json(body)
+            values = self.service.on_grid(request.get('Times', []), request.get('Values', []))
+            results = await self.cached_knn(content_key(values), lambda: values, SIMQUERY_K)
+            return {'SortedSimTS': [fn for dist, fn in results]}
+        raise HTTPError(405, "%s is not supported on %s" % (method, url.path))
+
+def parse_json(body):
+    """Decodes a JSON object request body"""
+    try:
+        request = json.loads(body.decode('utf-8'))
+    except (UnicodeDecodeError, json.JSONDecodeError) as e:
+        raise ValueError("Request body is not valid JSON: %s" % e)
+    if not isinstance(request, dict):
+        raise ValueError("Request body must be a JSON object")
+    return request
+
+def http_response(status, payload, keep_alive=True):
+    """Encodes a JSON payload as an HTTP/1.1 response"""
+    body = json.dumps(payload).encode('utf-8')
+    head = ("HTTP/1.1 %d %s\r\nContent-Type: application/json\r\nContent-Length: %d\r\nConnection: %s\r\n\r\n"
+            % (status, HTTPStatus(status).phrase, len(body), 'keep-alive' if keep_alive else 'close'))
+    return head.encode('latin-1') + body
+
+def streamed_head(headers, keep_alive=True, chunked=True):
+    """Encodes the head of an HTTP/1.1 200 response whose JSON body is streamed after it"""
+    lines = ["HTTP/1.1 200 OK", "Content-Type: application/json"]
+    lines += ["%s: %s" % (name, value) for name, value in headers.items()]
+    if chunked:
+        lines.append("Transfer-Encoding: chunked")
+    lines.append("Connection: %s" % ('keep-alive' if keep_alive else 'close'))
+    return ("\r\n".join(lines) + "\r\n\r\n").encode('latin-1')
+
+def serve(service, host=REST_ADDRESS[0], port=REST_ADDRESS[1], workers=None, threads=False,
+          cache_bytes=SIMQUERY_CACHE_BYTES):
+    """Runs a RestServer for service until interrupted"""
+    async def main():
+        rest_server = RestServer(service, workers, threads, cache_bytes)
+        server = await rest_server.start(host, port)
+        print("Serving %d time series on http://%s:%d/" % (len(service.metadata), host, port))
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            rest_server.close()
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.close()
+
+if __name__ == "__main__":
+    """Command line interface: loads the collection and serves it."""
+    need_help = False
+    host, port = REST_ADDRESS
+    workers = None
+    threads = False
+    cache_bytes = SIMQUERY_CACHE_BYTES
+    lc_dir = TSBTREEDB_DIR + LIGHT_CURVES_DIR
+    db_dir = TSBTREEDB_DIR + DB_DIR
+    sm_dir = TSBTREEDB_DIR + 'SM_TS_data'
+
+    # First, identify which flags were included
+    args = sys.argv[1:]
+    for i, arg in enumerate(args):
+        if arg.lower() in ['-h','--help', 'help']: need_help = True
+        elif arg.lower() == '--host' and i + 1 < len(args): host = args[i + 1]
+        elif arg.lower() == '--port' and i + 1 < len(args): port = int(args[i + 1])
+        elif arg.lower() in ['-w','--workers'] and i + 1 < len(args): workers = int(args[i + 1])
+        elif arg.lower() == '--threads': threads = True
+        elif arg.lower() == '--cache-mb' and i + 1 < len(args): cache_bytes = int(float(args[i + 1]) * 1024 * 1024)
+        elif arg.lower() == '--lc-dir' and i + 1 < len(args): lc_dir = args[i + 1]
+        elif arg.lower() == '--db-dir' and i + 1 < len(args): db_dir = args[i + 1]
+        elif arg.lower() == '--sm-dir' and i + 1 < len(args): sm_dir = args[i + 1]
+
+    while(True):
+        if need_help:
+            print (HELP_MESSAGE)
+            break
+        print("Loading indexes...",end="")
+        service = TimeSeriesService(lc_dir, db_dir, sm_dir)
+        print("Done.")
+        serve(service, host, port, workers, threads, cache_bytes)
+        break
@@ -0,0 +1,314 @@
+#!/usr/local/bin/python3
+# -*- coding: utf-8 -*-
+#
+# CS207 Group Project Part 7
+# Created by Team 2 (Jonne Seleva, Nathaniel Burbank, Nicholas Ruta, Rohan Thavarajah) for Team 4
+
+import os
+import json
+import socket
+import asyncio
+import threading
+import http.client
+import numpy as np
+
+import restserver
+import metadata
+import makelcs
+import genvpdbs
+import lcstore
+import distmatrix
+from makelcs import clear_dir
+from crosscorr import kernel_dist, standardize
+from settings import TEMP_DIR, VP_DIST_MATRIX_FILE
+
+def build_test_service(name, num_lcs=40, vps=("ts-2.txt", "ts-9.txt", "ts-17.txt")):
+    """Helper to build a small light curve collection and its indexes under TEMP_DIR"""
+    lc_dir = TEMP_DIR + name + "/"
+    db_dir = TEMP_DIR + name + "_dbs/"
+    makelcs.make_lc_files(num_lcs, lc_dir)
+    ts_dict = genvpdbs.load_ts(lc_dir)
+    store = lcstore.save_spectra(ts_dict, lc_dir)
+    lcstore.save_self_kernels(ts_dict, lc_dir, store=store)
+    clear_dir(db_dir)
+    distmatrix.build_distance_matrix(lc_dir, db_dir + VP_DIST_MATRIX_FILE, rows=list(vps), workers=1)
+    genvpdbs.save_all_vp_dbs(list(vps), db_dir + VP_DIST_MATRIX_FILE, workers=1, db_dir=db_dir)
+    return restserver.TimeSeriesService(lc_dir, db_dir, TEMP_DIR + name + "_sm"), ts_dict
+
+def start_server(service, threads=True):
+    """Helper to run a RestServer on an event loop in a background thread; returns (server, thread, port)"""
+    loop = asyncio.new_event_loop()
+    rest_server = restserver.RestServer(service, workers=2, threads=threads)
+    server = loop.run_until_complete(rest_server.start("localhost", 0))
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    return rest_server, thread, server.sockets[0].getsockname()[1]
+
+def stop_server(rest_server, thread):
+    """Helper to stop a server started by start_server once its connections have finished"""
+    # worker processes still starting up must not outlive the test's files
+    rest_server.pool.shutdown(wait=True)
+    async def shutdown():
+        rest_server.close()
+        others = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        if others:
+            await asyncio.wait(others, timeout=5)
+    loop = rest_server.server.get_loop()
+    asyncio.run_coroutine_threadsafe(shutdown(), loop).result()
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    loop.close()
+
+def request(conn, method, path, payload=None):
+    """Helper to send one request on an open connection; returns (status, decoded JSON)"""
+    body = json.dumps(payload) if payload is not None else None
+    conn.request(method, path, body, {"Content-type": "application/json"})
+    response = conn.getresponse()
+    return response.status, json.loads(response.read().decode('utf-8'))
+
+def raw_request(port, data):
+    """Helper to send raw bytes on a new connection; returns everything read until the server closes it"""
+    with socket.create_connection(("localhost", port), timeout=5) as sock:
+        sock.sendall(data)
+        received = b''
+        while True:
+            chunk = sock.recv(4096)
+            if not chunk:
+                return received
+            received += chunk
+
+def list_pages(conn, query, limit):
+    """Helper to follow the cursors of a paginated /timeseries listing; returns (records, page count)"""
+    records, pages, cursor = [], 0, None
+    while True:
+        path = "/timeseries?%slimit=%d" % (query + "&" if query else "", limit)
+        conn.request("GET", path + ("&cursor=" + cursor if cursor else ""))
+        response = conn.getresponse()
+        assert(response.status == 200 and response.getheader("Transfer-Encoding") == "chunked")
+        records += json.loads(response.read().decode('utf-8'))
+        pages += 1
+        cursor = response.getheader("X-Next-Cursor")
+        if cursor is None:
+            return records, pages
+
+def brute_force_ids(values, ts_dict, k):
+    """Helper to find the exact top k ids by scoring every light curve"""
+    query = standardize(restserver.ats.ArrayTimeSeries(times=restserver.grid(len(values)), values=values))
+    return [fn for d, fn in sorted((kernel_dist(query, standardize(ts)), fn) for fn, ts in ts_dict.items())[:k]]
+
+def test_parse_filters():
+    record = restserver.make_metadata("ts-1.txt", -0.5, 1.0, "light_curves/ts-1.txt")
+    assert(record == restserver.make_metadata("ts-1.txt", -0.5, 1.0, "light_curves/ts-1.txt"))
+    assert(record['TSlevel'] in restserver.LEVELS and 0 <= record['TSblarg'] < 1)
+    assert(restserver.parse_filters("") == {})
+    assert(restserver.parse_filters("mean_in=-1.5e0--0.25") == {'mean_in': (-1.5, -0.25)})
+    assert(restserver.parse_filters("mean_in=-1-0&std_in=0.5-2&mean_in=-0.5-1") == {'mean_in': (-0.5, 0.0), 'std_in': (0.5, 2.0)})
+    assert(restserver.parse_filters("level_in=A,Z&level=A") == {'levels': {'A'}})
+    assert(restserver.parse_filters('fullfilepath="light_curves/"') == {'filepath': "light_curves/"})
+    assert(restserver.parse_filters("fullfilepath=a/&fullfilepath=a/b/&level=A") == {'filepath': "a/b/", 'levels': {'A'}})
+    for bad in ["mean_in=low-high", "std_in=1", "colour=red", "fullfilepath=a/&fullfilepath=b/&level=A"]:
+        try:
+            restserver.parse_filters(bad)
+            assert(False)
+        except ValueError:
+            pass
+
+    assert(restserver.parse_listing("") == ({}, None, None, None))
+    assert(restserver.parse_listing("level=A&limit=20&cursor=abc&fields=TSid, TSmean")
+           == ({'levels': {'A'}}, ['TSid', 'TSmean'], 20, "abc"))
+    assert(restserver.parse_listing("limit=%d" % (10 * restserver.MAX_PAGE_SIZE))[2] == restserver.MAX_PAGE_SIZE)
+    for bad in ["limit=0", "limit=ten", "fields=TSid,colour", "limit=5&colour=red"]:
+        try:
+            restserver.parse_listing(bad)
+            assert(False)
+        except ValueError:
+            pass
+
+    stream = restserver.JSONStream(iter([{'a': i} for i in range(2 * restserver.STREAM_CHUNK + 1)]))
+    chunks = list(stream.chunks())
+    assert(len(chunks) == 3 and json.loads(b''.join(chunks).decode('utf-8')) == [{'a': i} for i in range(2 * restserver.STREAM_CHUNK + 1)])
+    assert([json.loads(b''.join(restserver.JSONStream(iter(items)).chunks()).decode('utf-8')) for items in [[], [1]]] == [[], [1]])
+
+def test_metadata_table():
+    directory = TEMP_DIR + "metadata/"
+    table = metadata.MetadataTable(directory)
+    records = [restserver.make_metadata("ts-%d" % i, (i % 20) / 10 - 1, i / 100, "lcs/ts-%d" % i) for i in range(200)]
+    table.add_many(records)
+    assert(len(table) == 200 and "ts-7" in table and table.get("ts-7") == records[7])
+
+    def brute(mean_in=None, std_in=None, levels=None, filepath=None):
+        return sorted(r['TSid'] for r in records if (mean_in is None or mean_in[0] <= r['TSmean'] <= mean_in[1])
+                      and (std_in is None or std_in[0] <= r['TSstd'] <= std_in[1])
+                      and (levels is None or r['TSlevel'] in levels)
+                      and (filepath is None or r['TSfilepath'].startswith(filepath)))
+    queries = [{}, {'mean_in': (-0.35, 0.1)}, {'std_in': (0.5, 0.755)}, {'levels': {'A', 'C'}},
+               {'mean_in': (0, 1), 'levels': {'B'}}, {'filepath': "lcs/ts-1"}, {'mean_in': (5, 6)}]
+    for query in queries:
+        assert(sorted(r['TSid'] for r in table.select(**query)) == brute(**query))
+
+    # a replaced record moves between index keys, and the table survives a reopen with its indexes
+    records[7] = restserver.make_metadata("ts-7", 3.0, 0.0, "posted/ts-7")
+    table.add(records[7])
+    table.close()
+    table = metadata.MetadataTable(directory)
+    assert(len(table) == 200 and table.get("ts-7")['TSmean'] == 3.0)
+    for query in queries + [{'mean_in': (2.5, 3.5)}]:
+        assert(sorted(r['TSid'] for r in table.select(**query)) == brute(**query))
+
+    # pages resume after the last record returned, even when records change level in between
+    pages, cursor = [], None
+    while True:
+        page, cursor = table.page(levels={'A', 'B'}, cursor=cursor, limit=9)
+        pages.append(page)
+        if cursor is None:
+            break
+        if len(pages) == 2:
+            moved = dict(table.get(page[-1]['TSid']), TSlevel='E')
+            table.add(moved)
+    assert(all(len(page) == 9 for page in pages[:-1]) and len(pages) > 2)
+    listed = [r['TSid'] for page in pages for r in page]
+    assert(len(set(listed)) == len(listed) and sorted(listed) == brute(levels={'A', 'B'}))
+    records[int(moved['TSid'][3:])] = moved
+    ranged = [r['TSid'] for r in table.scan(batch=4, mean_in=(-0.35, 0.1))]
+    assert(sorted(ranged) == brute(mean_in=(-0.35, 0.1)))
+    assert([table.get(ts_id)['TSmean'] for ts_id in ranged] == sorted(table.get(ts_id)['TSmean'] for ts_id in ranged))
+    table.close()
+
+    # a missing index is rebuilt from the table
+    os.remove(directory + metadata.INDEX_FILES['TSstd'])
+    table = metadata.MetadataTable(directory)
+    assert(sorted(r['TSid'] for r in table.select(std_in=(0.5, 0.755))) == brute(std_in=(0.5, 0.755)))
+    table.close()
+    clear_dir(TEMP_DIR,recreate=False)
+
+def test_rest_server():
+    service, ts_dict = build_test_service("rest")
+    rest_server, thread, port = start_server(service)
+    conn = http.client.HTTPConnection("localhost", port)
+    try:
+        status, listing = request(conn, "GET", "/timeseries")
+        assert(status == 200 and sorted(m['TSid'] for m in listing) == sorted(ts_dict))
+        means = {m['TSid']: m['TSmean'] for m in listing}
+        assert(abs(means["ts-3.txt"] - np.mean(ts_dict["ts-3.txt"].values())) < 1e-9)
+
+        status, listing = request(conn, "GET", "/timeseries?mean_in=-100-100&level_in=A,B")
+        assert(status == 200 and all(m['TSlevel'] in "AB" for m in listing))
+        std = float(np.std(ts_dict["ts-3.txt"].values()))
+        status, listing = request(conn, "GET", "/timeseries?std_in=0-%r" % std)
+        assert(status == 200 and "ts-3.txt" in [m['TSid'] for m in listing] and all(m['TSstd'] <= std for m in listing))
+        assert(request(conn, "GET", "/timeseries?mean_in=oops")[0] == 400)
+
+        # paginated listings return every match once, in pages of at most limit records
+        for query in ["", "level_in=A,B", "mean_in=-100-100"]:
+            status, listing = request(conn, "GET", "/timeseries?" + query)
+            records, pages = list_pages(conn, query, 7)
+            assert(records == listing and pages == len(listing) // 7 + 1)
+        status, listing = request(conn, "GET", "/timeseries?fields=TSid,TSlevel&level=A")
+        assert(status == 200 and all(sorted(m) == ['TSid', 'TSlevel'] and m['TSlevel'] == 'A' for m in listing))
+        for bad in ["limit=0", "fields=colour", "cursor=oops", "limit=5&cursor=WyJzZXEiXQ"]:
+            assert(request(conn, "GET", "/timeseries?" + bad)[0] == 400)
+
+        status, ts = request(conn, "GET", "/timeseries/ts-3.txt")
+        assert(status == 200 and np.allclose(ts['Values'], ts_dict["ts-3.txt"].values()))
+        assert(request(conn, "GET", "/timeseries/nope")[0] == 404)
+        assert(request(conn, "GET", "/nowhere")[0] == 404)
+        assert(request(conn, "DELETE", "/timeseries")[0] == 405)
+
+        status, result = request(conn, "GET", "/simquery/ts-3.txt")
+        assert(status == 200 and len(result['SortedSimTS']) == restserver.SIMQUERY_K)
+        assert(result['SortedSimTS'] == [fn for fn in brute_force_ids(ts_dict["ts-3.txt"].values(), ts_dict, 6)
+                                         if fn != "ts-3.txt"][:5])
+        query = makelcs.tsmaker(0.5, 0.1, 0.3)
+        status, result = request(conn, "POST", "/simquery", {'Times': query.times().tolist(), 'Values': query.values().tolist()})
+        assert(status == 200 and result['SortedSimTS'] == brute_force_ids(query.values(), ts_dict, 5))
+        assert(request(conn, "POST", "/simquery", {'Times': [1, 2], 'Values': [1]})[0] == 400)
+
+        # repeated queries are answered from the result cache, by id and by content
+        first = request(conn, "GET", "/simquery/ts-3.txt")[1]
+        again = request(conn, "POST", "/simquery", {'Times': query.times().tolist(), 'Values': query.values().tolist()})[1]
+        assert(first['SortedSimTS'] == [fn for fn in brute_force_ids(ts_dict["ts-3.txt"].values(), ts_dict, 6)
+                                        if fn != "ts-3.txt"][:5])
+        assert(again['SortedSimTS'] == brute_force_ids(query.values(), ts_dict, 5))
+        status, stats = request(conn, "GET", "/stats")
+        assert(status == 200 and stats['SimQueryCache']['hits'] == 2 and stats['SimQueryCache']['entries'] == 2)
+        generation = stats['IndexGeneration']
+
+        # a posted series is stored as read, and searchable on the grid
+        times = np.linspace(0, 0.99, 80)
+        values = np.sin(7 * times)
+        np.savetxt(TEMP_DIR + "posted.txt", np.column_stack([times, values]))
+        status, ts = request(conn, "POST", "/timeseries", {'TSid': 'star-1', 'TSfilepath': TEMP_DIR + "posted.txt"})
+        assert(status == 200 and np.allclose(ts['Times'], times) and np.allclose(ts['Values'], values))
+        assert(request(conn, "POST", "/timeseries", {'TSid': 'star-1', 'TSfilepath': TEMP_DIR + "posted.txt"})[0] == 400)
+        assert(request(conn, "POST", "/timeseries", {'TSid': 'star-2', 'TSfilepath': TEMP_DIR + "missing.txt"})[0] == 400)
+
+        # a rejected add leaves the listing and the similarity results unchanged
+        listing = request(conn, "GET", "/timeseries")[1]
+        similar = request(conn, "POST", "/simquery", {'Times': times.tolist(), 'Values': values.tolist()})[1]
+        for ts_id in ["a/b", "..", "../escape", "star 2", ""]:
+            assert(request(conn, "POST", "/timeseries", {'TSid': ts_id, 'TSfilepath': TEMP_DIR + "posted.txt"})[0] == 400)
+        def failing_add(*args, **kwargs):
+            raise OSError("disk full")
+        restserver.add_light_curve, add_light_curve = failing_add, restserver.add_light_curve
+        try:
+            assert(request(conn, "POST", "/timeseries", {'TSid': 'star-3', 'TSfilepath': TEMP_DIR + "posted.txt"})[0] == 400)
+        finally:
+            restserver.add_light_curve = add_light_curve
+        assert('star-3' not in service.sm and not os.path.exists(service.sm_dir + "/ts_star-3.npy"))
+        assert(request(conn, "GET", "/timeseries")[1] == listing)
+        assert(request(conn, "POST", "/simquery", {'Times': times.tolist(), 'Values': values.tolist()})[1] == similar)
+        assert(len(service.index.store) == len(ts_dict) + 1)
+        status, ts = request(conn, "GET", "/timeseries/star-1")
+        assert(status == 200 and ts['TSfilepath'] == TEMP_DIR + "posted.txt" and len(ts['Values']) == 80)
+        assert(len(request(conn, "GET", "/timeseries")[1]) == len(ts_dict) + 1)
+        status, result = request(conn, "POST", "/simquery", {'Times': times.tolist(), 'Values': values.tolist()})
+        assert(result['SortedSimTS'][0] == 'star-1')
+
+        # the add bumped the index generation, which empties the result cache
+        status, stats = request(conn, "GET", "/stats")
+        assert(stats['IndexGeneration'] == generation + 1 and stats['SimQueryCache']['entries'] == 1)
+
+        # a body that cannot be framed is answered once and the connection closed, before the
+        # body bytes could be parsed as a second request
+        follow = b"GET /stats HTTP/1.1\r\nHost: x\r\n\r\n"
+        for head, status in [(b"Transfer-Encoding: chunked", 411), (b"Content-Length: -5", 400),
+                             (b"Content-Length: ten", 400)]:
+            reply = raw_request(port, b"POST /simquery HTTP/1.1\r\nHost: x\r\n" + head + b"\r\n\r\n"
+                                      + b"5\r\n{}{}{\r\n0\r\n\r\n" + follow)
+            assert(reply.startswith(b"HTTP/1.1 %d " % status) and reply.count(b"HTTP/1.1") == 1)
+            assert(b"Connection: close" in reply)
+    finally:
+        conn.close()
+        stop_server(rest_server, thread)
+
+    # a restarted service still knows the posted series
+    service.close()
+    restarted = restserver.TimeSeriesService(service.lc_dir, service.db_dir, service.sm_dir)
+    assert(len(restarted.metadata) == len(ts_dict) + 1 and np.allclose(restarted.get('star-1')['Values'], values))
+    records, cursor = restarted.list_metadata("mean_in=%r-%r" % (means["ts-3.txt"], means["ts-3.txt"]))
+    assert([m['TSid'] for m in records] == ["ts-3.txt"] and cursor is None)
+    restarted.close()
+    clear_dir(TEMP_DIR,recreate=False)
+
+def test_rest_server_processes():
+    service, ts_dict = build_test_service("rest_procs")
+    rest_server, thread, port = start_server(service, threads=False)
+    conns = [http.client.HTTPConnection("localhost", port) for i in range(4)]
+    try:
+        for conn in conns:
+            conn.request("GET", "/simquery/ts-5.txt")
+        results = [json.loads(conn.getresponse().read().decode('utf-8'))['SortedSimTS'] for conn in conns]
+        assert(all(result == results[0] and len(result) == 5 for result in results))
+
+        # workers reload the indexes after an add
+        times = np.arange(0.0, 1.0, 0.01)
+        np.savetxt(TEMP_DIR + "posted.txt", np.column_stack([times, np.cos(5 * times)]))
+        assert(request(conns[0], "POST", "/timeseries", {'TSid': 'star-1', 'TSfilepath': TEMP_DIR + "posted.txt"})[0] == 200)
+        for conn in conns:
+            status, result = request(conn, "POST", "/simquery", {'Times': times.tolist(), 'Values': np.cos(5 * times).tolist()})
+            assert(status == 200 and result['SortedSimTS'][0] == 'star-1')
+    finally:
+        for conn in conns:
+            conn.close()
+        stop_server(rest_server, thread)
+    clear_dir(TEMP_DIR,recreate=False)
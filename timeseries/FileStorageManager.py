@@ -14,13 +14,19 @@ class FileStorageManager(StorageManagerInterface):
     Parameters
     ----------
     filename: string (optional)
-        Name of pickle file to stores the id and length of each time series. 
-        Default is 'ts_index.pkl'.
+        Name of pickle file to stores the id and summary statistics of each
+        time series. Default is 'ts_index.pkl'.
         
     directory: string (optional)
         Path to directory to which index file and time series data files are
         to be stored. 
     
+    Notes
+    -----
+    - the summary statistics (count, mean, std, min, max and the time range)
+      are computed once by `store` and kept in the index, so `size` and
+      `stats` never read the data files
+    
     Examples
     --------
     >>> sm = FileStorageManager()
@@ -31,21 +37,23 @@ class FileStorageManager(StorageManagerInterface):
     ArrayTimeSeries[1.0, 1.5, 2.0, 2.5]
     >>> sm.size(1)
     4
+    >>> sm.stats(1)['mean']
+    1.75
     """
     
     
     def __init__(self, filename = 'ts_index.pkl', directory = './SM_TS_data'):
         """
         Constructor for FileStorageManager. Initializes FileStorageManager with 
-        a pointer to a filename that stores the id and length of each time series, 
+        a pointer to a filename that stores the id and summary statistics of each time series, 
         and to a directory containing the aforesaid file as well as data files
         of stored time series
           
         Parameters
         ----------
         filename: string (optional)
-            Name of pickle file to stores the id and length of each time series. 
-            Default is 'ts_index.pkl'.
+            Name of pickle file to stores the id and summary statistics of each
+            time series. Default is 'ts_index.pkl'.
         
         directory: string (optional)
             Path to directory to which index file and time series data files are
@@ -55,9 +63,9 @@ class FileStorageManager(StorageManagerInterface):
         if not os.path.exists(directory):
             os.makedirs(directory)
             
-        # Check if file storing id and length of each time series (index_file)
+        # Check if file storing id and statistics of each time series (index_file)
         # exists. If so, store its contents in a variable. If not, create a new
-        # dictionary to store (future) id - length mappings
+        # dictionary to store (future) id - statistics mappings
         try:
             with open(directory + '/' + filename, 'rb') as index_file:
                 self._index = pickle.load(index_file)
@@ -99,14 +107,64 @@ class FileStorageManager(StorageManagerInterface):
         # Store/Update the time series data into a .npy file indexed by the series' id
         np.save(self._directory + '/' + 'ts_' + str(id), t_64bit_arr)
         
-        # Store/Update the id - length mapping corresponding to the time series
-        self._index[str(id)] = len(t)
+        # Store/Update the id - summary statistics mapping corresponding to the
+        # time series
+        self._index[str(id)] = self._summarize(t_64bit_arr)
         
         # Update the index_file
         with open(self._directory + '/' + self._filename, 'wb') as index_file:
             pickle.dump(self._index, index_file, protocol=pickle.HIGHEST_PROTOCOL)
         
         return t
+
+
+    def remove(self, id):
+        """
+        Removes the time series in storage indexed by `id`
+
+        Parameters
+        ----------
+        id: int / string
+            id of the time series to remove
+
+        Notes
+        -----
+        WARNINGS:
+            If given `id` does not exist, then KeyError is raised
+        """
+
+        del self._index[str(id)]
+
+        # Update the index_file before deleting the data file, so the index
+        # never points at a missing file
+        with open(self._directory + '/' + self._filename, 'wb') as index_file:
+            pickle.dump(self._index, index_file, protocol=pickle.HIGHEST_PROTOCOL)
+
+        os.remove(self._directory + '/' + 'ts_' + str(id) + '.npy')
+
+
+    def __contains__(self, id):
+        """
+        Returns whether a time series is stored under `id`
+        
+        Parameters
+        ----------
+        id: int / string
+            id of the time series of interest
+        """
+        return str(id) in self._index
+        
+        
+    def ids(self):
+        """
+        Returns the ids (as strings) of all time series in storage
+        
+        Returns
+        -------
+        ids : list of strings
+            ids of the stored time series, in no particular order
+        """
+        return list(self._index)
         
         
     def size(self, id):
@@ -132,13 +190,71 @@ class FileStorageManager(StorageManagerInterface):
             If given `id` does not exist, then KeyError is raised
         """
 
-        # Check if `id` exists in our storage. If not, raise KeyError
-        if str(id) in self._index:
-            return self._index[str(id)]
+        return self._stats(id)['count']
         
-        else:
+        
+    def stats(self, id):
+        """
+        Returns the summary statistics of the time series in storage indexed
+        by `id`, without reading its data file
+        
+        Parameters
+        ----------
+        id: int / string
+            id of the time series of interest
+            
+        Returns
+        -------
+        s : dict
+            'count', 'mean', 'std', 'min' and 'max' of the values, and 'start'
+            and 'end' of the times (all None except 'count' for an empty
+            time series)
+            
+        Notes
+        -----
+        PRE:
+            `id` should exist in the storage manager
+        
+        WARNINGS:
+            If given `id` does not exist, then KeyError is raised
+        """
+        return dict(self._stats(id))
+        
+        
+    def _stats(self, id):
+        """
+        Returns the index entry of `id`. Indexes written before summary
+        statistics were stored only hold the length; such entries are
+        summarized from the data file once and written back.
+        """
+        # Check if `id` exists in our storage. If not, raise KeyError
+        if str(id) not in self._index:
             raise KeyError('Input ID does not exist on disk!')
         
+        entry = self._index[str(id)]
+        if not isinstance(entry, dict):
+            t = np.load(self._directory + '/' + 'ts_' + str(id) + '.npy')
+            entry = self._index[str(id)] = self._summarize(t)
+            with open(self._directory + '/' + self._filename, 'wb') as index_file:
+                pickle.dump(self._index, index_file, protocol=pickle.HIGHEST_PROTOCOL)
+        return entry
+        
+        
+    @staticmethod
+    def _summarize(t):
+        """
+        Summary statistics of a time series stored as a 2-d array of times
+        and values
+        """
+        times, values = t[0], t[1]
+        if len(values) == 0:
+            return {'count': 0, 'mean': None, 'std': None, 'min': None,
+                    'max': None, 'start': None, 'end': None}
+        return {'count': len(values), 'mean': float(np.mean(values)),
+                'std': float(np.std(values)), 'min': float(np.min(values)),
+                'max': float(np.max(values)), 'start': float(np.min(times)),
+                'end': float(np.max(times))}
+        
         
     def get(self, id):
         """
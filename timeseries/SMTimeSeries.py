@@ -3,7 +3,6 @@ from SizedContainerTimeSeriesInterface import SizedContainerTimeSeriesInterface
 from FileStorageManager import FSM_global
 from ArrayTimeSeries import ArrayTimeSeries
 import numbers
-import numpy as np
 
 class SMTimeSeries(SizedContainerTimeSeriesInterface):
     """
@@ -600,16 +599,14 @@ class SMTimeSeries(SizedContainerTimeSeriesInterface):
            a floating point number, which is the mean of the specified values of the timeseries 
         """
         
-        t = FSM_global.get(self._id)
-
+        # The mean of the whole series is kept in the storage manager's index,
+        # so only a chunk needs the data file
         if ( chunk == None ):  
-            val = t.values()
-            the_mean = np.mean(val)
+            the_mean = FSM_global.stats(self._id)['mean']
             
         else:
-            val = t.values()
-            intermediate = val[:chunk]
-            the_mean = np.mean(intermediate)
+            t = FSM_global.get(self._id)
+            the_mean = t.mean(chunk)
             
         return the_mean               
                 
@@ -634,15 +631,11 @@ class SMTimeSeries(SizedContainerTimeSeriesInterface):
            a floating point number, which is the standard deviation of the specified values of the timeseries 
         """
 
-        t = FSM_global.get(self._id)
-        
         if ( chunk == None ):
-            val = t.values()
-            the_std = np.std(val)
+            the_std = FSM_global.stats(self._id)['std']
 
         else:
-            val = t.values()
-            intermediate = val[:chunk]
-            the_std = np.std(intermediate)
+            t = FSM_global.get(self._id)
+            the_std = t.std(chunk)
 
         return the_std
\ No newline at end of file
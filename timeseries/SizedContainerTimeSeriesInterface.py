@@ -269,13 +269,13 @@ class SizedContainerTimeSeriesInterface(TimeSeriesInterface, abc.ABC):
 
         """
 
+        # Reads the stored values directly rather than through values(),
+        # which copies them
         if ( chunk == None ):  
-            val = self.values()
-            the_mean = np.mean(val)
+            the_mean = np.mean(self._value)
             
         else:
-            val = self.values()
-            intermediate = val[:chunk]
+            intermediate = self._value[:chunk]
             the_mean = np.mean(intermediate)
             
         return the_mean               
@@ -304,12 +304,10 @@ class SizedContainerTimeSeriesInterface(TimeSeriesInterface, abc.ABC):
         """
 
         if ( chunk == None ):
-            val = self.values()
-            the_std = np.std(val)
+            the_std = np.std(self._value)
 
         else:
-            val = self.values()
-            intermediate = val[:chunk]
+            intermediate = self._value[:chunk]
             the_std = np.std(intermediate)
 
         return the_std
@@ -15,6 +15,9 @@ class StorageManagerInterface(abc.ABC):
     
     get:
         Returns a time series instance by index
+
+    stats:
+        Returns the summary statistics of the time series in storage by index
     """
     
     @abc.abstractmethod
@@ -88,4 +91,22 @@ class StorageManagerInterface(abc.ABC):
         WARNINGS:
             If given `id` does not exist, then KeyError is raised
         """
-        
\ No newline at end of file
+        
+
+    @abc.abstractmethod
+    def stats(self, id):
+        """
+        Returns the summary statistics of the time series in storage indexed
+        by `id`, without reading its data
+
+        Parameters
+        ----------
+        id: int / string
+            id of the time series of interest
+
+        Returns
+        -------
+        s : dict
+            count, mean, std, min and max of the values, and start and end
+            of the times of the time series
+        """
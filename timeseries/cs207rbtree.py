@@ -799,14 +799,18 @@ class BinaryTree(object):
         if node is None:
             new_node = BinaryNode(
                 BinaryNodeRef(), key, value_ref, BinaryNodeRef())
+        # the sibling of each node on the path is copied too: balancing recolors
+        # uncles in place, and a node already on disk would keep its old color
         elif key < node.key:
             new_node = BinaryNode.from_node(
                 node,
                 left_ref=self._insert(
-                    self._follow(node.left_ref), key, value_ref))
+                    self._follow(node.left_ref), key, value_ref),
+                right_ref=self._copy_ref(node.right_ref))
         elif key > node.key:
             new_node = BinaryNode.from_node(
                 node,
+                left_ref=self._copy_ref(node.left_ref),
                 right_ref=self._insert(
                     self._follow(node.right_ref), key, value_ref))
         else: #create a new node to represent this data
@@ -815,6 +819,20 @@ class BinaryTree(object):
         # return the reference to the head node of the new tree
         return BinaryNodeRef(referent=new_node)
 
+    def _copy_ref(self, ref):
+        """
+        returns a reference to an unsaved copy of the node at `ref`, so changes
+        made to it while balancing are written out on the next commit
+        Parameters
+        ----------
+        ref : BinaryNodeRef
+            A reference to the node to copy
+        """
+        node = self._follow(ref)
+        if node is None:
+            return BinaryNodeRef()
+        return BinaryNodeRef(referent=BinaryNode.from_node(node))
+
 
 
     def delete(self, key):
@@ -873,6 +891,89 @@ class BinaryTree(object):
                 return node.right_ref
         return BinaryNodeRef(referent=new_node)
 
+    def bulk_load(self, items):
+        """
+        replaces the tree with a balanced red-black tree of the (key, value) pairs
+        in `items`, written bottom-up so every node is appended to storage exactly
+        once and the root is committed once. much faster than repeated set() calls
+        Parameters
+        ----------
+        items : iterable of (key, value) pairs
+            later pairs win when a key repeats, as with repeated set() calls
+        Notes
+        -----
+        - every level of the tree is full except possibly the deepest; its nodes
+          are red and all others black, so the red-black invariants hold
+        """
+        pairs = sorted(dict(items).items(), key=lambda pair: pair[0])
+        # depth of the deepest level, and whether that level is full
+        depth = len(pairs).bit_length() - 1
+        full = ((len(pairs) + 1) & len(pairs)) == 0
+        self._storage.lock()
+        root_address = self._write_balanced(pairs, 0, len(pairs), 0, depth, full)
+        self._storage.commit_root_address(root_address)
+        self._refresh_tree_ref()
+
+    def _write_balanced(self, pairs, lo, hi, level, depth, full):
+        """
+        writes the balanced subtree for pairs[lo:hi] to storage and returns its address
+        Parameters
+        ----------
+        pairs : list
+            sorted (key, value) pairs
+        lo, hi : int
+            bounds of the slice of `pairs` in this subtree
+        level : int
+            depth of the subtree's root
+        depth, full : int, bool
+            depth of the deepest level of the whole tree, and whether it is full
+        """
+        if lo >= hi:
+            return 0
+        mid = (lo + hi) // 2
+        left_address = self._write_balanced(pairs, lo, mid, level + 1, depth, full)
+        right_address = self._write_balanced(pairs, mid + 1, hi, level + 1, depth, full)
+        key, value = pairs[mid]
+        color = Color.RED if level == depth and not full else Color.BLACK
+        node_ref = BinaryNodeRef(referent=BinaryNode(
+            BinaryNodeRef(address=left_address),
+            key,
+            ValueRef(value),
+            BinaryNodeRef(address=right_address),
+            color))
+        # stores the value and then the node itself; children are already on disk
+        node_ref.store(self._storage)
+        return node_ref.address
+
+    def range(self, lo, hi):
+        """
+        yields the (key, value) pairs with `lo` <= key <= `hi`, in key order.
+        only descends into subtrees that can hold keys in range, so the cost is
+        the depth of the tree plus the number of matches
+        Parameters
+        ----------
+        lo : int, float, or str
+            The smallest key to yield
+        hi : int, float, or str
+            The largest key to yield
+        """
+        #if tree is not locked by another writer
+        #refresh the references and get new tree if needed
+        if not self._storage.locked:
+            self._refresh_tree_ref()
+        #iterative in-order traversal, skipping subtrees outside the range
+        stack = []
+        node = self._follow(self._tree_ref)
+        while stack or node is not None:
+            if node is not None:
+                stack.append(node)
+                node = self._follow(node.left_ref) if lo < node.key else None
+            else:
+                node = stack.pop()
+                if lo <= node.key <= hi:
+                    yield (node.key, self._follow(node.value_ref))
+                node = self._follow(node.right_ref) if node.key < hi else None
+
     def _follow(self, ref):
         """
         gets a node from the reference given by `ref`
@@ -1158,16 +1259,7 @@ class DBDB(object):
             The key component in a key value pair
         """
         self._assert_not_closed()
-        result = self._tree.get(key)
-
-
-        try:
-            return int(result)
-        except ValueError:
-            try:
-                return float(result)
-            except ValueError:
-                return result
+        return _convert(self._tree.get(key))
 
 
     def set(self, key, value):
@@ -1209,6 +1301,52 @@ class DBDB(object):
 
 
 
+    def bulk_load(self, items):
+        """
+        replaces the database contents with the (key, value) pairs in `items`,
+        written as a balanced red-black tree and committed once
+        calls BinaryTree bulk_load()
+        Parameters
+        ----------
+        items : iterable of (key, value) pairs
+            keys and values must be int, float, or str
+        """
+        items = list(items)
+        for key, value in items:
+            if type(key) not in [int,float,str]:
+                raise TypeError('Precondition violated: key must be int, float, or str')
+            if type(value) not in [int,float,str]:
+                raise TypeError('Precondition violated: value must be int, float, or str')
+        self._assert_not_closed()
+        self._tree.bulk_load(items)
+
+    def range(self, lo, hi):
+        """
+        yields the (key, value) pairs with `lo` <= key <= `hi`, in key order.
+        calls BinaryTree range(); values are converted like get()
+        Parameters
+        ----------
+        lo : int, float, or str
+            The smallest key to yield
+        hi : int, float, or str
+            The largest key to yield
+        """
+        self._assert_not_closed()
+        for key, result in self._tree.range(lo, hi):
+            yield (key, _convert(result))
+
+
+
+def _convert(result):
+    """converts a stored value string back to an int or a float if possible"""
+    try:
+        return int(result)
+    except ValueError:
+        try:
+            return float(result)
+        except ValueError:
+            return result
+
 def connect(dbname):
     """"
     Opens an existing database file, creating a new one if it 
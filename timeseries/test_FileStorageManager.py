@@ -63,6 +63,12 @@ def test_overwrite():
     t1_new_from_disk = storage_manager.get('1')
     assert((t1_new_from_disk == t1_new))
         
+# membership
+def test_contains():
+    assert(1 in storage_manager and '1' in storage_manager)
+    assert('7' not in storage_manager)
+    assert(sorted(storage_manager.ids()) == ['1', '2', '3', '4', '5', '6'])
+
 # size
 # valid id's represented as strings
 def test_size_valid_str():
@@ -86,6 +92,51 @@ def test_size_valid_int():
 def test_size_invalid_id():
     with raises(KeyError):
         x = storage_manager.size('7')
+
+# remove
+def test_remove():
+    storage_manager.store('removed', ArrayTimeSeries([1, 2], [3, 4]))
+    storage_manager.remove('removed')
+    assert('removed' not in storage_manager and 'removed' not in storage_manager.ids())
+    assert(not os.path.exists('./SM_TS_data/ts_removed.npy'))
+    with raises(KeyError):
+        storage_manager.get('removed')
+    with raises(KeyError):
+        storage_manager.remove('removed')
+
+# stats
+def test_stats():
+    stats = storage_manager.stats('3')
+    assert(stats['count'] == 4 and stats['mean'] == 1.25)
+    assert(stats['std'] == np.std([-5, 3, 1, 6]))
+    assert(stats['min'] == -5 and stats['max'] == 6)
+    assert(stats['start'] == 0 and stats['end'] == 6)
+    
+    # overwritten series get new statistics
+    assert(storage_manager.stats(1)['mean'] == 207)
+    
+    # statistics are read from the index, not the data file
+    os.remove('./SM_TS_data/ts_3.npy')
+    assert(FileStorageManager().stats(3) == stats)
+    storage_manager.store(3, ArrayTimeSeries([0, 1, 5, 6], [-5, 3, 1, 6]))
+    
+def test_stats_empty():
+    storage_manager.store('empty', ArrayTimeSeries([], []))
+    assert(storage_manager.stats('empty')['count'] == 0)
+    assert(storage_manager.stats('empty')['mean'] is None)
+    
+def test_stats_invalid_id():
+    with raises(KeyError):
+        x = storage_manager.stats('7')
+        
+# indexes written before statistics were stored only hold lengths
+def test_stats_length_index():
+    sm = FileStorageManager(filename = 'old_index.pkl')
+    sm.store('old', ArrayTimeSeries([1, 2], [3, 5]))
+    sm._index['old'] = 2
+    assert(sm.size('old') == 2)
+    assert(sm.stats('old')['mean'] == 4)
+    assert(FileStorageManager(filename = 'old_index.pkl')._index['old']['max'] == 5)
             
 # _autogenerate_id
     
@@ -373,6 +373,13 @@ def test_mean_larger():
     assert(t.mean() == 9.5)
        
 
+# test mean after changing a value
+def test_mean_after_setitem():
+    t = SMTimeSeries(range(4), [1, 2, 3, 4])
+    t[3] = 8
+    assert(t.mean() == 3.5)
+    assert(t.std() == np.std([1, 2, 3, 8]))
+
 # test mean for some chunk input
 def test_mean_chunk():
     t = SMTimeSeries(range(20), range(20))
@@ -328,6 +328,104 @@ class TestCS207RBT(unittest.TestCase):
 		db.close()
 		os.remove("/tmp/test.dbdb")
 
+	def test_set_after_commit(self):
+		# balancing recolors nodes that are already on disk; the colors must survive a reload
+		db = connect("/tmp/test.dbdb")
+		keys = [(i * 37) % 101 for i in range(60)]
+		for i, key in enumerate(keys):
+			db.set(key, key)
+			db.commit()
+			if i % 5 == 0:
+				db.close()
+				db = connect("/tmp/test.dbdb")
+		self.assertEqual([key for key, value in db.range(0, 101)], sorted(keys))
+		for key in keys:
+			self.assertEqual(db.get(key), key)
+
+		db.close()
+		os.remove("/tmp/test.dbdb")
+
+	def test_insert_recolors_committed_nodes(self):
+		# regression: balancing recolored uncle nodes in place, and an uncle already on disk
+		# was never rewritten, so after a reload its old color broke the tree and keys went missing
+		def black_height(tree, node):
+			if node is None:
+				return 1
+			left = tree._follow(node.left_ref)
+			right = tree._follow(node.right_ref)
+			if node.is_red():
+				self.assertFalse(left is not None and left.is_red())
+				self.assertFalse(right is not None and right.is_red())
+			height = black_height(tree, left)
+			self.assertEqual(height, black_height(tree, right))
+			return height + (1 if node.is_black() else 0)
+
+		db = connect("/tmp/test.dbdb")
+		# 1 is committed as a red leaf; inserting 4 under 3 makes 1 its uncle and recolors it black
+		for key in [2, 1, 3, 4]:
+			db.set(key, key)
+			db.commit()
+			db.close()
+			db = connect("/tmp/test.dbdb")
+			black_height(db._tree, db._tree._follow(db._tree._tree_ref))
+		for key in [1, 2, 3, 4]:
+			self.assertEqual(db.get(key), key)
+
+		db.close()
+		os.remove("/tmp/test.dbdb")
+
+	def test_range(self):
+		db = connect("/tmp/test.dbdb")
+		for key in [5.5, 1.0, 9.25, -3.0, 7.0, 2.5, 8.0, 0.0]:
+			db.set(key, str(key * 2))
+		db.commit()
+		db.close()
+		db = connect("/tmp/test.dbdb")
+
+		self.assertEqual(list(db.range(0.0, 7.0)), [(0.0, 0), (1.0, 2), (2.5, 5), (5.5, 11), (7.0, 14)])
+		self.assertEqual([key for key, value in db.range(-10, 10)], [-3.0, 0.0, 1.0, 2.5, 5.5, 7.0, 8.0, 9.25])
+		self.assertEqual(list(db.range(3.0, 5.0)), [])
+		self.assertEqual(list(db.range(9.25, 9.25)), [(9.25, 18.5)])
+
+		db.close()
+		os.remove("/tmp/test.dbdb")
+
+	def test_bulk_load(self):
+		def black_height(tree, node):
+			# checks the red-black invariants below node and returns its black height
+			if node is None:
+				return 1
+			left = tree._follow(node.left_ref)
+			right = tree._follow(node.right_ref)
+			if node.is_red():
+				self.assertFalse(left is not None and left.is_red())
+				self.assertFalse(right is not None and right.is_red())
+			height = black_height(tree, left)
+			self.assertEqual(height, black_height(tree, right))
+			return height + (1 if node.is_black() else 0)
+
+		for n in [1, 2, 7, 8, 100]:
+			db = connect("/tmp/test.dbdb")
+			db.set(-1, 'replaced')
+			db.commit()
+			db.bulk_load([(float(i), 'v%d' % i) for i in reversed(range(n))] + [(0.0, 'zero')])
+			db.close()
+			db = connect("/tmp/test.dbdb")
+
+			self.assertEqual(db.get(0.0), 'zero')
+			self.assertEqual(db.get(float(n - 1)), 'v%d' % (n - 1) if n > 1 else 'zero')
+			self.assertRaises(KeyError, db.get, -1)
+			self.assertEqual([key for key, value in db.range(0, n)], [float(i) for i in range(n)])
+			black_height(db._tree, db._tree._follow(db._tree._tree_ref))
+
+			# the loaded tree can still be updated
+			db.set(n + 0.5, 'new')
+			db.commit()
+			self.assertEqual(db.get(n + 0.5), 'new')
+			black_height(db._tree, db._tree._follow(db._tree._tree_ref))
+			db.close()
+			os.remove("/tmp/test.dbdb")
+
 
 if __name__ == '__main__':
 	unittest.main()
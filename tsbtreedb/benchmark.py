@@ -0,0 +1,273 @@
+#!/usr/local/bin/python3
+# -*- coding: utf-8 -*-
+#
+# CS207 Group Project Part 7
+# Created by Team 2 (Jonne Seleva, Nathaniel Burbank, Nicholas Ruta, Rohan Thavarajah) for Team 4
+
+import sys
+import os
+import json
+import time
+import random
+import shutil
+import platform
+import numpy as np
+
+from makelcs import make_lc_files, tsmaker, random_ts
+from genvpdbs import create_vpdbs
+from ingest import add_light_curve
+from crosscorr import standardize, standardize_values, kernel_dist_many
+from lcstore import load_self_kernels, CurveStore
+from simsearch import list_vps, find_closest_vp, search_vpdb, knn_search, approx_search, brute_force_search
+from simsearch import open_spectra, open_vp_matrix, open_vp_tree, lc_cache
+from settings import LIGHT_CURVES_DIR, DB_DIR, BENCH_DIR, BENCH_SEED
+
+HELP_MESSAGE = \
+"""
+Similarity Search Benchmark
+
+Generates seeded collections of simulated light curves, builds their indexes and measures build
+time, index size, query latency (p50/p99) and throughput of every search mode, checking recall
+against brute-force kernel distances, and the latency of adding each query to the collection
+with ingest. Results are written as JSON.
+
+Usage: ./benchmark  [optional flags]
+
+Optional flags:
+  -h, --help          Show this help message and exit.
+  --sizes N,N,...     Collection sizes to benchmark; accepts k and M suffixes (Defaults to 1k,10k)
+  --queries N         Queries per collection (Defaults to 100)
+  -k N                Neighbours per query for the knn, tree, approx and brute modes (Defaults to 5)
+  --budget N          Candidate budget for the approx mode (Defaults to 200)
+  --vps N             Number of vantage points (Defaults to 20)
+  -w, --workers N     Worker processes for the index builds (Defaults to every core)
+  --seed N            Random seed for the light curves and queries (Defaults to 207)
+  -o, --out PATH      Write the results to PATH (Defaults to benchmark.json)
+  --baseline PATH     Compare p50 latencies with an earlier results file
+  --tolerance X       Latency ratio to the baseline counted as a regression (Defaults to 1.5)
+  --min-recall R      Recall below which an exact search mode counts as a regression (Defaults to 1.0)
+  --keep              Keep the generated collections in benchmarks/ afterwards
+"""
+
+# Search modes whose results should match brute force exactly
+EXACT_MODES = ['vpdb', 'knn', 'tree', 'brute']
+
+def seed_all(seed):
+    """Seeds both random number generators used by makelcs and vantage point selection"""
+    random.seed(seed)
+    np.random.seed(seed)
+
+def parse_size(size):
+    """Parses a collection size such as 1000, 10k or 1M"""
+    size = size.strip().lower()
+    multiplier = {'k': 1000, 'm': 1000000}.get(size[-1:], 1)
+    return int(float(size.rstrip('km')) * multiplier)
+
+def dir_size(path):
+    """Total size in bytes of the files under path"""
+    return sum(os.path.getsize(os.path.join(root, file))
+               for root, dirs, files in os.walk(path) for file in files)
+
+def make_queries(n, seed):
+    """Generates n seeded query light curves, half from each makelcs generator"""
+    seed_all(seed)
+    queries = [tsmaker(np.random.uniform(0, 1), np.random.exponential(0.3) + 0.01, np.random.exponential(0.2))
+               for i in range(n - n // 2)]
+    return queries + [random_ts(np.random.uniform(0, 10)) for i in range(n // 2)]
+
+def brute_force(ts, curves, k, chunk=10000):
+    """Exact k nearest light curves of ts by kernel distance to every curve in a CurveStore"""
+    s_ts = standardize(ts)
+    ids = curves.ids
+    dists = np.concatenate([kernel_dist_many(s_ts, standardize_values(curves.values_many(ids[i:i + chunk])))
+                            for i in range(0, len(ids), chunk)])
+    nearest = np.argsort(dists, kind='stable')[:k]
+    return [(float(dists[i]), ids[i]) for i in nearest]
+
+def recall(found, truth):
+    """Fraction of the true nearest light curves that were found"""
+    return len(set(found) & set(truth)) / float(len(truth))
+
+def latency_stats(latencies):
+    """Summary of per-query latencies in seconds"""
+    latencies = np.asarray(latencies)
+    return {'p50_ms': 1000 * float(np.percentile(latencies, 50)),
+            'p99_ms': 1000 * float(np.percentile(latencies, 99)),
+            'mean_ms': 1000 * float(latencies.mean()),
+            'qps': len(latencies) / float(latencies.sum())}
+
+def run_size(num_lcs, queries, k=5, budget=200, vps=20, workers=None, seed=BENCH_SEED, work_dir=BENCH_DIR):
+    """
+    Builds a seeded collection of num_lcs light curves in work_dir and benchmarks every search mode on it,
+    then times adding each query to the collection (which should not grow with num_lcs).
+
+    Args:
+        num_lcs: number of light curves to generate
+        queries: list of query time series
+        k: neighbours per query for the knn, tree, approx and brute modes
+        budget: candidate budget for the approx mode
+        vps: number of vantage points
+        workers: worker processes for the index build (Defaults to every core)
+        seed: random seed for the light curves and vantage points
+        work_dir: directory the collection is built in (its light_curves/ and vp_dbs/ are replaced)
+    Returns:
+        Dict of build and query measurements
+    """
+    os.makedirs(work_dir, exist_ok=True)
+    cwd = os.getcwd()
+    # The search functions read the default light curve and DB directories, relative to the working directory
+    os.chdir(work_dir)
+    try:
+        seed_all(seed)
+        start = time.perf_counter()
+        make_lc_files(num_lcs, LIGHT_CURVES_DIR)
+        generate_time = time.perf_counter() - start
+        start = time.perf_counter()
+        create_vpdbs(vps, LIGHT_CURVES_DIR, workers=workers)
+        build_time = time.perf_counter() - start
+
+        lc_cache.clear()
+        self_kernels = load_self_kernels(LIGHT_CURVES_DIR)
+        store = open_spectra()
+        vp_matrix = open_vp_matrix()
+        tree = open_vp_tree(store)
+        vp_fns = list_vps()
+        curves = CurveStore(LIGHT_CURVES_DIR)
+        truth = [[fn for d, fn in brute_force(q, curves, k)] for q in queries]
+
+        modes = {
+            'vpdb': (lambda q: [search_vpdb(find_closest_vp(vp_fns, q, self_kernels, store), q, self_kernels, store)[1]], 1),
+            'knn': (lambda q: [fn for d, fn in knn_search(q, k, self_kernels, store, vp_matrix)], k),
+            'tree': (lambda q: [fn for d, fn in tree.knn(q, k, store, self_kernels)], k),
+            'approx': (lambda q: [fn for d, fn in approx_search(q, k, budget, self_kernels, store, vp_matrix)[0]], k),
+            'brute': (lambda q: [fn for d, fn in brute_force_search(q, k, self_kernels, store)], k),
+        }
+        result = {'num_lcs': len(curves), 'generate_time_s': generate_time, 'build_time_s': build_time,
+                  'index_bytes': dir_size(DB_DIR), 'store_bytes': dir_size(LIGHT_CURVES_DIR), 'modes': {}}
+        for mode, (search, n) in sorted(modes.items()):
+            latencies = []
+            recalls = []
+            for q, true_fns in zip(queries, truth):
+                start = time.perf_counter()
+                found = search(q)
+                latencies.append(time.perf_counter() - start)
+                recalls.append(recall(found, true_fns[:n]))
+            result['modes'][mode] = dict(latency_stats(latencies), recall=float(np.mean(recalls)),
+                                         min_recall=float(np.min(recalls)))
+
+        latencies = []
+        for q in queries:
+            start = time.perf_counter()
+            add_light_curve(q, LIGHT_CURVES_DIR, DB_DIR)
+            latencies.append(time.perf_counter() - start)
+        result['ingest'] = latency_stats(latencies)
+        return result
+    finally:
+        os.chdir(cwd)
+
+def find_regressions(results, baseline=None, tolerance=1.5, min_recall=1.0):
+    """
+    Lists regressions in a results dict: exact search modes with recall below min_recall, and
+    modes (or ingest) whose p50 latency grew by more than tolerance times the same size in a
+    baseline results dict
+    """
+    regressions = []
+    base = {}
+    if baseline is not None:
+        base = {(r['num_lcs'], mode): m for r in baseline['results'] for mode, m in timed_modes(r).items()}
+    for r in results['results']:
+        for mode, m in sorted(timed_modes(r).items()):
+            if mode in EXACT_MODES and m['recall'] < min_recall:
+                regressions.append("%d curves, %s: recall %.4f < %.4f" % (r['num_lcs'], mode, m['recall'], min_recall))
+            old = base.get((r['num_lcs'], mode))
+            if old is not None and m['p50_ms'] > tolerance * old['p50_ms']:
+                regressions.append("%d curves, %s: p50 %.3f ms vs %.3f ms in the baseline"
+                                   % (r['num_lcs'], mode, m['p50_ms'], old['p50_ms']))
+    return regressions
+
+def timed_modes(result):
+    """Latency measurements of a run_size result keyed by name: the search modes, and ingest"""
+    modes = dict(result['modes'])
+    if 'ingest' in result:
+        modes['ingest'] = result['ingest']
+    return modes
+
+def run_benchmark(sizes, num_queries=100, k=5, budget=200, vps=20, workers=None, seed=BENCH_SEED, work_dir=BENCH_DIR):
+    """Runs run_size for every collection size with the same queries; returns the results dict"""
+    queries = make_queries(num_queries, seed + 1)
+    config = {'sizes': sizes, 'queries': num_queries, 'k': k, 'budget': budget, 'vps': vps,
+              'workers': workers, 'seed': seed}
+    environment = {'python': platform.python_version(), 'numpy': np.__version__,
+                   'platform': platform.platform(), 'cpus': os.cpu_count()}
+    results = []
+    for num_lcs in sizes:
+        print("\n== %d light curves ==" % num_lcs)
+        results.append(run_size(num_lcs, queries, k, budget, vps, workers, seed, work_dir))
+    return {'config': config, 'environment': environment, 'results': results}
+
+def print_results(results):
+    """Prints a results dict as a table"""
+    print("\n%9s %8s %10s %10s  %-6s %9s %9s %9s %7s" %
+          ("curves", "build s", "index MB", "store MB", "mode", "p50 ms", "p99 ms", "QPS", "recall"))
+    for r in results['results']:
+        for mode, m in sorted(timed_modes(r).items()):
+            print("%9d %8.2f %10.2f %10.2f  %-6s %9.3f %9.3f %9.1f %7s" %
+                  (r['num_lcs'], r['build_time_s'], r['index_bytes'] / 1e6, r['store_bytes'] / 1e6,
+                   mode, m['p50_ms'], m['p99_ms'], m['qps'], "%.4f" % m['recall'] if 'recall' in m else "-"))
+
+if __name__ == "__main__":
+    """Command line interface: runs the benchmark and writes the results."""
+    need_help = False
+    sizes = [1000, 10000]
+    num_queries = 100
+    k = 5
+    budget = 200
+    vps = 20
+    workers = None
+    seed = BENCH_SEED
+    out_path = "benchmark.json"
+    baseline_path = None
+    tolerance = 1.5
+    min_recall = 1.0
+    keep = False
+
+    # First, identify which flags were included
+    args = sys.argv[1:]
+    for i, arg in enumerate(args):
+        if arg.lower() in ['-h','--help', 'help']: need_help = True
+        elif arg.lower() == '--sizes' and i + 1 < len(args): sizes = [parse_size(size) for size in args[i + 1].split(',')]
+        elif arg.lower() == '--queries' and i + 1 < len(args): num_queries = int(args[i + 1])
+        elif arg.lower() == '-k' and i + 1 < len(args): k = int(args[i + 1])
+        elif arg.lower() == '--budget' and i + 1 < len(args): budget = int(args[i + 1])
+        elif arg.lower() == '--vps' and i + 1 < len(args): vps = int(args[i + 1])
+        elif arg.lower() in ['-w','--workers'] and i + 1 < len(args): workers = int(args[i + 1])
+        elif arg.lower() == '--seed' and i + 1 < len(args): seed = int(args[i + 1])
+        elif arg.lower() in ['-o','--out'] and i + 1 < len(args): out_path = args[i + 1]
+        elif arg.lower() == '--baseline' and i + 1 < len(args): baseline_path = args[i + 1]
+        elif arg.lower() == '--tolerance' and i + 1 < len(args): tolerance = float(args[i + 1])
+        elif arg.lower() == '--min-recall' and i + 1 < len(args): min_recall = float(args[i + 1])
+        elif arg.lower() == '--keep': keep = True
+
+    while(True):
+        if need_help:
+            print (HELP_MESSAGE)
+            break
+        try:
+            results = run_benchmark(sizes, num_queries, k, budget, vps, workers, seed)
+        finally:
+            if not keep:
+                shutil.rmtree(BENCH_DIR, ignore_errors=True)
+        print_results(results)
+        with open(out_path, 'w') as f:
+            json.dump(results, f, indent=2)
+        print("\nResults written to %s" % out_path)
+
+        baseline = None
+        if baseline_path is not None:
+            with open(baseline_path) as f:
+                baseline = json.load(f)
+        regressions = find_regressions(results, baseline, tolerance, min_recall)
+        if regressions:
+            print("\nRegressions:\n  " + "\n  ".join(regressions))
+            sys.exit(1)
+        break
@@ -0,0 +1,115 @@
+#!/usr/local/bin/python3
+# -*- coding: utf-8 -*-
+#
+# CS207 Group Project Part 7
+# Created by Team 2 (Jonne Seleva, Nathaniel Burbank, Nicholas Ruta, Rohan Thavarajah) for Team 4
+
+# Size-bounded least recently used cache, used to keep hot light curves in memory between queries,
+# and the index generation counter that tells long-lived processes (and their cached search
+# results) when the indexes on disk have changed
+
+import os
+import sys
+import threading
+from collections import OrderedDict
+
+from settings import DB_DIR, INDEX_GENERATION_FILE
+
+class LRUCache(object):
+    """
+    Least recently used cache bounded by the total size of its values in bytes.
+
+    Args:
+        max_bytes: total size of the cached values; the least recently used entries are evicted
+            to stay under it. A value larger than max_bytes on its own is never cached.
+        sizeof: function returning the size of a value in bytes (Defaults to sys.getsizeof)
+    """
+
+    def __init__(self, max_bytes, sizeof=sys.getsizeof):
+        self.max_bytes = max_bytes
+        self._sizeof = sizeof
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key, default=None):
+        "value cached for key (marking it as most recently used), or default"
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        "cache value under key, evicting least recently used entries to make room"
+        size = self._sizeof(value)
+        with self._lock:
+            if key in self._entries:
+                self.bytes -= self._entries.pop(key)[1]
+            if size > self.max_bytes:
+                return
+            while self.bytes + size > self.max_bytes:
+                old_key, (old_value, old_size) = self._entries.popitem(last=False)
+                self.bytes -= old_size
+                self.evictions += 1
+            self._entries[key] = (value, size)
+            self.bytes += size
+
+    def get_or_load(self, key, load):
+        "cached value for key, calling load(key) and caching the result on a miss"
+        value = self.get(key)
+        if value is None:
+            value = load(key)
+            self.put(key, value)
+        return value
+
+    def clear(self):
+        "drop every entry (the counters are kept)"
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        "hit/miss/eviction counters and current size"
+        lookups = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'entries': len(self._entries), 'bytes': self.bytes, 'max_bytes': self.max_bytes,
+                'hit_rate': float(self.hits) / lookups if lookups else 0.0}
+
+def index_generation(db_dir=DB_DIR):
+    """Generation of the indexes in db_dir: bumped every time they change (0 if never bumped)"""
+    try:
+        with open(db_dir + INDEX_GENERATION_FILE) as f:
+            return int(f.read())
+    except (OSError, ValueError):
+        return 0
+
+def bump_index_generation(db_dir=DB_DIR, previous=None):
+    """
+    Records that the indexes in db_dir have changed.
+
+    Args:
+        db_dir: vantage point DB directory
+        previous: generation before the change (Defaults to the current one); pass it when the
+            directory was cleared in between, so the count never goes back
+    Returns:
+        The new generation
+    """
+    generation = (index_generation(db_dir) if previous is None else previous) + 1
+    # written to a temporary file and renamed, so readers never see a partial number
+    with open(db_dir + INDEX_GENERATION_FILE + ".tmp", 'w') as f:
+        f.write("%d\n" % generation)
+    os.replace(db_dir + INDEX_GENERATION_FILE + ".tmp", db_dir + INDEX_GENERATION_FILE)
+    return generation
@@ -13,6 +13,17 @@ def standardize(ts):
     stand_vals = (ts.values() - ts.mean())/ts.std()
     return ats.ArrayTimeSeries(times=ts.times(), values=stand_vals)
 
+def standardize_values(values):
+    """standardize every row of an (N x L) array of values by its own mean and std deviation"""
+    values = np.atleast_2d(np.asarray(values, dtype=np.float64))
+    return (values - values.mean(axis=1, keepdims=True)) / values.std(axis=1, keepdims=True)
+
+def _as_values(ts):
+    """Helper to accept either a time series object or a plain array of values"""
+    if hasattr(ts, 'values') and callable(ts.values):
+        return np.asarray(ts.values(), dtype=np.float64)
+    return np.asarray(ts, dtype=np.float64)
+
 def ccor(ts1, ts2):
     """
     given two standardized time series, compute their cross-correlation using FFT
@@ -52,7 +63,21 @@ def max_corr_at_phase(ts1, ts2):
     maxcorr = ccorts[idx]
     return idx, maxcorr
 
-def kernel_corr(ts1, ts2, mult=1):
+def self_kernel(ts, mult=1):
+    """
+    Computes the self-normalization term K(x,x) = sum(e^(m*ccor(x,x))) of a standardized time series.
+
+    This never changes for a stored curve, so it can be computed once and passed back
+    into kernel_corr / kernel_dist / kernel_dist_many instead of being recomputed.
+    """
+    return np.sum(np.exp(mult * ccor(ts, ts)))
+
+def self_kernels_many(values, mult=1):
+    """Computes K(x,x) for every row of an (N x L) array of standardized values"""
+    values = np.atleast_2d(np.asarray(values, dtype=np.float64))
+    return self_kernels_spectra(nfft.rfft(values, axis=1), values.shape[1], mult)
+
+def kernel_corr(ts1, ts2, mult=1, k11=None, k22=None):
     """
     Compute a kernelized correlation between two time series objects to be used as distance measure
 
@@ -60,6 +85,8 @@ def kernel_corr(ts1, ts2, mult=1):
         ts1: first time series object. (Must be standardized.)
         ts2: second time series object. (Must be standardized.)
         m: multiplier factor. Defaults to 1. (Must be non-negative.)
+        k11: optional precomputed self_kernel(ts1, mult). Computed if not given.
+        k22: optional precomputed self_kernel(ts2, mult). Computed if not given.
 
     Returns:
         Float - kernelized correlation value
@@ -76,8 +103,11 @@ def kernel_corr(ts1, ts2, mult=1):
 
     # Calculate kernel normalization constant:
     # sqrt(K(x,x)K(y,y))
-    k_norm = np.sqrt(np.sum(np.exp(mult * ccor(ts1, ts1))) *
-                     np.sum(np.exp(mult * ccor(ts2, ts2))))
+    if k11 is None:
+        k11 = self_kernel(ts1, mult)
+    if k22 is None:
+        k22 = self_kernel(ts2, mult)
+    k_norm = np.sqrt(k11 * k22)
 
     # return normalized kernel if k_norm is non-zero
     if k_norm != 0:
@@ -85,7 +115,7 @@ def kernel_corr(ts1, ts2, mult=1):
     else:
         return 0
 
-def kernel_dist(ts1, ts2, mult=1):
+def kernel_dist(ts1, ts2, mult=1, k11=None, k22=None):
     """
     Calculates a cross-correlation based distance between two time series objects.
 
@@ -93,6 +123,7 @@ def kernel_dist(ts1, ts2, mult=1):
         ts1: 1st time series object. (Must be standardized)
         ts2: 2nd time series object. (Must be standardized)
         m: multiplier factor. Defaults to 1. (Must be non-negative.)
+        k11, k22: optional precomputed self-normalization terms (see self_kernel)
 
     Returns:
         Float: distance value
@@ -103,12 +134,136 @@ def kernel_dist(ts1, ts2, mult=1):
         raise ValueError("time series must be standardized before calculating kernel distance")
 
     # Calculate the kernel correlation value for ts1 and ts2
-    kernel_corr_val = kernel_corr(ts1,ts2, mult)
+    kernel_corr_val = kernel_corr(ts1,ts2, mult, k11, k22)
 
     # Theorem 1-P4 in Pavlos paper states that the dist^2 = C(ts1,ts1)+C(ts2,ts2)-2C(ts1,ts2)
     # (Where C = kernel correlation )
     # However, we are using normalized kernels here, so the dist^2 will be 2(1-C(ts1,ts2))
-    return np.sqrt(2*(1-kernel_corr_val))
+    return _corr_to_dist(kernel_corr_val)
+
+def kernel_dist_many(ts, candidates, mult=1, ts_self=None, cand_self=None):
+    """
+    Calculates the kernel distance between one time series and every row of a candidate matrix.
+
+    Equivalent to [kernel_dist(ts, c, mult) for c in candidates], but does one rfft of the
+    candidate matrix and a handful of vectorized inverse transforms instead of three full
+    complex FFTs per pair.
+
+    Args:
+        ts: standardized query time series (time series object or 1-d array of values)
+        candidates: (N x L) array of standardized candidate values, one candidate per row
+        mult: multiplier factor. Defaults to 1. (Must be non-negative.)
+        ts_self: optional precomputed self_kernel(ts, mult)
+        cand_self: optional array of precomputed self-normalization terms, one per candidate.
+            Passing these skips a third of the inverse FFT work.
+
+    Returns:
+        Numpy array of N distance values
+    """
+    x = _as_values(ts)
+    candidates = np.atleast_2d(np.asarray(candidates, dtype=np.float64))
+    n = len(x)
+    if candidates.shape[1] != n:
+        raise ValueError("candidates must be the same length as ts to calculate kernel distance")
+
+    return kernel_dist_spectra(nfft.rfft(x), nfft.rfft(candidates, axis=1), n, mult, ts_self, cand_self)
+
+def spectrum(ts):
+    """
+    Real FFT of a standardized time series (or of every row of an (N x L) array of standardized values).
+    These are the only FFTs kernel_dist_spectra needs, so they can be computed once and stored.
+    """
+    values = _as_values(ts)
+    return nfft.rfft(values, axis=-1)
+
+def kernel_dist_spectra(X, Y, n, mult=1, ts_self=None, cand_self=None):
+    """
+    Calculates kernel distances from precomputed spectra: one multiply plus one inverse FFT per candidate.
+
+    Args:
+        X: spectrum of the standardized query (see spectrum)
+        Y: (N x L//2+1) array of spectra of standardized candidates, one per row
+        n: length of the original time series
+        mult: multiplier factor. Defaults to 1. (Must be non-negative.)
+        ts_self: optional precomputed self_kernel of the query
+        cand_self: optional array of precomputed self-normalization terms, one per candidate
+
+    Returns:
+        Numpy array of N distance values
+
+    Raises:
+        ValueError: if the spectra are not of standardized time series of length n
+    """
+    Y = np.atleast_2d(Y)
+    _check_spectra(np.atleast_2d(X), n)
+    _check_spectra(Y, n)
+
+    # K(x,y), K(x,x) and K(y,y) all come from the same two spectra
+    kernel = np.sum(np.exp(mult * nfft.irfft(X * np.conjugate(Y), n=n, axis=1) / n), axis=1)
+    if ts_self is None:
+        ts_self = self_kernels_spectra(X, n, mult)
+    if cand_self is None:
+        cand_self = self_kernels_spectra(Y, n, mult)
+    return _norm_kernel_dist(kernel, ts_self, np.asarray(cand_self, dtype=np.float64))
+
+def kernel_dist_matrix(X, Y, n, mult=1, x_self=None, y_self=None):
+    """
+    Calculates the (A x B) matrix of kernel distances between every pair of rows of two spectra arrays.
+
+    Args:
+        X: (A x L//2+1) array of spectra of standardized time series (see spectrum)
+        Y: (B x L//2+1) array of spectra of standardized time series
+        n: length of the original time series
+        mult: multiplier factor. Defaults to 1. (Must be non-negative.)
+        x_self, y_self: optional arrays of precomputed self-normalization terms for the rows of X and Y
+
+    Returns:
+        (A x B) numpy array; entry [i, j] is the distance between row i of X and row j of Y
+
+    Notes:
+        Works on an (A x B x L) intermediate, so callers should tile large problems
+        (see distmatrix.build_distance_matrix).
+    """
+    X = np.atleast_2d(X)
+    Y = np.atleast_2d(Y)
+    _check_spectra(X, n)
+    _check_spectra(Y, n)
+
+    cross = nfft.irfft(X[:, np.newaxis, :] * np.conjugate(Y[np.newaxis, :, :]), n=n, axis=2)
+    kernel = np.sum(np.exp(mult * cross / n), axis=2)
+    if x_self is None:
+        x_self = self_kernels_spectra(X, n, mult)
+    if y_self is None:
+        y_self = self_kernels_spectra(Y, n, mult)
+    x_self = np.asarray(x_self, dtype=np.float64)[:, np.newaxis]
+    y_self = np.asarray(y_self, dtype=np.float64)[np.newaxis, :]
+    return _norm_kernel_dist(kernel, x_self, y_self)
+
+def self_kernels_spectra(Y, n, mult=1):
+    """Computes K(x,x) from the spectrum of a standardized time series (or every row of an array of spectra)"""
+    return np.sum(np.exp(mult * nfft.irfft(np.abs(Y) ** 2, n=n, axis=-1) / n), axis=-1)
+
+def _check_spectra(Y, n):
+    """Raises ValueError unless every row of Y is the spectrum of a standardized time series of length n"""
+    if Y.shape[1] != n // 2 + 1:
+        raise ValueError("spectra must come from time series of length %d" % n)
+
+    # The zero frequency term is n times the mean, so this is the usual standardization check
+    if np.any(np.abs(Y[:, 0].real) / n >= .0001):
+        raise ValueError("time series must be standardized before calculating kernel distance")
+
+def _norm_kernel_dist(kernel, k_xx, k_yy):
+    """Turns raw kernel values into distances; a zero normalizer gives a correlation of 0 like kernel_corr"""
+    k_norm = np.sqrt(k_xx * k_yy)
+    corr = np.divide(kernel, k_norm, out=np.zeros(np.shape(kernel)), where=(k_norm != 0))
+    return _corr_to_dist(corr)
+
+def _corr_to_dist(corr):
+    """Turns normalized kernel correlations into distances; shared by kernel_dist and the batched paths"""
+    # Round-off leaves the correlation of a curve with itself a few ulps away from 1, and the square
+    # root turns that into a distance of ~1e-8 instead of 0, so differences that small are snapped to 0
+    dist_sq = 2 * (1 - corr)
+    return np.sqrt(np.where(dist_sq < 1e-12, 0, dist_sq))
 
 def s_stats(n,ts):
     """Prints summary stats for ts """
@@ -0,0 +1,168 @@
+#!/usr/local/bin/python3
+# -*- coding: utf-8 -*-
+#
+# CS207 Group Project Part 7
+# Created by Team 2 (Jonne Seleva, Nathaniel Burbank, Nicholas Ruta, Rohan Thavarajah) for Team 4
+
+# Blocked many-to-many kernel distance engine. The matrix is split into square tiles that
+# are computed on a process pool; each worker reads the memory-mapped spectral store and
+# writes its tiles straight into a memory-mapped .npy file, so nothing large is ever
+# pickled between processes or held in memory at once.
+
+import os
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+from crosscorr import kernel_dist_matrix, self_kernels_spectra
+from lcstore import SpectralStore, load_self_kernels, lookup_self_kernels, append_to_npy
+from lcstore import load_index, write_index, append_index
+from settings import DIST_BLOCK_SIZE
+
+# Per-process state set up by _init_worker
+_worker = {}
+
+def build_distance_matrix(lc_dir, out_path, rows=None, block=DIST_BLOCK_SIZE, workers=None, mult=1):
+    """
+    Computes kernel distances between light curves and streams them into a memory-mapped .npy matrix.
+
+    Args:
+        lc_dir: light curve directory containing a spectral store (see lcstore.save_spectra)
+        out_path: path of the .npy file to write. Row and column ids are saved next to it.
+        rows: optional list of light curve filenames to use as matrix rows (e.g. vantage points).
+            Defaults to every stored curve, which gives the symmetric all-pairs matrix.
+        block: number of rows and columns per tile
+        workers: number of worker processes. Defaults to every core; 1 runs in this process.
+        mult: multiplier factor. Defaults to 1.
+    Returns:
+        A DistanceMatrix opened on the new file. Columns are every stored curve, in store order.
+    Notes:
+        - Matrices with explicit rows are stored in Fortran (column) order, so that a new light curve
+          can later be added as a column with append_column.
+    """
+    store = SpectralStore(lc_dir)
+    col_ids = store.ids
+    row_ids = col_ids if rows is None else list(rows)
+    symmetric = rows is None
+
+    out = np.lib.format.open_memmap(out_path, mode='w+', dtype=np.float64,
+                                    shape=(len(row_ids), len(col_ids)), fortran_order=not symmetric)
+    del out
+    write_index(_ids_path(out_path), {'rows': row_ids, 'cols': col_ids})
+
+    # For the all-pairs matrix only the upper triangle of tiles is computed; each tile also fills its mirror
+    tiles = [(r0, min(r0 + block, len(row_ids)), c0, min(c0 + block, len(col_ids)))
+             for r0 in range(0, len(row_ids), block)
+             for c0 in range(r0 if symmetric else 0, len(col_ids), block)]
+
+    initargs = (lc_dir, out_path, row_ids, symmetric, mult)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers <= 1 or len(tiles) <= 1:
+        _init_worker(*initargs)
+        for tile in tiles:
+            _compute_tile(tile)
+        _worker.clear()
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=initargs) as pool:
+            for _ in pool.map(_compute_tile, tiles, chunksize=max(1, len(tiles) // (4 * workers))):
+                pass
+
+    return DistanceMatrix(out_path)
+
+def copy_rows(matrix, rows, out_path):
+    """
+    Writes the given rows of a DistanceMatrix (e.g. the vantage points of an all-pairs matrix)
+    to a new matrix file, stored in column order like any matrix built with explicit rows.
+    """
+    out = np.lib.format.open_memmap(out_path, mode='w+', dtype=np.float64,
+                                    shape=(len(rows), len(matrix.col_ids)), fortran_order=True)
+    for i, ts_fn in enumerate(rows):
+        out[i] = matrix.row(ts_fn)
+    out.flush()
+    del out
+    write_index(_ids_path(out_path), {'rows': list(rows), 'cols': list(matrix.col_ids)})
+    return DistanceMatrix(out_path)
+
+def append_column(path, ts_fn, dists):
+    """
+    Adds the distances from every row to a new light curve ts_fn as the last column of a matrix on disk.
+    Only matrices built with explicit rows (stored in column order) can be extended this way.
+    dists is a list in row order, or a dict keyed to row filename.
+    """
+    if not np.load(path, mmap_mode='r').flags.f_contiguous:
+        raise ValueError("Only vantage point matrices can be extended; rebuild %s instead" % path)
+    ids, appended = load_index(_ids_path(path))
+    if isinstance(dists, dict):
+        dists = [dists[row_fn] for row_fn in ids['rows']]
+    if len(dists) != len(ids['rows']):
+        raise ValueError("Expected %d distances, one per matrix row" % len(ids['rows']))
+    append_to_npy(path, np.reshape(dists, (len(dists), 1)))
+    append_index(_ids_path(path), ids, len(appended), ts_fn)
+
+def has_distance_matrix(path):
+    """Helper to determine whether a distance matrix and its ids have been written to path"""
+    return os.path.isfile(path) and os.path.isfile(_ids_path(path))
+
+class DistanceMatrix(object):
+    """Read-only, memory-mapped view of a distance matrix written by build_distance_matrix"""
+
+    def __init__(self, path):
+        self.values = np.load(path, mmap_mode='r')
+        ids = load_index(_ids_path(path))[0]
+        self.row_ids = ids['rows']
+        self.col_ids = ids['cols']
+        self._rows = {ts_fn: i for i, ts_fn in enumerate(self.row_ids)}
+        self._cols = {ts_fn: j for j, ts_fn in enumerate(self.col_ids)}
+
+    @property
+    def shape(self):
+        return self.values.shape
+
+    def row(self, ts_fn):
+        "distances from light curve ts_fn to every column"
+        return self.values[self._rows[ts_fn]]
+
+    def col_index(self, ts_fn):
+        "column number of light curve ts_fn"
+        return self._cols[ts_fn]
+
+    def distance(self, row_fn, col_fn):
+        return float(self.values[self._rows[row_fn], self._cols[col_fn]])
+
+def _ids_path(path):
+    """Row and column ids are stored next to the matrix: distances.npy -> distances_ids.pkl"""
+    return path[:-4] + "_ids.pkl"
+
+def _init_worker(lc_dir, out_path, row_ids, symmetric, mult):
+    """Opens the spectral store and output matrix once per worker process"""
+    store = SpectralStore(lc_dir)
+    self_kernels = lookup_self_kernels(store.ids, load_self_kernels(lc_dir, mult))
+    if self_kernels is None:
+        self_kernels = self_kernels_spectra(store.spectra(store.ids), store.length, mult)
+    col_index = {ts_fn: j for j, ts_fn in enumerate(store.ids)}
+    _worker.update(
+        store=store,
+        out=np.load(out_path, mmap_mode='r+'),
+        row_cols=np.array([col_index[ts_fn] for ts_fn in row_ids], dtype=np.intp),
+        self_kernels=self_kernels,
+        symmetric=symmetric,
+        mult=mult,
+    )
+
+def _compute_tile(tile):
+    """Computes one tile of the matrix and writes it (and its mirror for all-pairs) to disk"""
+    r0, r1, c0, c1 = tile
+    store, out, self_kernels = _worker['store'], _worker['out'], _worker['self_kernels']
+    row_cols = _worker['row_cols'][r0:r1]
+
+    dists = kernel_dist_matrix(store.spectra_at(row_cols), store.spectra_at(slice(c0, c1)), store.length, _worker['mult'],
+                               self_kernels[row_cols], self_kernels[c0:c1])
+
+    # A curve is exactly zero away from itself, whatever the round-off says
+    same = row_cols[:, np.newaxis] == np.arange(c0, c1)[np.newaxis, :]
+    dists[same] = 0
+
+    out[r0:r1, c0:c1] = dists
+    if _worker['symmetric'] and r0 != c0:
+        out[c0:c1, r0:r1] = dists.T
+    out.flush()
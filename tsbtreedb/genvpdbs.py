@@ -8,11 +8,17 @@ import sys
 import os
 import random
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 from unbalancedDB import connect
-from crosscorr import kernel_dist, standardize
+from crosscorr import kernel_dist_many, standardize, standardize_values
 from makelcs import clear_dir
-from settings import LIGHT_CURVES_DIR, DB_DIR, TS_LENGTH, ats
+from lcstore import save_self_kernels, save_spectra, lookup_self_kernels, has_curves, import_text_curves, CurveStore
+from distmatrix import build_distance_matrix, copy_rows, DistanceMatrix
+from vpselect import pick_vps, compare_strategies, expected_candidates
+from vptree import build_vp_tree
+from cache import index_generation, bump_index_generation
+from settings import LIGHT_CURVES_DIR, DB_DIR, TS_LENGTH, DIST_MATRIX_FILE, VP_DIST_MATRIX_FILE, VP_STRATEGIES, BRUTE_FORCE_THRESHOLD, ats
 
 # Global variables
 
@@ -25,11 +31,18 @@ A python command line utility to generate vantage point DBs from light-curve fil
 Usage: ./genvpdbs  [optional flags]
 
 Optional flags:
-  -h, --help    Show this help message and exit.
+  -h, --help        Show this help message and exit.
+  -a, --all-pairs   Also build the full all-pairs distance matrix (vp_dbs/distances.npy)
+  -w, --workers N   Number of worker processes for the build (Defaults to every core)
+  -s, --strategy S  Vantage point selection strategy: random, farthest, spread or best (Defaults to random)
+  -c, --compare     Report the expected candidate-set size of every selection strategy
+  --no-tree         Skip building the vantage point tree (vp_dbs/vptree.npy)
 """
 
 def load_ts(LIGHT_CURVES_DIR):
-    """Loads time series text files; returns dict keyed to filename"""
+    """Loads the light curves (from the packed store if there is one, else text files); returns dict keyed to filename"""
+    if has_curves(LIGHT_CURVES_DIR):
+        return CurveStore(LIGHT_CURVES_DIR).timeseries_dict()
     timeseries_dict = {}
     for file in os.listdir(LIGHT_CURVES_DIR):
         if file.startswith("ts-") and file.endswith(".txt"):
@@ -40,58 +53,169 @@ def load_ts(LIGHT_CURVES_DIR):
             timeseries_dict[file] = ts
     return timeseries_dict
 
-def pick_vantage_points(timeseries_dict,n=20):
-    """Selects n light curves at random to serve as vantage points"""
-    return random.sample(timeseries_dict.keys(), n)
+def pick_vantage_points(timeseries_dict,n=20,strategy='random',store=None,matrix=None):
+    """
+    Selects n light curves to serve as vantage points; at random unless another strategy is given.
+    The other strategies (see vpselect) need the SpectralStore of the light curves, and read
+    distances from an all-pairs DistanceMatrix when one is given.
+    """
+    if strategy == 'random':
+        return random.sample(list(timeseries_dict), n)
+    if store is None:
+        raise ValueError("The '%s' vantage point strategy needs a spectral store" % strategy)
+    return pick_vps(store, n, strategy, matrix)
 
-def calc_distances(vp_k,timeseries_dict):
-    """Calculates kernel distance between vantage point and all loaded light curves"""
-    distances = []
+def calc_distances(vp_k,timeseries_dict,self_kernels=None):
+    """
+    Calculates kernel distance between vantage point and all loaded light curves.
+    Uses cached K(x,x) normalizers from self_kernels when they are available.
+    """
+    keys = [k for k in timeseries_dict if k != vp_k]
     vp = standardize(timeseries_dict[vp_k])
-    for k in timeseries_dict:
-        if k != vp_k:
-            k_dist = kernel_dist(vp, standardize(timeseries_dict[k]))
-            distances.append((k_dist,k))
-    return distances
-
-def save_vp_dbs(vp,timeseries_dict):
-    """ Creates unbalanced binary tree databases and saves them to disk"""
-    sorted_ds = calc_distances(vp,timeseries_dict)
+    candidates = standardize_values([timeseries_dict[k].values() for k in keys])
+    vp_self = self_kernels.get(vp_k) if self_kernels else None
+    k_dists = kernel_dist_many(vp, candidates, ts_self=vp_self,
+                               cand_self=lookup_self_kernels(keys, self_kernels))
+    return [(float(k_dist),k) for k_dist,k in zip(k_dists,keys)]
+
+def matrix_distances(vp_k,matrix):
+    """Reads kernel distance between vantage point and all other light curves from a precomputed DistanceMatrix"""
+    return [(float(k_dist),k) for k_dist,k in zip(matrix.row(vp_k),matrix.col_ids) if k != vp_k]
+
+def save_vp_dbs(vp,timeseries_dict,self_kernels=None,matrix=None,db_dir=DB_DIR):
+    """ Creates binary tree databases (bulk loaded, so balanced) and saves them to disk"""
+    if matrix is not None:
+        sorted_ds = matrix_distances(vp,matrix)
+    else:
+        sorted_ds = calc_distances(vp,timeseries_dict,self_kernels)
 
     # ts-13.txt -> vp_dbs/ts-13.dbdb
-    db_filepath = DB_DIR + vp[:-4] + ".dbdb"
+    db_filepath = db_dir + vp[:-4] + ".dbdb"
     db = connect(db_filepath)
 
-    for dist_to_vp,ts_fn in sorted_ds:
-        db.set(dist_to_vp, ts_fn)
-
-    db.commit()
+    # Balanced tree written bottom-up in one pass, instead of one set() per light curve
+    db.bulk_load(sorted_ds)
     db.close()
 
-def create_vpdbs(n,LIGHT_CURVES_DIR):
+def _save_vp_db_from_file(vp,matrix_path,db_dir):
+    """Worker process entry point: opens the shared distance matrix read-only and writes one vp db"""
+    save_vp_dbs(vp,None,matrix=DistanceMatrix(matrix_path),db_dir=db_dir)
+    return vp
+
+def save_all_vp_dbs(vantage_points,matrix_path,workers=None,db_dir=DB_DIR):
+    """
+    Writes the database of every vantage point from a distance matrix on disk.
+    With more than one worker the databases are written concurrently, one per process;
+    each process memory-maps the same matrix file, so the distances are never copied.
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers <= 1:
+        matrix = DistanceMatrix(matrix_path)
+        for vp in vantage_points:
+            print('.', end="")
+            save_vp_dbs(vp,None,matrix=matrix,db_dir=db_dir)
+        return
+    with ProcessPoolExecutor(max_workers=min(workers, len(vantage_points))) as pool:
+        futures = [pool.submit(_save_vp_db_from_file, vp, matrix_path, db_dir) for vp in vantage_points]
+        for future in as_completed(futures):
+            future.result()
+            print('.', end="")
+
+def report_strategies(results,num_lcs):
+    """Prints the expected candidate-set size of each vantage point selection strategy"""
+    print("Expected candidates scored per query:")
+    for strategy in VP_STRATEGIES:
+        expected = results[strategy][2]
+        print("  %-9s %9.1f of %d (%.1f%%)" % (strategy, expected, num_lcs, 100. * expected / num_lcs))
+
+def create_vpdbs(n,LIGHT_CURVES_DIR,all_pairs=False,workers=None,strategy='random',compare=False,tree=True):
     """
     Executes functions above:
-        (1) Creates timeseries_dict from time series files on disk
-        (2) Picks 20 vantage points at random
-        (3) Calculates kernel distance between vantage points and generated time series (This can take a while)
-        (4) Saves kernel distance indexes to disk as binary tree databases
+        (1) Creates timeseries_dict from the light curves on disk, packing text files into a
+            light curve store first if there is none
+        (2) Standardizes every light curve once, caching its spectrum and K(x,x) normalizer next to
+            the light curve files
+        (3) With all_pairs, calculates the full all-pairs distance matrix on a process pool
+        (4) Picks 20 vantage points with the selected strategy (random by default; 'best' tries every
+            strategy and keeps the one with the smallest expected candidate set)
+        (5) Calculates kernel distance between vantage points and generated time series on a process pool
+            (This can take a while)
+        (6) Saves kernel distance indexes to disk as binary tree databases, one process per database
+        (7) With tree, builds the vantage point tree over every light curve (see vptree)
+        (8) Bumps the index generation, so running servers reload and drop cached results
+
+    workers sets the number of processes for steps 3, 5 and 6. Defaults to every core.
+    Returns the expected number of candidates scored per query with the chosen vantage points.
     """
+    if strategy != 'best' and strategy not in VP_STRATEGIES:
+        raise ValueError("Unknown vantage point strategy '%s'" % strategy)
     print("Creating %d vantage point dbs" % n,end="")
+    if not has_curves(LIGHT_CURVES_DIR):
+        import_text_curves(LIGHT_CURVES_DIR)
     timeseries_dict = load_ts(LIGHT_CURVES_DIR)
-    vantage_points = pick_vantage_points(timeseries_dict,n)
+    store = save_spectra(timeseries_dict, LIGHT_CURVES_DIR)
+    self_kernels = save_self_kernels(timeseries_dict, LIGHT_CURVES_DIR, store=store)
+    generation = index_generation(DB_DIR)
     clear_dir(DB_DIR)
-    for vp in vantage_points:
-        print('.', end="")
-        save_vp_dbs(vp,timeseries_dict)
+
+    matrix = None
+    if all_pairs:
+        matrix_path = DB_DIR + DIST_MATRIX_FILE
+        matrix = build_distance_matrix(LIGHT_CURVES_DIR, matrix_path, workers=workers)
+
+    results = None
+    if compare or strategy == 'best':
+        results = compare_strategies(store, n, matrix)
+        if strategy == 'best':
+            strategy = min(VP_STRATEGIES, key=lambda s: results[s][2])
+    if results is not None:
+        vantage_points = results[strategy][0]
+    else:
+        vantage_points = pick_vantage_points(timeseries_dict,n,strategy,store,matrix)
+
+    # Searches bound candidates with the distances to every vantage point, so these are always saved
+    if all_pairs:
+        copy_rows(matrix, vantage_points, DB_DIR + VP_DIST_MATRIX_FILE)
+    else:
+        matrix_path = DB_DIR + VP_DIST_MATRIX_FILE
+        matrix = build_distance_matrix(LIGHT_CURVES_DIR, matrix_path, rows=vantage_points, workers=workers)
+    save_all_vp_dbs(vantage_points, matrix_path, workers)
+    if tree:
+        build_vp_tree(store, DB_DIR, self_kernels)
+    bump_index_generation(DB_DIR, generation)
     print("Done.")
 
+    if results is not None:
+        report_strategies(results, len(store))
+        expected = results[strategy][2]
+    else:
+        vp_rows = np.array([matrix.row(vp) for vp in vantage_points])
+        expected = expected_candidates(store, vantage_points, vp_rows)
+    print("Using %s vantage points: ~%.1f of %d candidates scored per query" % (strategy, expected, len(store)))
+    if len(store) < BRUTE_FORCE_THRESHOLD:
+        print("Collections under %d light curves are searched by brute force by default; pass -i to simsearch to use these indexes"
+              % BRUTE_FORCE_THRESHOLD)
+    return expected
+
 if __name__ == "__main__":
     """Enables this file to be run independently of simsearch as it's own CLU."""
     need_help = False
+    all_pairs = False
+    workers = None
+    strategy = 'random'
+    compare = False
+    tree = True
 
     # First, identify which flags were included
-    for arg in sys.argv[1:]:
+    args = sys.argv[1:]
+    for i, arg in enumerate(args):
         if arg.lower() in ['-h','--help', 'help']: need_help = True
+        elif arg.lower() in ['-a','--all-pairs']: all_pairs = True
+        elif arg.lower() in ['-w','--workers'] and i + 1 < len(args): workers = int(args[i + 1])
+        elif arg.lower() in ['-s','--strategy'] and i + 1 < len(args): strategy = args[i + 1].lower()
+        elif arg.lower() in ['-c','--compare']: compare = True
+        elif arg.lower() == '--no-tree': tree = False
 
     while(True):
         if need_help:
@@ -99,5 +223,5 @@ if __name__ == "__main__":
             break
         else:
             print("Starting...(May take a little while)")
-            create_vpdbs(20,LIGHT_CURVES_DIR)
+            create_vpdbs(20,LIGHT_CURVES_DIR,all_pairs,workers,strategy,compare,tree)
             break
@@ -0,0 +1,114 @@
+#!/usr/local/bin/python3
+# -*- coding: utf-8 -*-
+#
+# CS207 Group Project Part 7
+# Created by Team 2 (Jonne Seleva, Nathaniel Burbank, Nicholas Ruta, Rohan Thavarajah) for Team 4
+
+import sys
+
+from unbalancedDB import connect
+from crosscorr import standardize_values, spectrum, kernel_dist_spectra
+from makelcs import write_ts
+from lcstore import SpectralStore, has_spectra, append_spectrum, add_self_kernel, load_self_kernels, lookup_self_kernels
+from lcstore import has_curves, append_curve
+from distmatrix import has_distance_matrix, append_column
+from simsearch import list_vps, load_external_ts
+from cache import bump_index_generation
+from settings import LIGHT_CURVES_DIR, DB_DIR, VP_DIST_MATRIX_FILE
+
+# Global variables
+
+HELP_MESSAGE = \
+"""
+Add Light Curves
+
+A python command line utility to add light curves to an existing collection and insert them
+into its vantage point DBs without rebuilding anything.
+
+Usage: ./ingest input.txt [more input files]  [optional flags]
+
+Optional flags:
+  -h, --help    Show this help message and exit.
+"""
+
+def next_lc_id(store):
+    """Returns the next unused light curve filename (ts-<n>.txt) for a SpectralStore, from its stored counter"""
+    return "ts-%d.txt" % store.next_num
+
+def add_light_curve(ts, lc_dir=LIGHT_CURVES_DIR, db_dir=DB_DIR, ts_fn=None):
+    """
+    Adds a light curve to the collection and inserts it into every existing vantage point DB.
+
+    Args:
+        ts: time series on the same grid as the stored light curves (e.g. from simsearch.load_external_ts)
+        lc_dir: light curve directory (must already hold a spectral store built by genvpdbs)
+        db_dir: vantage point DB directory
+        ts_fn: name to store the light curve under (Defaults to the next unused ts-<n>.txt; other
+            names need a packed light curve store)
+    Returns:
+        Tuple: filename assigned to the new light curve, dict of its distance to each vantage point
+    Notes:
+        - Costs one kernel distance per vantage point and one commit per vantage point DB.
+        - The light curve store (or text file, for collections that have not been packed), spectral store, K(x,x) cache and vantage point distance matrix are
+          all appended to in place, and their row indexes only have the new id appended to a log (see
+          lcstore.append_index), so nothing is rewritten in proportion to the collection.
+          An all-pairs matrix (genvpdbs -a) is not extended.
+        - Bumps the index generation (see cache.index_generation).
+    """
+    if not has_spectra(lc_dir):
+        raise ValueError("No light curve index found in %s; run genvpdbs first" % lc_dir)
+    store = SpectralStore(lc_dir)
+    if len(ts) != store.length:
+        raise ValueError("Light curve must have %d points to be added (got %d)" % (store.length, len(ts)))
+
+    if ts_fn is None:
+        ts_fn = next_lc_id(store)
+    elif ts_fn in store:
+        raise ValueError("A light curve named %s already exists" % ts_fn)
+    elif not has_curves(lc_dir):
+        raise ValueError("Light curves can only be named when the collection is packed (see lcstore)")
+    s_values = standardize_values(ts.values())[0]
+    if has_curves(lc_dir):
+        append_curve(lc_dir, ts_fn, ts)
+    else:
+        write_ts(ts, int(ts_fn[3:-4]), lc_dir)
+    append_spectrum(lc_dir, ts_fn, s_values)
+    add_self_kernel(lc_dir, ts_fn, s_values)
+
+    vps = list_vps(db_dir)
+    vp_dists = kernel_dist_spectra(spectrum(s_values), store.spectra(vps), store.length,
+                                   cand_self=lookup_self_kernels(vps, load_self_kernels(lc_dir)))
+    vp_dists = dict(zip(vps, vp_dists.tolist()))
+
+    for vp in vps:
+        db = connect(db_dir + vp[:-4] + ".dbdb")
+        db.set(vp_dists[vp], ts_fn)
+        db.commit()
+        db.close()
+
+    matrix_path = db_dir + VP_DIST_MATRIX_FILE
+    if has_distance_matrix(matrix_path):
+        append_column(matrix_path, ts_fn, vp_dists)
+    bump_index_generation(db_dir)
+
+    return ts_fn, vp_dists
+
+if __name__ == "__main__":
+    """Command line interface: adds each given time series file to the light curve collection."""
+    need_help = False
+    input_fpaths = []
+
+    # First, identify which flags were included
+    for arg in sys.argv[1:]:
+        if arg.lower() in ['-h','--help', 'help']: need_help = True
+        elif '.txt' in arg.lower() or '.dat_folded' in arg.lower():
+            input_fpaths.append(arg)
+
+    while(True):
+        if need_help or len(input_fpaths) == 0:
+            print (HELP_MESSAGE)
+            break
+        for input_fpath in input_fpaths:
+            ts_fn, vp_dists = add_light_curve(load_external_ts(input_fpath))
+            print("Added %s as %s (indexed against %d vantage points)" % (input_fpath, ts_fn, len(vp_dists)))
+        break
@@ -0,0 +1,472 @@
+#!/usr/local/bin/python3
+# -*- coding: utf-8 -*-
+#
+# CS207 Group Project Part 7
+# Created by Team 2 (Jonne Seleva, Nathaniel Burbank, Nicholas Ruta, Rohan Thavarajah) for Team 4
+
+# Per-curve data derived from the light curves that never changes once a curve is stored.
+# It is computed once at index build time and persisted next to the light curve files.
+#
+# Row indexes (the filename of every row) are pickled in one piece when a store is built. Curves
+# added later are appended to a log next to the index instead of rewriting it, and the log is
+# folded back into the index once it has grown as long as the index (see append_index).
+
+import io
+import os
+import sys
+import pickle
+import numpy as np
+
+from crosscorr import standardize_values, self_kernels_many, self_kernels_spectra, spectrum
+from settings import LIGHT_CURVES_DIR, SELF_KERNELS_FILE, SPECTRA_FILE, SPECTRA_IDS_FILE, CURVES_FILE, CURVES_IDS_FILE, INDEX_LOG_MIN, ats
+
+HELP_MESSAGE = \
+"""
+Pack Light Curves
+
+Converts a directory of ts-<n>.txt light curve text files into a packed light curve store
+(one memory-mapped matrix of values plus a row index), which is what the search tools read.
+
+Usage: ./lcstore [light_curves_dir ...]  [optional flags]
+
+Optional flags:
+  -h, --help    Show this help message and exit.
+  --float32     Store values as float32 instead of float64 (half the size)
+  --remove      Delete the text files once they are packed
+"""
+
+def save_self_kernels(timeseries_dict, lc_dir, mult=1, store=None):
+    """
+    Computes the self-normalization term K(x,x) for every light curve and saves it to disk.
+
+    Args:
+        timeseries_dict: dict of (unstandardized) time series keyed to filename
+        lc_dir: light curve directory the cache file is written to
+        mult: kernel multiplier the normalizers are computed for. Defaults to 1.
+        store: optional SpectralStore holding every curve in timeseries_dict. When given the
+            normalizers are computed from the stored spectra instead of re-standardizing the curves.
+    Returns:
+        Dict of K(x,x) values keyed to filename
+    Notes:
+        - Normalizers for other multipliers already in the cache are kept only if they cover
+          exactly the same set of light curves.
+    """
+    keys = list(timeseries_dict)
+    if store is not None:
+        k_vals = self_kernels_spectra(store.spectra(keys), store.length, mult)
+    else:
+        k_vals = self_kernels_many(standardize_values([timeseries_dict[k].values() for k in keys]), mult)
+    self_kernels = dict(zip(keys, k_vals.tolist()))
+
+    all_kernels = {m: ks for m, ks in _load_all_self_kernels(lc_dir).items()
+                   if ks.keys() == self_kernels.keys()}
+    all_kernels[mult] = self_kernels
+    _write_all_self_kernels(lc_dir, all_kernels)
+    return self_kernels
+
+def load_self_kernels(lc_dir, mult=1):
+    """Loads cached K(x,x) values keyed to filename; returns an empty dict if none were saved for mult"""
+    return _load_all_self_kernels(lc_dir).get(mult, {})
+
+def add_self_kernel(lc_dir, ts_fn, s_values):
+    """
+    Adds K(x,x) of one new light curve (given its standardized values) for every cached multiplier.
+    The values are appended to the cache's log; the cache is only rewritten once the log has grown
+    as long as the cache.
+    """
+    all_kernels, logged = _load_self_kernel_log(lc_dir)
+    record = {mult: float(self_kernels_many(s_values, mult)[0]) for mult in all_kernels}
+    for mult, k_val in record.items():
+        all_kernels[mult][ts_fn] = k_val
+    size = max([len(ks) for ks in all_kernels.values()] + [0])
+    if logged + 1 >= max(INDEX_LOG_MIN, size - logged - 1):
+        _write_all_self_kernels(lc_dir, all_kernels)
+    else:
+        _append_log(lc_dir + SELF_KERNELS_FILE, (ts_fn, record))
+
+def lookup_self_kernels(ts_fns, self_kernels):
+    """Returns cached K(x,x) values for ts_fns as an array, or None if any of them is not cached"""
+    if not self_kernels:
+        return None
+    try:
+        return np.array([self_kernels[fn] for fn in ts_fns])
+    except KeyError:
+        return None
+
+def save_spectra(timeseries_dict, lc_dir):
+    """
+    Standardizes every light curve, takes its real FFT and saves the stacked spectra to disk.
+
+    Args:
+        timeseries_dict: dict of (unstandardized) time series keyed to filename
+        lc_dir: light curve directory the spectra and their row index are written to
+    Returns:
+        A SpectralStore opened on the new files
+    """
+    keys = list(timeseries_dict)
+    values = standardize_values([timeseries_dict[k].values() for k in keys])
+    os.makedirs(lc_dir, exist_ok=True)
+    np.save(lc_dir + SPECTRA_FILE, spectrum(values))
+    write_index(lc_dir + SPECTRA_IDS_FILE, {'ids': keys, 'length': values.shape[1], 'next_num': _next_lc_num(keys)})
+    return SpectralStore(lc_dir)
+
+def append_spectrum(lc_dir, ts_fn, s_values):
+    """
+    Adds one light curve to the spectral store in lc_dir without rewriting the stored spectra.
+
+    Args:
+        lc_dir: light curve directory holding the store
+        ts_fn: filename of the new light curve
+        s_values: standardized values of the new light curve
+    """
+    index_path = lc_dir + SPECTRA_IDS_FILE
+    index, appended = load_index(index_path)
+    if ts_fn in index['ids']:
+        raise ValueError("'%s' is already in the spectral store" % ts_fn)
+    append_to_npy(lc_dir + SPECTRA_FILE, spectrum(s_values)[np.newaxis, :])
+    index['next_num'] = _next_lc_num([ts_fn], _stored_next_num(index, appended))
+    append_index(index_path, index, len(appended), ts_fn)
+
+def save_curves(timeseries_dict, lc_dir, dtype=np.float64):
+    """
+    Packs the values of every light curve into one matrix on disk, replacing one text file per curve.
+
+    Args:
+        timeseries_dict: dict of time series keyed to filename, all on the same time grid
+        lc_dir: light curve directory the matrix and its row index are written to
+        dtype: dtype the values are stored as (Defaults to float64; float32 halves the size)
+    Returns:
+        A CurveStore opened on the new files
+    """
+    keys = list(timeseries_dict)
+    if len(keys) == 0:
+        raise ValueError("No light curves to save")
+    times = np.asarray(timeseries_dict[keys[0]].times(), dtype=np.float64)
+    values = np.empty((len(keys), len(times)), dtype=dtype)
+    for i, k in enumerate(keys):
+        ts = timeseries_dict[k]
+        if len(ts) != len(times) or not np.allclose(ts.times(), times):
+            raise ValueError("'%s' is not on the same time grid as the other light curves" % k)
+        values[i] = ts.values()
+    os.makedirs(lc_dir, exist_ok=True)
+    np.save(lc_dir + CURVES_FILE, values)
+    write_index(lc_dir + CURVES_IDS_FILE, {'ids': keys, 'times': times})
+    return CurveStore(lc_dir)
+
+def append_curve(lc_dir, ts_fn, ts):
+    """Adds one light curve (on the store's time grid) to the packed store in lc_dir without rewriting it"""
+    index_path = lc_dir + CURVES_IDS_FILE
+    index, appended = load_index(index_path)
+    if ts_fn in index['ids']:
+        raise ValueError("'%s' is already in the light curve store" % ts_fn)
+    if len(ts) != len(index['times']) or not np.allclose(ts.times(), index['times']):
+        raise ValueError("'%s' is not on the time grid of the light curve store" % ts_fn)
+    append_to_npy(lc_dir + CURVES_FILE, np.asarray(ts.values())[np.newaxis, :])
+    append_index(index_path, index, len(appended), ts_fn)
+
+def has_curves(lc_dir):
+    """Helper to determine whether a packed light curve store has been built in lc_dir"""
+    return os.path.isfile(lc_dir + CURVES_FILE) and os.path.isfile(lc_dir + CURVES_IDS_FILE)
+
+def text_curve_files(lc_dir):
+    """Names of the ts-<n>.txt light curve text files in lc_dir, in numeric order"""
+    files = [file for file in os.listdir(lc_dir) if file.startswith("ts-") and file.endswith(".txt")]
+    return sorted(files, key=lambda file: (len(file), file))
+
+def import_text_curves(lc_dir, dtype=np.float64, remove=False):
+    """
+    Converts the ts-<n>.txt light curve text files in lc_dir into a packed store.
+
+    Args:
+        lc_dir: light curve directory holding the text files
+        dtype: dtype the values are stored as (Defaults to float64)
+        remove: delete the text files once the store is written
+    Returns:
+        A CurveStore opened on the new files
+    """
+    timeseries_dict = {}
+    for file in text_curve_files(lc_dir):
+        times, values = np.loadtxt(lc_dir + file).T
+        timeseries_dict[file] = ats.ArrayTimeSeries(times=times, values=values)
+    store = save_curves(timeseries_dict, lc_dir, dtype)
+    if remove:
+        for file in timeseries_dict:
+            os.remove(lc_dir + file)
+    return store
+
+def has_spectra(lc_dir):
+    """Helper to determine whether a spectral store has been built in lc_dir"""
+    return os.path.isfile(lc_dir + SPECTRA_FILE) and os.path.isfile(lc_dir + SPECTRA_IDS_FILE)
+
+class SpectralStore(object):
+    """
+    Read-only, memory-mapped store of the standardized rfft spectra of every light curve.
+
+    Rows are only paged in from disk when they are used, so opening the store is cheap
+    and a distance needs no text parsing, standardization or forward FFT.
+    """
+
+    def __init__(self, lc_dir):
+        self._spectra = np.load(lc_dir + SPECTRA_FILE, mmap_mode='r')
+        index, appended = load_index(lc_dir + SPECTRA_IDS_FILE)
+        self._ids = index['ids']
+        self._rows = {ts_fn: i for i, ts_fn in enumerate(self._ids)}
+        self.length = index['length']
+        self.next_num = _stored_next_num(index, appended)
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __contains__(self, ts_fn):
+        return ts_fn in self._rows
+
+    @property
+    def ids(self):
+        "filenames of the stored light curves, in row order"
+        return list(self._ids)
+
+    def spectrum(self, ts_fn):
+        "spectrum of a single light curve (a view into the memory map)"
+        return self._spectra[self._rows[ts_fn]]
+
+    def spectra(self, ts_fns):
+        "(N x L//2+1) array of spectra for the light curves ts_fns, in the given order"
+        return self._spectra[[self._rows[ts_fn] for ts_fn in ts_fns]]
+
+    def spectra_at(self, rows):
+        "spectra by row number (an int array or a slice)"
+        return self._spectra[rows]
+
+    def ids_at(self, rows):
+        "filenames of the light curves in rows, without copying the whole id list"
+        return [self._ids[row] for row in rows]
+
+class CurveStore(object):
+    """
+    Read-only, memory-mapped store of the values of every light curve on their shared time grid.
+
+    A light curve is a row of the matrix, so looking one up is a dict lookup plus a view into
+    the memory map: no file is opened or parsed.
+    """
+
+    def __init__(self, lc_dir):
+        self._values = np.load(lc_dir + CURVES_FILE, mmap_mode='r')
+        index, appended = load_index(lc_dir + CURVES_IDS_FILE)
+        self._ids = index['ids']
+        self._rows = {ts_fn: i for i, ts_fn in enumerate(self._ids)}
+        self.times = index['times']
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __contains__(self, ts_fn):
+        return ts_fn in self._rows
+
+    @property
+    def ids(self):
+        "filenames of the stored light curves, in row order"
+        return list(self._ids)
+
+    @property
+    def length(self):
+        "number of points in every light curve"
+        return len(self.times)
+
+    def values(self, ts_fn):
+        "values of a single light curve (a read-only view into the memory map)"
+        return self._values[self._rows[ts_fn]]
+
+    def values_many(self, ts_fns):
+        "(N x length) array of values for the light curves ts_fns, in the given order"
+        return self._values[[self._rows[ts_fn] for ts_fn in ts_fns]]
+
+    def values_at(self, rows):
+        "values by row number (an int array or a slice)"
+        return self._values[rows]
+
+    def timeseries(self, ts_fn):
+        "a light curve as an ArrayTimeSeries"
+        return ats.ArrayTimeSeries(times=self.times, values=self.values(ts_fn))
+
+    def timeseries_dict(self):
+        "every light curve as an ArrayTimeSeries, keyed to filename"
+        return {ts_fn: self.timeseries(ts_fn) for ts_fn in self._ids}
+
+def _load_all_self_kernels(lc_dir):
+    """Helper to load the full {mult: {filename: K(x,x)}} cache from disk"""
+    return _load_self_kernel_log(lc_dir)[0]
+
+def _load_self_kernel_log(lc_dir):
+    """Helper to load the full cache with the values added to its log; returns (cache, number of logged curves)"""
+    filepath = lc_dir + SELF_KERNELS_FILE
+    if not os.path.isfile(filepath):
+        return {}, 0
+    with open(filepath, 'rb') as f:
+        all_kernels = pickle.load(f)
+    records = _read_log(filepath)
+    for ts_fn, record in records:
+        for mult, k_val in record.items():
+            if mult in all_kernels:
+                all_kernels[mult][ts_fn] = k_val
+    return all_kernels, len(records)
+
+def _write_all_self_kernels(lc_dir, all_kernels):
+    """Helper to write the full {mult: {filename: K(x,x)}} cache to disk"""
+    os.makedirs(lc_dir, exist_ok=True)
+    write_index(lc_dir + SELF_KERNELS_FILE, all_kernels)
+
+def load_index(index_path):
+    """
+    Loads a pickled row index, with the ids appended to its log since it was written.
+
+    Returns:
+        Tuple: the index dict (its 'ids' list, or 'cols' for a distance matrix, includes the
+        logged ids), list of the ids read from the log
+    """
+    with open(index_path, 'rb') as f:
+        index = pickle.load(f)
+    ids = index['cols'] if 'cols' in index else index['ids']
+    appended = []
+    for row, ts_fn in _read_log(index_path):
+        # a log that was folded into the index but not yet removed repeats rows the index has
+        if row == len(ids):
+            ids.append(ts_fn)
+            appended.append(ts_fn)
+    return index, appended
+
+def write_index(index_path, index):
+    """Writes a pickled row index in one piece, replacing the old index and its log"""
+    with open(index_path + ".tmp", 'wb') as f:
+        pickle.dump(index, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(index_path + ".tmp", index_path)
+    if os.path.isfile(_log_path(index_path)):
+        os.remove(_log_path(index_path))
+
+def append_index(index_path, index, logged, ts_fn):
+    """
+    Adds ts_fn as the next row of a row index loaded with load_index.
+
+    The id is appended to the index's log, which costs the same however large the index is. Once
+    the log holds as many ids as the index (and at least INDEX_LOG_MIN), the index is rewritten
+    with the log folded in, so rewriting costs O(1) per added id amortized.
+
+    Args:
+        index_path: path of the pickled index
+        index: the index, as returned by load_index
+        logged: number of ids load_index read from the log
+        ts_fn: filename of the new row
+    """
+    ids = index['cols'] if 'cols' in index else index['ids']
+    ids.append(ts_fn)
+    if logged + 1 >= max(INDEX_LOG_MIN, len(ids) - logged - 1):
+        write_index(index_path, index)
+    else:
+        _append_log(index_path, (len(ids) - 1, ts_fn))
+
+def index_version(index_path):
+    """Changes whenever a row index or its log is written: (modification time of the index, size of the log)"""
+    log_path = _log_path(index_path)
+    return os.stat(index_path).st_mtime_ns, os.path.getsize(log_path) if os.path.isfile(log_path) else 0
+
+def _log_path(index_path):
+    """Ids added to a row index are logged next to it: spectra_ids.pkl -> spectra_ids.log"""
+    return index_path[:-4] + ".log"
+
+def _append_log(index_path, record):
+    """Helper to append one pickled record to the log of a row index"""
+    with open(_log_path(index_path), 'ab') as f:
+        pickle.dump(record, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+def _read_log(index_path):
+    """Helper to read every record in the log of a row index, up to a record cut short by a crash"""
+    records = []
+    if not os.path.isfile(_log_path(index_path)):
+        return records
+    with open(_log_path(index_path), 'rb') as f:
+        while True:
+            try:
+                records.append(pickle.load(f))
+            except (EOFError, pickle.UnpicklingError, ValueError):
+                break
+    return records
+
+def _next_lc_num(ts_fns, start=0):
+    """Helper to find the smallest n (at least start) above every ts-<n>.txt in ts_fns"""
+    nums = [int(ts_fn[3:-4]) for ts_fn in ts_fns
+            if ts_fn.startswith("ts-") and ts_fn.endswith(".txt") and ts_fn[3:-4].isdigit()]
+    return max(nums + [start - 1]) + 1
+
+def _stored_next_num(index, appended):
+    """Helper to find the next unused ts-<n>.txt number of a spectral store from its index"""
+    if 'next_num' not in index:
+        # indexes written before the counter was kept
+        return _next_lc_num(index['ids'])
+    return _next_lc_num(appended, index['next_num'])
+
+def append_to_npy(path, block):
+    """
+    Appends to an .npy file in place: rows to a C-ordered array, or columns to a Fortran-ordered one.
+
+    numpy pads .npy headers so that the growing dimension can gain digits, so normally only
+    the new data and the header are written. The whole file is rewritten if the header would not fit.
+    """
+    with open(path, 'r+b') as f:
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+        header_len = f.tell()
+
+        axis = len(shape) - 1 if fortran_order else 0
+        block = np.asarray(block, dtype=dtype)
+        if block.ndim != len(shape) or any(block.shape[i] != shape[i] for i in range(len(shape)) if i != axis):
+            raise ValueError("Cannot append a %s block to a %s array" % (block.shape, shape))
+        new_shape = list(shape)
+        new_shape[axis] += block.shape[axis]
+
+        header = io.BytesIO()
+        header_d = {'descr': np.lib.format.dtype_to_descr(dtype), 'fortran_order': fortran_order,
+                    'shape': tuple(new_shape)}
+        if version == (1, 0):
+            np.lib.format.write_array_header_1_0(header, header_d)
+        else:
+            np.lib.format.write_array_header_2_0(header, header_d)
+
+        if len(header.getvalue()) == header_len:
+            # Data first, so a crash part way leaves the old (still valid) header in place
+            f.seek(0, os.SEEK_END)
+            f.write(block.tobytes(order='F' if fortran_order else 'C'))
+            f.flush()
+            f.seek(0)
+            f.write(header.getvalue())
+            return
+
+    combined = np.concatenate((np.load(path), block), axis=axis)
+    out = np.lib.format.open_memmap(path, mode='w+', dtype=combined.dtype, shape=combined.shape,
+                                    fortran_order=fortran_order)
+    out[...] = combined
+    out.flush()
+
+if __name__ == "__main__":
+    """Command line interface: packs the light curve text files of each given directory."""
+    need_help = False
+    dtype = np.float64
+    remove = False
+    lc_dirs = []
+
+    # First, identify which flags were included
+    for arg in sys.argv[1:]:
+        if arg.lower() in ['-h','--help', 'help']: need_help = True
+        elif arg.lower() == '--float32': dtype = np.float32
+        elif arg.lower() == '--remove': remove = True
+        elif os.path.isdir(arg): lc_dirs.append(arg if arg.endswith('/') else arg + '/')
+
+    while(True):
+        if need_help:
+            print (HELP_MESSAGE)
+            break
+        for lc_dir in lc_dirs or [LIGHT_CURVES_DIR]:
+            store = import_text_curves(lc_dir, dtype, remove)
+            print("Packed %d light curves in %s" % (len(store), lc_dir))
+        break
@@ -8,10 +8,10 @@ import os
 import sys
 import random
 import numpy as np
-from scipy.stats import norm
 
 # Global variables
 
+from lcstore import save_curves
 from settings import LIGHT_CURVES_DIR, ats
 
 HELP_MESSAGE = \
@@ -25,6 +25,7 @@ Usage: ./makelcs 100 [optional flags]
 
 Optional flags:
   -d, --delete  Delete existing light curves and exit.
+  -t, --text    Also write each light curve as a ts-<n>.txt text file
   -h, --help    Show this help message and exit.
 """
 
@@ -41,6 +42,8 @@ def tsmaker(mean, scale, jitter, length = 100):
         An array time series object.
 
     """
+    # scipy is slow to import and only needed here, so it is not imported at module level
+    from scipy.stats import norm
     times = np.arange(0.0, 1.0, (1.0 / length))
     values = norm.pdf(times, mean, scale) + jitter*np.random.randn(100)
     return ats.ArrayTimeSeries(times=times, values=values)
@@ -95,20 +98,23 @@ def clear_dir(dir,recreate=True):
     if(recreate):
         os.makedirs(dir, exist_ok=True)
 
-def make_lc_files(num_lcs,lc_dir):
+def make_lc_files(num_lcs,lc_dir,text=False):
     """
     Executes functions above:
         (1) Generates n light curves
         (2) Deletes any existing light curve files
-        (3) Writes them to disk
+        (3) Writes them to disk as a packed light curve store (see lcstore), keyed to ts-<n>.txt names
+        (4) Optionally also writes one text file per light curve
     """
     light_curves = make_n_ts(num_lcs)
     print("Generating %d light-curve files" % num_lcs, end="")
     clear_dir(lc_dir)
-    for i, ts in enumerate(light_curves):
-        if i % 50 == 0:
-            print('.', end="")
-        write_ts(ts,i,lc_dir)
+    save_curves({"ts-{}.txt".format(i): ts for i, ts in enumerate(light_curves)}, lc_dir)
+    if text:
+        for i, ts in enumerate(light_curves):
+            if i % 50 == 0:
+                print('.', end="")
+            write_ts(ts,i,lc_dir)
     print("Done.")
 
 if __name__ == "__main__":
@@ -116,12 +122,14 @@ if __name__ == "__main__":
 
     need_help = False
     delete = False
+    text = False
     num_lcs = 1000
 
     # First, identify which flags were included
     for arg in sys.argv[1:]:
         if arg.lower() in ['-h','--help', 'help']: need_help = True
         elif arg.lower() in ['-d','--delete']: delete = True
+        elif arg.lower() in ['-t','--text']: text = True
         elif int(sys.argv[1]) > 0 and int(sys.argv[1]) < 100000:
             num_lcs = int(sys.argv[1])
 
@@ -140,7 +148,7 @@ if __name__ == "__main__":
 
         cmd = input('\nErase existing files in "%s" directory and generate %d new simulated light-curves?(Y/n):\n' %(LIGHT_CURVES_DIR, num_lcs))
         if cmd.lower() == 'y' or cmd.lower() == 'yes' or cmd == '':
-            make_lc_files(num_lcs,LIGHT_CURVES_DIR)
+            make_lc_files(num_lcs,LIGHT_CURVES_DIR,text)
             print("\nExiting.")
             break
         else:
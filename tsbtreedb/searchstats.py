@@ -0,0 +1,84 @@
+#!/usr/local/bin/python3
+# -*- coding: utf-8 -*-
+#
+# CS207 Group Project Part 7
+# Created by Team 2 (Jonne Seleva, Nathaniel Burbank, Nicholas Ruta, Rohan Thavarajah) for Team 4
+
+# Per-query timings and counters for similarity search. Search functions take an optional
+# SearchStats and record into it; stage() and count() do nothing when it is None, so the
+# instrumentation costs nothing when it is not asked for.
+
+import json
+import time
+from contextlib import contextmanager
+
+# Stages, in the order a query goes through them
+STAGES = ['input_load', 'vp_distances', 'db_chop', 'lower_bounds', 'candidate_load', 'candidate_scoring']
+
+class SearchStats(object):
+    """
+    Timings (in seconds) and counters for one query.
+
+    Stage timings accumulate, so a stage entered several times (e.g. candidate scoring in batches)
+    reports its total. Counters used by simsearch:
+        chop_candidates: light curves returned by the DB range scan
+        distance_evals: full kernel distances computed, vantage points included
+        pruned: light curves never scored because their bounds ruled them out
+    """
+
+    def __init__(self, **info):
+        self.info = dict(info)
+        self.timings = {}
+        self.counters = {}
+
+    @contextmanager
+    def stage(self, name):
+        "time the enclosed block and add it to stage name"
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = self.timings.get(name, 0.0) + time.perf_counter() - start
+
+    def count(self, name, n=1):
+        "add n to counter name"
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def total_time(self):
+        return sum(self.timings.values())
+
+    def as_dict(self):
+        "the stats as a plain dict (JSON serializable as long as info is)"
+        return {'info': dict(self.info), 'timings': dict(self.timings), 'counters': dict(self.counters),
+                'total_time': self.total_time()}
+
+    def write_jsonl(self, path):
+        "append the stats as one JSON line to path"
+        with open(path, 'a') as f:
+            f.write(json.dumps(self.as_dict()) + "\n")
+
+    def summary(self):
+        "human readable multi-line summary"
+        lines = []
+        for name in STAGES + sorted(set(self.timings) - set(STAGES)):
+            if name in self.timings:
+                lines.append("  %-18s %9.3f ms" % (name, 1000 * self.timings[name]))
+        lines.append("  %-18s %9.3f ms" % ('total', 1000 * self.total_time()))
+        for name in sorted(self.counters):
+            lines.append("  %-18s %9d" % (name, self.counters[name]))
+        return "\n".join(lines)
+
+@contextmanager
+def _no_stage():
+    yield
+
+def stage(stats, name):
+    """Times a block into stats if stats is given: with stage(stats, 'db_chop'): ..."""
+    if stats is None:
+        return _no_stage()
+    return stats.stage(name)
+
+def count(stats, name, n=1):
+    """Adds n to a counter of stats if stats is given"""
+    if stats is not None:
+        stats.count(name, n)
@@ -22,3 +22,26 @@ DB_DIR = "vp_dbs/"
 SAMPLE_DIR = "sample_data/"
 TEMP_DIR = "temp/"
 TS_LENGTH = 100 #Number of data points for generated time series
+CURVES_FILE = "curves.npy" #Values of every light curve on the shared grid, stored in LIGHT_CURVES_DIR
+CURVES_IDS_FILE = "curves_ids.pkl" #Row index and time grid for CURVES_FILE
+SELF_KERNELS_FILE = "self_kernels.pkl" #Cached K(x,x) normalizers, stored in LIGHT_CURVES_DIR
+SPECTRA_FILE = "spectra.npy" #Standardized rfft spectra of every light curve, stored in LIGHT_CURVES_DIR
+SPECTRA_IDS_FILE = "spectra_ids.pkl" #Row index for SPECTRA_FILE
+INDEX_LOG_MIN = 1024 #Ids appended to a row index's log before it may be folded back into the index (see lcstore.append_index)
+DIST_MATRIX_FILE = "distances.npy" #All-pairs kernel distance matrix, stored in DB_DIR
+VP_DIST_MATRIX_FILE = "vp_distances.npy" #Vantage point to light curve distance matrix, stored in DB_DIR
+VP_TREE_FILE = "vptree.npy" #Nodes of the vantage point tree, stored in DB_DIR
+VP_TREE_LEAVES_FILE = "vptree_leaves.npy" #Light curve rows of the vantage point tree's leaves
+VP_TREE_IDS_FILE = "vptree_ids.pkl" #Light curve filenames the vantage point tree was built over
+VP_TREE_LEAF_SIZE = 32 #Largest number of light curves in a vantage point tree leaf
+INDEX_GENERATION_FILE = "generation.txt" #Counter bumped by genvpdbs and ingest whenever the indexes change, stored in DB_DIR
+DIST_BLOCK_SIZE = 128 #Rows/columns per tile when building distance matrices
+VP_STRATEGIES = ['random', 'farthest', 'spread'] #Vantage point selection strategies (see vpselect)
+BRUTE_FORCE_BLOCK = 1024 #Light curves scored per block by brute-force search
+BRUTE_FORCE_THRESHOLD = 50000 #simsearch scores every light curve instead of using the index below this many
+KNN_BATCH_SIZE = 64 #Candidates scored per batch by k-NN search
+BATCH_QUERY_CHUNK = 64 #Queries searched together by batch mode
+SEARCH_SERVER_ADDRESS = ("localhost", 5207) #Default TCP address of the similarity search server (see simserver)
+LC_CACHE_BYTES = 64 * 1024 * 1024 #Memory bound of the light curve cache in simsearch.load_ts
+BENCH_DIR = "benchmarks/" #Scratch directory for the collections generated by benchmark.py
+BENCH_SEED = 207 #Default random seed of benchmark.py
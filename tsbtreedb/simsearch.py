@@ -8,15 +8,23 @@ import sys
 import os
 import numpy as np
 import random
+import heapq
 
-from crosscorr import standardize, kernel_dist
+from crosscorr import standardize, standardize_values, spectrum, kernel_dist_many, kernel_dist_spectra
+from crosscorr import kernel_dist_matrix, self_kernels_spectra
 from makelcs import make_lc_files
 from genvpdbs import create_vpdbs
 from unbalancedDB import connect
+from lcstore import load_self_kernels, lookup_self_kernels, has_spectra, SpectralStore, has_curves, CurveStore, index_version
+from distmatrix import DistanceMatrix, has_distance_matrix
+from cache import LRUCache
+from searchstats import SearchStats, stage, count
+from vptree import VPTree, has_vp_tree
 
 # Global variables
 
-from settings import LIGHT_CURVES_DIR, DB_DIR, SAMPLE_DIR, TS_LENGTH, ats
+from settings import LIGHT_CURVES_DIR, DB_DIR, SAMPLE_DIR, TS_LENGTH, VP_DIST_MATRIX_FILE, KNN_BATCH_SIZE, BATCH_QUERY_CHUNK
+from settings import SEARCH_SERVER_ADDRESS, LC_CACHE_BYTES, CURVES_IDS_FILE, BRUTE_FORCE_BLOCK, BRUTE_FORCE_THRESHOLD, ats
 
 HELP_MESSAGE = \
 """
@@ -30,26 +38,88 @@ Optional flags:
   -p, --plot        Plot submitted light curve with most similar curve in database
   -r, --rebuild     Recreates light curve files vantage point indexes (Run automatically on first use)
   -d, --demo        Loads a random time series from sample data folder and runs similarity search
-
-"""
-USAGE = "Usage: ./simsearch input_ts.txt [optional flags]"
-
-def load_nparray(filepath):
-    """Helper to load space delimited nparray from disk"""
+  -k N              Return the N most similar light curves (bounded by the distances to every vantage point)
+  --budget N        Approximate search: score at most N candidates per query and report the achieved bound
+  --range R         Stream every light curve within kernel distance R instead of the closest ones
+  -t, --stats       Print per-stage timings and pruning counters of the search
+  --stats-log PATH  Append the timings and counters of the search to PATH as a JSON line
+  -i, --index       Always use the vantage point index (collections under %d light curves are otherwise
+                    searched by brute force, which is faster at that size)
+  -b, --batch       Search every input file (or every file in an input directory) in one batch
+  -c, --client      Send the search to a running simserver instead of loading the indexes
+  --server ADDR     simserver address for --client: host:port or a Unix socket path (Defaults to localhost:5207)
+
+""" % BRUTE_FORCE_THRESHOLD
+USAGE = "Usage: ./simsearch input_ts.txt [optional flags]\n       ./simsearch -b input_dir_or_files... [-k N]"
+
+def load_nparray(filepath, usecols=None):
+    """Helper to load space delimited nparray from disk (only columns usecols, when given)"""
     try:
-        nparray = np.loadtxt(filepath)
+        nparray = np.loadtxt(filepath, usecols=usecols, ndmin=2)
     except(IOError):
         raise IOError("Unable to load np array %s" % filepath)
     else:
         return nparray
 
+def resample(times, values, grid):
+    """
+    Resamples a light curve onto grid: dedupes and sorts by time, then interpolates linearly,
+    holding the first and last values beyond the ends (the same rules as ArrayTimeSeries.interpolate).
+
+    Args:
+        times: times of the observations, in any order and possibly repeated
+        values: observed values (the first observation is kept for a repeated time)
+        grid: times to resample at
+    Returns:
+        Numpy array of values at the grid times
+    """
+    order = np.argsort(times, kind='stable')
+    times, values = times[order], values[order]
+    first = np.empty(len(times), dtype=bool)
+    first[:1] = True
+    np.not_equal(times[1:], times[:-1], out=first[1:])
+    return np.interp(grid, times[first], values[first])
+
+def ts_nbytes(ts):
+    """Approximate memory used by an ArrayTimeSeries: its times and values arrays"""
+    return ts.times().nbytes + ts.values().nbytes
+
+# Light curves loaded by load_ts, keyed to absolute file path. Cached objects are shared between callers,
+# so they must not be modified. Call lc_cache.clear() after rewriting light curve files.
+lc_cache = LRUCache(LC_CACHE_BYTES, sizeof=ts_nbytes)
+
+def read_ts(filepath):
+    """Reads a two column (time, value) text file into an ArrayTimeSeries"""
+    times, values = load_nparray(filepath, usecols=(0, 1)).T
+    return ats.ArrayTimeSeries(times=times,values=values)
+
+# Open packed light curve stores, keyed to absolute directory path: (version of the row index, CurveStore)
+_curve_stores = {}
+
+def open_curves(lc_dir=LIGHT_CURVES_DIR):
+    """
+    Returns the packed light curve store of lc_dir, or None if it has not been built.
+    The store is kept open between calls and reopened when its row index changes on disk.
+    """
+    if not has_curves(lc_dir):
+        return None
+    key = os.path.abspath(lc_dir)
+    version = index_version(lc_dir + CURVES_IDS_FILE)
+    cached = _curve_stores.get(key)
+    if cached is None or cached[0] != version:
+        cached = _curve_stores[key] = (version, CurveStore(lc_dir))
+    return cached[1]
+
 def load_ts(ts_fname):
-    """Helper to load previously generated ts file from disk"""
+    """
+    Helper to load a previously generated light curve: a row of the packed light curve store,
+    or a text file on disk (served from lc_cache when possible) for curves that have not been packed
+    """
     if ts_fname.startswith("ts-"):
-        filepath = LIGHT_CURVES_DIR + ts_fname
-        data = load_nparray(filepath)
-        times, values = data.T
-        return ats.ArrayTimeSeries(times=times,values=values)
+        curves = open_curves()
+        if curves is not None and ts_fname in curves:
+            return curves.timeseries(ts_fname)
+        return lc_cache.get_or_load(os.path.abspath(LIGHT_CURVES_DIR + ts_fname), read_ts)
     else:
         raise ValueError("'%s' does not appear to be a time series file" % ts_fname)
 
@@ -62,21 +132,19 @@ def load_external_ts(filepath):
     Returns:
         A 100 point interpolated ArrayTimeSeries object for times between 0 and 1.
     Notes:
-        - Only considers the first two columns of the text file (other columns are discarded)
+        - Only parses the first two columns of the text file (other columns are skipped)
         - Only evaluates time values between 0 and 1
         - First column is presumed to be times and second column is presumed to be light curve values.
+        - Rows with a repeated time are dropped (the first is kept) and rows need not be sorted.
     """
-    data = load_nparray(filepath)
-    data = data[:,:2] # truncate to first 2 cols
-
-    # Remove rows with duplicate time values (if they exist) and resorts to ensure ts in ascending order
-    _, indices = np.unique(data[:, 0], return_index=True)
-    data = data[indices, :]
+    times, values = load_nparray(filepath, usecols=(0, 1)).T
+    grid = np.arange(0.0, 1.0, (1.0 /TS_LENGTH))
+    return ats.ArrayTimeSeries(times=grid,values=resample(times, values, grid))
 
-    times, values = data.T
-    full_ts = ats.ArrayTimeSeries(times=times,values=values)
-    interpolated_ats = full_ts.interpolate(np.arange(0.0, 1.0, (1.0 /TS_LENGTH)))
-    return interpolated_ats
+def list_vps(db_dir=DB_DIR):
+    """Based on names of vantage point db files returns filenames of the vantage point light curves"""
+    return [file[:-5] + '.txt' for file in os.listdir(db_dir)
+            if file.startswith("ts-") and file.endswith(".dbdb")]
 
 def load_vp_lcs():
     """
@@ -84,59 +152,443 @@ def load_vp_lcs():
     of identified vantage points from disk
     """
     vp_dict= {}
-    for file in os.listdir(DB_DIR):
-        if file.startswith("ts-") and file.endswith(".dbdb"):
-            lc_id = file[:-5] + '.txt'
-            vp_dict[lc_id] = load_ts(lc_id)
+    for lc_id in list_vps():
+        vp_dict[lc_id] = load_ts(lc_id)
     #print("Loaded %d vp files" % len(vps_dict))
     return vp_dict
 
-def find_closest_vp(vps_dict, ts):
+def open_spectra(lc_dir=LIGHT_CURVES_DIR):
+    """Opens the memory-mapped spectral store of the light curves, or returns None if it has not been built"""
+    if has_spectra(lc_dir):
+        return SpectralStore(lc_dir)
+    return None
+
+def calc_dists_to(s_ts, ts_fns, self_kernels=None, store=None, stats=None, stages=('candidate_load', 'candidate_scoring')):
+    """
+    Calculates kernel distances from standardized time series s_ts to stored light curves ts_fns.
+
+    Uses the precomputed spectra in store when they cover every curve (one multiply plus
+    one inverse FFT per curve), and falls back to loading the light curves otherwise.
+    With a SearchStats, loading and scoring are timed into the two given stages.
+    """
+    count(stats, 'distance_evals', len(ts_fns))
+    load_stage, score_stage = stages
+    cand_self = lookup_self_kernels(ts_fns, self_kernels)
+    if store is not None and all(ts_fn in store for ts_fn in ts_fns):
+        with stage(stats, load_stage):
+            spectra = store.spectra(ts_fns)
+        with stage(stats, score_stage):
+            return kernel_dist_spectra(spectrum(s_ts), spectra, store.length, cand_self=cand_self)
+    with stage(stats, load_stage):
+        curves = open_curves()
+        if curves is not None and all(ts_fn in curves for ts_fn in ts_fns):
+            candidates = standardize_values(curves.values_many(ts_fns))
+        else:
+            candidates = standardize_values([load_ts(ts_fn).values() for ts_fn in ts_fns])
+    with stage(stats, score_stage):
+        return kernel_dist_many(s_ts, candidates, cand_self=cand_self)
+
+def find_closest_vp(vps, ts, self_kernels=None, store=None, stats=None):
     """
     Calculates distances from ts to all vantage points.
     Returns tuple with filename of closest vantage point and distance to that vantage point.
+
+    vps can be a dict of vantage point curves keyed to filename or just a list of filenames.
     """
     s_ts = standardize(ts)
-    vp_distances = sorted([(kernel_dist(s_ts, standardize(vps_dict[vp])),vp) for vp in vps_dict])
-    dist_to_vp, vp_fn = vp_distances[0]
-    return (vp_fn,dist_to_vp)
+    vp_fns = list(vps)
+    vp_dists = calc_dists_to(s_ts, vp_fns, self_kernels, store, stats, ('vp_distances', 'vp_distances'))
+    closest = np.argmin(vp_dists)
+    return (vp_fns[closest],float(vp_dists[closest]))
 
-def search_vpdb(vp_t,ts):
+def search_vpdb(vp_t,ts,self_kernels=None,store=None,stats=None):
     """
     Searches for most similar light curve based on pre-computed distances in vpdb
 
     Args:
         vp_t: tuple containing vantage point filename and distance of time series to vantage point
         ts: time series to search on.
+        self_kernels: optional dict of cached K(x,x) normalizers keyed to filename
+        store: optional SpectralStore with the precomputed spectra of the light curves
+        stats: optional SearchStats to record stage timings and counters into
     Returns:
         Tuple: Distance to closest light curve, filename of closest light curve, ats object for closest light curve
 
     """
 
     vp_fn, dist_to_vp = vp_t
-    db_path = DB_DIR + vp_fn[:-4] + ".dbdb"
-    db = connect(DB_DIR + vp_fn[:-4] + ".dbdb")
     s_ts = standardize(ts)
 
     # Identify light curves in selected vantage db that are up to 2x the distance
     # that the time series is from the vantage point
-    lc_candidates = db.chop(2 * dist_to_vp)
-    db.close()
+    with stage(stats, 'db_chop'):
+        db = connect(DB_DIR + vp_fn[:-4] + ".dbdb")
+        lc_candidates = db.chop(2 * dist_to_vp)
+        db.close()
+    count(stats, 'chop_candidates', len(lc_candidates))
+    if stats is not None:
+        stats.info.update(vp=vp_fn, chop_radius=2 * dist_to_vp)
+        if store is not None:
+            count(stats, 'pruned', len(store) - 1 - len(lc_candidates))
 
     # Vantage point is ts to beat as we search through candidate light curves
     min_dist = dist_to_vp
     closest_ts_fn = vp_fn
-    closest_ts = load_ts(vp_fn)
 
-    for d_to_vp,ts_fn in lc_candidates:
-        candidate_ts = load_ts(ts_fn)
-        dist_to_ts = kernel_dist(standardize(candidate_ts),s_ts)
-        if (dist_to_ts < min_dist):
-            min_dist = dist_to_ts
-            closest_ts_fn = ts_fn
-            closest_ts = candidate_ts
+    if len(lc_candidates) > 0:
+        # Score every candidate against the input in one batched pass
+        candidate_fns = [ts_fn for d_to_vp,ts_fn in lc_candidates]
+        dists_to_ts = calc_dists_to(s_ts, candidate_fns, self_kernels, store, stats)
+        best = np.argmin(dists_to_ts)
+        if (dists_to_ts[best] < min_dist):
+            min_dist = float(dists_to_ts[best])
+            closest_ts_fn = candidate_fns[best]
+
+    return(min_dist,closest_ts_fn,load_ts(closest_ts_fn))
+
+def open_vp_matrix(db_dir=DB_DIR):
+    """Opens the vantage point to light curve distance matrix written by genvpdbs, or returns None if there is none"""
+    if has_distance_matrix(db_dir + VP_DIST_MATRIX_FILE):
+        return DistanceMatrix(db_dir + VP_DIST_MATRIX_FILE)
+    return None
+
+def open_vp_tree(store, db_dir=DB_DIR):
+    """Opens the vantage point tree written by genvpdbs, or returns None if there is none or it was built over other light curves"""
+    if store is None or not has_vp_tree(db_dir):
+        return None
+    tree = VPTree(db_dir)
+    return tree if tree.matches(store) else None
+
+def knn_search(ts,k=5,self_kernels=None,store=None,vp_matrix=None,stats=None):
+    """
+    Searches for the k most similar light curves, using the distances to every vantage point.
 
-    return(min_dist,closest_ts_fn,closest_ts)
+    By the triangle inequality, |d(q,vp) - d(c,vp)| <= d(q,c) for every vantage point, so the largest
+    of these is a lower bound on the distance to candidate c. Candidates are scored in order of their
+    lower bound, in batches, and the search stops as soon as the next lower bound is no better than
+    the current k-th best distance.
+
+    Args:
+        ts: time series to search on.
+        k: number of light curves to return. Defaults to 5.
+        self_kernels: optional dict of cached K(x,x) normalizers keyed to filename
+        store: optional SpectralStore with the precomputed spectra of the light curves
+        vp_matrix: DistanceMatrix of vantage point to light curve distances (Defaults to the one in DB_DIR)
+        stats: optional SearchStats to record stage timings and counters into
+    Returns:
+        List of (distance, filename) tuples for the k closest light curves, closest first
+    """
+    return approx_search(ts,k,None,self_kernels,store,vp_matrix,stats)[0]
+
+def approx_search(ts,k=5,budget=None,self_kernels=None,store=None,vp_matrix=None,stats=None):
+    """
+    knn_search with a hard limit on the number of candidate light curves scored.
+
+    Candidates are visited in order of their lower bound, so when the budget runs out every light
+    curve that was not scored is at least as far away as the next lower bound. Results closer than
+    that bound are exact; if the bound is no smaller than the k-th distance, the whole result is.
+
+    Args:
+        ts: time series to search on.
+        k: number of light curves to return. Defaults to 5.
+        budget: most candidates to score, on top of the vantage points (Defaults to no limit)
+        self_kernels: optional dict of cached K(x,x) normalizers keyed to filename
+        store: optional SpectralStore with the precomputed spectra of the light curves
+        vp_matrix: DistanceMatrix of vantage point to light curve distances (Defaults to the one in DB_DIR)
+        stats: optional SearchStats to record stage timings and counters into
+    Returns:
+        Tuple: list of (distance, filename) tuples for the k closest light curves found, closest first,
+        and the achieved bound (the smallest possible distance of any light curve not scored; inf
+        when the search was exhaustive)
+    """
+    if budget is not None and budget < 0:
+        raise ValueError("budget must be at least 0 (got %d)" % budget)
+    if vp_matrix is None:
+        vp_matrix = open_vp_matrix()
+    if vp_matrix is None:
+        raise ValueError("No vantage point distance matrix found in %s; rebuild the indexes with -r" % DB_DIR)
+    s_ts = standardize(ts)
+    vps = vp_matrix.row_ids
+    lc_ids = vp_matrix.col_ids
+
+    # Exact distances to the vantage points seed the heap of the best k found so far
+    q_to_vps = calc_dists_to(s_ts, vps, self_kernels, store, stats, ('vp_distances', 'vp_distances'))
+    best = []
+    for dist, vp in zip(q_to_vps.tolist(), vps):
+        _push_bounded(best, k, dist, vp)
+
+    with stage(stats, 'lower_bounds'):
+        lower_bounds = _lower_bounds(np.asarray(vp_matrix.values), q_to_vps)
+        vp_set = set(vps)
+        order = [i for i in np.argsort(lower_bounds, kind='stable') if lc_ids[i] not in vp_set]
+
+    bound = np.inf
+    scored = 0
+    for start in range(0, len(order), KNN_BATCH_SIZE):
+        batch = order[start:start + KNN_BATCH_SIZE]
+        kth_dist = -best[0][0] if len(best) == k else np.inf
+        # Everything from here on is at least this far away, so nothing left can make the top k
+        if lower_bounds[batch[0]] >= kth_dist:
+            bound = float(lower_bounds[batch[0]])
+            break
+        out_of_budget = budget is not None and scored + len(batch) > budget
+        if out_of_budget:
+            # The first candidate that will not be scored has the smallest lower bound of those left
+            bound = float(lower_bounds[batch[budget - scored]])
+            batch = batch[:budget - scored]
+        batch = [i for i in batch if lower_bounds[i] < kth_dist]
+        batch_fns = [lc_ids[i] for i in batch]
+        if len(batch_fns) > 0:
+            for dist, ts_fn in zip(calc_dists_to(s_ts, batch_fns, self_kernels, store, stats).tolist(), batch_fns):
+                _push_bounded(best, k, dist, ts_fn)
+        scored += len(batch)
+        if out_of_budget:
+            break
+
+    count(stats, 'pruned', len(order) - scored)
+    return sorted((-neg_dist, ts_fn) for neg_dist, ts_fn in best), bound
+
+def brute_force_search(ts,k=5,self_kernels=None,store=None,block=BRUTE_FORCE_BLOCK,stats=None):
+    """
+    Exact top-k search by scoring every light curve, without any index.
+
+    The stored spectra (or, without a spectral store, the packed light curves) are streamed through
+    the vectorized distance kernel block rows at a time, so the working set stays cache sized, and
+    only the best k of each block are kept.
+
+    Args:
+        ts: time series to search on.
+        k: number of light curves to return. Defaults to 5.
+        self_kernels: optional dict of cached K(x,x) normalizers keyed to filename
+        store: optional SpectralStore with the precomputed spectra of the light curves
+        block: light curves scored per block
+        stats: optional SearchStats to record stage timings and counters into
+    Returns:
+        List of (distance, filename) tuples for the k closest light curves, closest first
+    """
+    s_ts = standardize(ts)
+    curves = None
+    if store is not None:
+        ids = store.ids
+        q_spec = spectrum(s_ts)
+        q_self = self_kernels_spectra(q_spec, store.length)
+    else:
+        curves = open_curves()
+        if curves is None:
+            raise ValueError("No light curve store found in %s; rebuild the indexes with -r" % LIGHT_CURVES_DIR)
+        ids = curves.ids
+    all_self = lookup_self_kernels(ids, self_kernels)
+
+    best_dists = np.empty(0)
+    best_rows = np.empty(0, dtype=np.intp)
+    for start in range(0, len(ids), block):
+        rows = slice(start, min(start + block, len(ids)))
+        cand_self = None if all_self is None else all_self[rows]
+        with stage(stats, 'candidate_load'):
+            if curves is None:
+                spectra = store.spectra_at(rows)
+            else:
+                values = standardize_values(curves.values_many(ids[rows]))
+        with stage(stats, 'candidate_scoring'):
+            if curves is None:
+                dists = kernel_dist_spectra(q_spec, spectra, store.length, ts_self=q_self, cand_self=cand_self)
+            else:
+                dists = kernel_dist_many(s_ts, values, cand_self=cand_self)
+            best_dists = np.concatenate((best_dists, dists))
+            best_rows = np.concatenate((best_rows, np.arange(rows.start, rows.stop)))
+            if len(best_dists) > k:
+                keep = np.argpartition(best_dists, k - 1)[:k]
+                best_dists, best_rows = best_dists[keep], best_rows[keep]
+    count(stats, 'distance_evals', len(ids))
+    return sorted((float(dist), ids[row]) for dist, row in zip(best_dists, best_rows))
+
+def use_brute_force(store):
+    """Whether the collection is small enough that brute_force_search beats the vantage point index"""
+    return store is not None and len(store) < BRUTE_FORCE_THRESHOLD
+
+def range_search(ts,radius,self_kernels=None,store=None,vp_matrix=None,db_dir=DB_DIR):
+    """
+    Finds every light curve within kernel distance radius of ts, yielding matches as they are found.
+
+    A vantage point DB is keyed on distance to its vantage point, and by the triangle inequality a
+    match c has d(q,vp) - radius <= d(c,vp) <= d(q,vp) + radius. That range is scanned on the DB of
+    the closest vantage point; when the vantage point distance matrix is available, the scanned
+    candidates are also checked against the same bound for every other vantage point. Only the
+    survivors are scored, in batches of KNN_BATCH_SIZE.
+
+    Args:
+        ts: time series to search on.
+        radius: largest kernel distance to report
+        self_kernels: optional dict of cached K(x,x) normalizers keyed to filename
+        store: optional SpectralStore with the precomputed spectra of the light curves
+        vp_matrix: optional DistanceMatrix of vantage point to light curve distances
+        db_dir: vantage point DB directory
+    Yields:
+        Tuple: distance, filename of each light curve within radius (in no particular order)
+    """
+    s_ts = standardize(ts)
+    vps = list_vps(db_dir)
+    q_to_vps = calc_dists_to(s_ts, vps, self_kernels, store)
+    for dist, vp in zip(q_to_vps.tolist(), vps):
+        if dist <= radius:
+            yield (dist, vp)
+
+    q_by_vp = dict(zip(vps, q_to_vps.tolist()))
+    vp_set = set(vps)
+    if vp_matrix is not None and not vp_set.issuperset(vp_matrix.row_ids):
+        vp_matrix = None
+    if vp_matrix is not None:
+        q_to_rows = np.array([q_by_vp[vp] for vp in vp_matrix.row_ids])
+
+    def score(batch_fns):
+        if vp_matrix is not None:
+            cols = [vp_matrix.col_index(ts_fn) for ts_fn in batch_fns]
+            lower_bounds = _lower_bounds(np.asarray(vp_matrix.values[:, cols]), q_to_rows)
+            batch_fns = [ts_fn for ts_fn, bound in zip(batch_fns, lower_bounds) if bound <= radius]
+        if len(batch_fns) == 0:
+            return []
+        return [(dist, ts_fn) for dist, ts_fn in zip(calc_dists_to(s_ts, batch_fns, self_kernels, store).tolist(), batch_fns)
+                if dist <= radius]
+
+    closest_vp = vps[int(np.argmin(q_to_vps))]
+    d_vp = q_by_vp[closest_vp]
+    db = connect(db_dir + closest_vp[:-4] + ".dbdb")
+    try:
+        batch_fns = []
+        for d_to_vp, ts_fn in db.range(d_vp - radius, d_vp + radius):
+            if ts_fn in vp_set:
+                continue
+            batch_fns.append(ts_fn)
+            if len(batch_fns) == KNN_BATCH_SIZE:
+                for match in score(batch_fns):
+                    yield match
+                batch_fns = []
+        for match in score(batch_fns):
+            yield match
+    finally:
+        db.close()
+
+def load_batch(queries):
+    """
+    Loads a batch of queries for batch_search.
+
+    Args:
+        queries: a directory of input files, a list of input file paths, or a (Q x TS_LENGTH)
+            array of values on the shared time grid
+    Returns:
+        Tuple: list of query names (file paths, or row numbers for an array), (Q x TS_LENGTH) array of values
+    """
+    if isinstance(queries, str):
+        if not os.path.isdir(queries):
+            raise ValueError("'%s' is not a directory of time series files" % queries)
+        queries = [os.path.join(queries, file) for file in sorted(os.listdir(queries))
+                   if file.endswith(".txt") or file.endswith(".dat_folded")]
+    if isinstance(queries, np.ndarray):
+        values = np.atleast_2d(np.asarray(queries, dtype=np.float64))
+        return list(range(len(values))), values
+    names = list(queries)
+    return names, np.array([load_external_ts(fpath).values() for fpath in names])
+
+def batch_search(queries,k=1,self_kernels=None,store=None,vp_matrix=None,stats=None):
+    """
+    Runs knn_search for a whole batch of queries, loading the index data once.
+
+    Query to vantage point distances are computed as one matrix. Queries are then searched together
+    in chunks of BATCH_QUERY_CHUNK: each round takes the next batch of candidates of every query
+    still running, and the spectra of the union of those candidates are fetched once for all of them.
+
+    Args:
+        queries: a directory of input files, a list of input file paths, or a (Q x TS_LENGTH) array of values
+        k: number of light curves to return per query. Defaults to 1.
+        self_kernels: optional dict of cached K(x,x) normalizers (Defaults to the cached ones)
+        store: SpectralStore of the light curves (Defaults to the one in LIGHT_CURVES_DIR)
+        vp_matrix: DistanceMatrix of vantage point to light curve distances (Defaults to the one in DB_DIR)
+        stats: optional SearchStats to record stage timings and counters into (totals over the batch)
+    Returns:
+        Tuple: list of query names, list of results per query (each a list of (distance, filename), closest first)
+    """
+    if store is None:
+        store = open_spectra()
+    if vp_matrix is None:
+        vp_matrix = open_vp_matrix()
+    if store is None or vp_matrix is None:
+        raise ValueError("Batch search needs the spectral store and vantage point matrix; rebuild the indexes with -r")
+    if self_kernels is None:
+        self_kernels = load_self_kernels(LIGHT_CURVES_DIR)
+
+    with stage(stats, 'input_load'):
+        names, values = load_batch(queries)
+    n = store.length
+    q_specs = spectrum(standardize_values(values))
+    q_self = self_kernels_spectra(q_specs, n)
+    vps = vp_matrix.row_ids
+    lc_ids = vp_matrix.col_ids
+    vp_set = set(vps)
+    vp_dists = np.asarray(vp_matrix.values)
+    cand_self = lookup_self_kernels(lc_ids, self_kernels)
+
+    with stage(stats, 'vp_distances'):
+        q_to_vps = kernel_dist_matrix(q_specs, store.spectra(vps), n, x_self=q_self,
+                                      y_self=lookup_self_kernels(vps, self_kernels))
+    count(stats, 'distance_evals', len(names) * len(vps))
+
+    results = []
+    for c0 in range(0, len(names), BATCH_QUERY_CHUNK):
+        chunk = range(c0, min(c0 + BATCH_QUERY_CHUNK, len(names)))
+        best, orders, bounds, next_pos, scored = {}, {}, {}, {}, {}
+        for q in chunk:
+            best[q] = []
+            for dist, vp in zip(q_to_vps[q].tolist(), vps):
+                _push_bounded(best[q], k, dist, vp)
+            with stage(stats, 'lower_bounds'):
+                bounds[q] = _lower_bounds(vp_dists, q_to_vps[q])
+                orders[q] = [i for i in np.argsort(bounds[q], kind='stable') if lc_ids[i] not in vp_set]
+            next_pos[q] = 0
+            scored[q] = 0
+
+        running = set(chunk)
+        while running:
+            wanted = {}
+            for q in list(running):
+                batch = orders[q][next_pos[q]:next_pos[q] + KNN_BATCH_SIZE]
+                next_pos[q] += KNN_BATCH_SIZE
+                kth_dist = -best[q][0][0] if len(best[q]) == k else np.inf
+                if len(batch) == 0 or bounds[q][batch[0]] >= kth_dist:
+                    running.discard(q)
+                    continue
+                wanted[q] = [i for i in batch if bounds[q][i] < kth_dist]
+            if not wanted:
+                break
+
+            # Fetch each candidate once, however many queries want it this round
+            fetch = sorted(set(i for cols in wanted.values() for i in cols))
+            with stage(stats, 'candidate_load'):
+                fetched = store.spectra([lc_ids[i] for i in fetch])
+            fetched_row = {i: r for r, i in enumerate(fetch)}
+            for q, cols in wanted.items():
+                with stage(stats, 'candidate_scoring'):
+                    dists = kernel_dist_spectra(q_specs[q], fetched[[fetched_row[i] for i in cols]], n,
+                                                ts_self=q_self[q],
+                                                cand_self=None if cand_self is None else cand_self[cols])
+                for dist, i in zip(dists.tolist(), cols):
+                    _push_bounded(best[q], k, dist, lc_ids[i])
+                scored[q] += len(cols)
+                count(stats, 'distance_evals', len(cols))
+
+        count(stats, 'pruned', sum(len(orders[q]) - scored[q] for q in chunk))
+        results.extend(sorted((-neg_dist, ts_fn) for neg_dist, ts_fn in best[q]) for q in chunk)
+    return names, results
+
+def _lower_bounds(vp_dists, q_to_vps):
+    """Helper: triangle inequality lower bound on the distance from the query to every light curve"""
+    return np.max(np.abs(vp_dists - q_to_vps[:, np.newaxis]), axis=0)
+
+def _push_bounded(heap, k, dist, ts_fn):
+    """Helper to keep the k smallest distances in a max-heap of (-distance, filename)"""
+    if len(heap) < k:
+        heapq.heappush(heap, (-dist, ts_fn))
+    elif dist < -heap[0][0]:
+        heapq.heapreplace(heap, (-dist, ts_fn))
 
 def need_to_rebuild(LIGHT_CURVES_DIR,DB_DIR):
     """Helper to determine whether required lc files and database files already exist or need to be generated"""
@@ -147,11 +599,14 @@ def need_to_rebuild(LIGHT_CURVES_DIR,DB_DIR):
     if not (os.path.isdir(DB_DIR)):
         return True
 
-    # Count correctly named lc files in lc dir
+    # Count packed light curves, or correctly named lc files in lc dir
     lc_files = 0
-    for file in os.listdir(LIGHT_CURVES_DIR):
-        if file.startswith("ts-") and file.endswith(".txt"):
-            lc_files +=1
+    if has_curves(LIGHT_CURVES_DIR):
+        lc_files = len(CurveStore(LIGHT_CURVES_DIR))
+    else:
+        for file in os.listdir(LIGHT_CURVES_DIR):
+            if file.startswith("ts-") and file.endswith(".txt"):
+                lc_files +=1
 
     if lc_files < 10:
         return True
@@ -182,27 +637,109 @@ def rebuild_lcs_dbs(LIGHT_CURVES_DIR):
     """Calls functions to regenerate light curves and rebuild vp indexes"""
     print("\nRebuilding simulated light curves and vantage point index files....\n(This may take up to 30 seconds)")
     make_lc_files(1000, LIGHT_CURVES_DIR)
+    lc_cache.clear()
     create_vpdbs(20, LIGHT_CURVES_DIR)
     print("Indexes rebuilt.\n")
 
-def run_demo(plot=False):
+def run_demo(plot=False,k=None):
     """Loads a random time series from sample data folder and runs similarity search"""
     demo_ts_fn = random.choice(os.listdir(SAMPLE_DIR))
-    sim_search(SAMPLE_DIR + demo_ts_fn,plot)
+    sim_search(SAMPLE_DIR + demo_ts_fn,plot,k)
+
+def sim_batch_search(inputs,k=None,stats=None):
+    """
+    Executes a batch similarity search over directories and/or lists of time series files.
+    Stage timings and counters for the whole batch are recorded into stats when a SearchStats is given.
+    """
+    fpaths = []
+    for fpath in inputs:
+        fpaths.extend(load_batch(fpath)[0] if os.path.isdir(fpath) else [fpath])
+    names, results = batch_search(fpaths,k or 1,stats=stats)
+    print("\n============================ Results ============================")
+    for name, result in zip(names, results):
+        print("%s: %s" % (name, ", ".join("%s (%.5f)" % (ts_fn, dist) for dist, ts_fn in result)))
+
+def print_knn_results(results,input_fpath):
+    """Prints the ranked results of a top-k search"""
+    print("\n============================ Results ============================")
+    print("The %d closest light curves to %s:" % (len(results), input_fpath))
+    for rank, (dist, ts_fn) in enumerate(results):
+        print("%3d. %s (distance: %.5f)" % (rank + 1, ts_fn, dist))
+
+def parse_server_address(addr):
+    """Parses a --server argument: 'host:port' for TCP, anything else is a Unix socket path"""
+    host, sep, port = addr.rpartition(':')
+    if sep and port.isdigit():
+        return (host or SEARCH_SERVER_ADDRESS[0], int(port))
+    return addr
+
+def client_search(input_fpath,k=None,address=SEARCH_SERVER_ADDRESS):
+    """Sends a similarity search to a running simserver, which already has the indexes in memory"""
+    from simserver import SearchClient
+    input_ts = load_external_ts(input_fpath)
+    client = SearchClient(address)
+    try:
+        results = client.knn(input_ts, k or 1)
+    finally:
+        client.close()
+    print_knn_results(results,input_fpath)
 
-def sim_search(input_fpath,plot=False):
-    """Executes similarity search on submitted time series files"""
+def sim_range_search(input_fpath,radius):
+    """Executes range search on a submitted time series file, printing matches as they are found"""
     print("Loading %s..." % input_fpath,end="")
     input_ts = load_external_ts(input_fpath)
     print("Done.")
-    closest_vp = find_closest_vp(load_vp_lcs(), input_ts)
-
-    min_dist,closest_ts_fn,closest_ts = search_vpdb(closest_vp,input_ts)
     print("\n============================ Results ============================")
-    print("%s is the closest light curve to %s" % (closest_ts_fn, input_fpath))
-    print("Distance from %s to %s: %.5f" % (input_fpath, closest_ts_fn, min_dist))
+    print("Light curves within distance %g of %s:" % (radius, input_fpath))
+    found = 0
+    for dist, ts_fn in range_search(input_ts,radius,load_self_kernels(LIGHT_CURVES_DIR),open_spectra(),open_vp_matrix()):
+        print("%s (distance: %.5f)" % (ts_fn, dist))
+        found += 1
+    print("%d light curves found." % found)
+
+def sim_search(input_fpath,plot=False,k=None,budget=None,stats=None,use_index=False):
+    """
+    Executes similarity search on submitted time series files (top-k search when k is given,
+    approximate when a candidate budget is given). Collections smaller than BRUTE_FORCE_THRESHOLD
+    are searched by brute force unless use_index is set; larger ones descend the vantage point tree
+    when genvpdbs built one. Stage timings and counters are recorded into stats when a SearchStats is given.
+    """
+    print("Loading %s..." % input_fpath,end="")
+    with stage(stats, 'input_load'):
+        input_ts = load_external_ts(input_fpath)
+    print("Done.")
+    self_kernels = load_self_kernels(LIGHT_CURVES_DIR)
+    store = open_spectra()
+    tree = open_vp_tree(store) if budget is None else None
+    if budget is not None:
+        results, bound = approx_search(input_ts,k or 1,budget,self_kernels,store,stats=stats)
+        print_knn_results(results,input_fpath)
+        if bound >= results[-1][0]:
+            print("Exact: no light curve that was not scored can be closer than %.5f" % bound)
+        else:
+            print("Approximate: light curves that were not scored are at least %.5f away" % bound)
+    elif not use_index and use_brute_force(store):
+        results = brute_force_search(input_ts,k or 1,self_kernels,store,stats=stats)
+        if k is not None:
+            print_knn_results(results,input_fpath)
+    elif tree is not None:
+        results = tree.knn(input_ts,k or 1,store,self_kernels,stats)
+        if k is not None:
+            print_knn_results(results,input_fpath)
+    elif k is not None:
+        results = knn_search(input_ts,k,self_kernels,store,stats=stats)
+        print_knn_results(results,input_fpath)
+    else:
+        closest_vp = find_closest_vp(list_vps(), input_ts, self_kernels, store, stats)
+        results = [search_vpdb(closest_vp,input_ts,self_kernels,store,stats)[:2]]
+
+    if k is None and budget is None:
+        min_dist, closest_ts_fn = results[0]
+        print("\n============================ Results ============================")
+        print("%s is the closest light curve to %s" % (closest_ts_fn, input_fpath))
+        print("Distance from %s to %s: %.5f" % (input_fpath, closest_ts_fn, min_dist))
     if plot:
-        plot_two_ts(input_ts,input_fpath,closest_ts,closest_ts_fn)
+        plot_two_ts(input_ts,input_fpath,load_ts(results[0][1]),results[0][1])
 
 if __name__ == "__main__":
     """
@@ -214,8 +751,18 @@ if __name__ == "__main__":
     rebuild = need_to_rebuild(LIGHT_CURVES_DIR,DB_DIR)
     need_help = False
     input_fpath = False
+    input_fpaths = []
     plot = False
     demo = False
+    batch = False
+    client = False
+    server_address = SEARCH_SERVER_ADDRESS
+    k = None
+    radius = None
+    budget = None
+    show_stats = False
+    use_index = False
+    stats_log = None
 
     while(True):
         if len(sys.argv) <= 1:
@@ -224,29 +771,78 @@ if __name__ == "__main__":
             break
 
         # First, identify which flags were included
-        for arg in sys.argv[1:]:
+        args = sys.argv[1:]
+        for i, arg in enumerate(args):
             if arg.lower() in ['-h','--help', 'help']: need_help = True
 
             elif '.txt' in arg.lower() or '.dat_folded' in arg.lower():
                 input_fpath = arg
+                input_fpaths.append(arg)
+            elif os.path.isdir(arg): input_fpaths.append(arg)
 
             elif arg.lower() in ['-r','--rebuild']: rebuild = True
             elif arg.lower() in ['-d','--demo']: demo = True
             elif arg.lower() in ['-p','--plot']: plot = True
+            elif arg.lower() == '-k' and i + 1 < len(args): k = int(args[i + 1])
+            elif arg.lower() == '--range' and i + 1 < len(args): radius = float(args[i + 1])
+            elif arg.lower() == '--budget' and i + 1 < len(args): budget = int(args[i + 1])
+            elif arg.lower() in ['-t','--stats']: show_stats = True
+            elif arg.lower() in ['-i','--index']: use_index = True
+            elif arg.lower() == '--stats-log' and i + 1 < len(args): stats_log = args[i + 1]
+            elif arg.lower() in ['-b','--batch']: batch = True
+            elif arg.lower() in ['-c','--client']: client = True
+            elif arg.lower() == '--server' and i + 1 < len(args): server_address = parse_server_address(args[i + 1])
+
+        if budget is not None and budget < 0:
+            print("Error: --budget must be at least 0")
+            print(USAGE)
+            break
 
         # Execute selected options
         if need_help:
             print (HELP_MESSAGE)
             break
+        elif client:
+            # The server owns the indexes, so never rebuild from a client
+            if input_fpath is not False:
+                client_search(input_fpath,k,server_address)
+            else:
+                print("Error: no compatible time series or light curve file provided")
+                print(USAGE)
+            break
         elif rebuild:
             rebuild_lcs_dbs(LIGHT_CURVES_DIR)
 
         if demo:
-            run_demo(plot)
+            run_demo(plot,k)
+            break
+
+        elif radius is not None and input_fpath is not False:
+            sim_range_search(input_fpath,radius)
+            break
+
+        elif batch and len(input_fpaths) > 0:
+            stats = None
+            if show_stats or stats_log is not None:
+                stats = SearchStats(queries=input_fpaths, k=k, vps=len(list_vps()))
+            sim_batch_search(input_fpaths,k,stats)
+            if show_stats:
+                print("\n============================= Stats =============================")
+                print(stats.summary())
+            if stats_log is not None:
+                stats.write_jsonl(stats_log)
             break
 
         elif(input_fpath is not False):
-            sim_search(input_fpath,plot)
+            stats = None
+            if show_stats or stats_log is not None:
+                stats = SearchStats(query=input_fpath, k=k, budget=budget, vps=len(list_vps()))
+            sim_search(input_fpath,plot,k,budget,stats,use_index)
+            if show_stats:
+                print("\n============================= Stats =============================")
+                print(stats.summary())
+            if stats_log is not None:
+                stats.write_jsonl(stats_log)
             break
         else:
             print("Error: no compatible time series or light curve file provided")
@@ -0,0 +1,224 @@
+#!/usr/local/bin/python3
+# -*- coding: utf-8 -*-
+#
+# CS207 Group Project Part 7
+# Created by Team 2 (Jonne Seleva, Nathaniel Burbank, Nicholas Ruta, Rohan Thavarajah) for Team 4
+
+# Long-lived similarity search server. The spectral store, K(x,x) cache and vantage point matrix
+# are loaded once and kept in memory; queries arrive over a TCP or Unix socket as one JSON object
+# per line and are answered with one JSON object per line.
+#
+# Requests:
+#   {"op": "knn", "values": [floats], "k": 5}         values on the shared TS_LENGTH grid
+#   {"op": "batch", "values": [[floats], ...], "k": 1}
+#   {"op": "reload"}                                  reopen the indexes now (knn and batch reopen them
+#                                                     themselves after a genvpdbs rebuild or an ingest)
+#   {"op": "stats"}                                   light curve cache counters and index generation
+#   {"op": "ping"}
+# Responses:
+#   {"results": [[distance, filename], ...]}          ("results" is a list of those for batch)
+#   {"error": message}
+
+import sys
+import os
+import json
+import socket
+import socketserver
+import threading
+import numpy as np
+
+from simsearch import knn_search, batch_search, brute_force_search, use_brute_force, open_spectra, open_vp_matrix, open_vp_tree, lc_cache
+from lcstore import load_self_kernels
+from cache import index_generation
+from settings import LIGHT_CURVES_DIR, DB_DIR, TS_LENGTH, SEARCH_SERVER_ADDRESS, ats
+
+HELP_MESSAGE = \
+"""
+Light Curve Similarity Search Server
+
+Keeps the light curve indexes in memory and answers similarity queries over a socket.
+Query it with: ./simsearch input.txt -c [-k N]
+
+Usage: ./simserver  [optional flags]
+
+Optional flags:
+  -h, --help        Show this help message and exit.
+  --port N          TCP port to listen on (Defaults to 5207, on localhost)
+  --unix PATH       Listen on a Unix socket at PATH instead of TCP
+"""
+
+class SearchIndex(object):
+    """The in-memory indexes used to answer queries"""
+
+    def __init__(self, lc_dir=LIGHT_CURVES_DIR, db_dir=DB_DIR):
+        self.lc_dir = lc_dir
+        self.db_dir = db_dir
+        self._lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+        self.reload()
+
+    def reload(self):
+        "(re)open the spectral store, K(x,x) cache, vantage point matrix and vantage point tree from disk"
+        # read first, so a change made while the files are opened is seen by the next refresh
+        generation = index_generation(self.db_dir)
+        store = open_spectra(self.lc_dir)
+        vp_matrix = open_vp_matrix(self.db_dir)
+        if store is None or vp_matrix is None:
+            raise ValueError("No indexes found in %s and %s; build them with genvpdbs first" % (self.lc_dir, self.db_dir))
+        self_kernels = load_self_kernels(self.lc_dir)
+        tree = open_vp_tree(store, self.db_dir)
+        lc_cache.clear()
+        with self._lock:
+            self.store, self.vp_matrix, self.self_kernels, self.tree = store, vp_matrix, self_kernels, tree
+            self.generation = generation
+
+    def refresh(self):
+        "reload if the indexes on disk are newer than the loaded ones; returns the loaded generation"
+        # a rebuild clears db_dir first, so an older (or missing) generation means one is under way
+        if index_generation(self.db_dir) > self.generation:
+            with self._reload_lock:
+                # another thread may have reloaded while this one waited
+                if index_generation(self.db_dir) > self.generation:
+                    self.reload()
+        return self.generation
+
+    def knn(self, values, k=5):
+        "k most similar light curves to a curve on the shared grid"
+        with self._lock:
+            store, vp_matrix, self_kernels, tree = self.store, self.vp_matrix, self.self_kernels, self.tree
+        ts = ats.ArrayTimeSeries(times=grid(len(values)), values=values)
+        if use_brute_force(store):
+            return brute_force_search(ts, k, self_kernels, store)
+        if tree is not None:
+            return tree.knn(ts, k, store, self_kernels)
+        return knn_search(ts, k, self_kernels, store, vp_matrix)
+
+    def batch(self, values, k=1):
+        "k most similar light curves to each row of a (Q x TS_LENGTH) array"
+        with self._lock:
+            store, vp_matrix, self_kernels = self.store, self.vp_matrix, self.self_kernels
+        return batch_search(np.asarray(values, dtype=np.float64), k, self_kernels, store, vp_matrix)[1]
+
+def grid(length=TS_LENGTH):
+    """The shared time grid that stored light curves are interpolated onto"""
+    return np.arange(0.0, 1.0, (1.0 / length))
+
+def handle_request(index, request):
+    """Dispatches one decoded request to the index and returns the response dict"""
+    op = request.get('op', 'knn')
+    if op == 'ping':
+        return {'ok': True}
+    elif op == 'reload':
+        index.reload()
+        return {'ok': True}
+    elif op == 'stats':
+        return {'cache': lc_cache.stats(), 'generation': index.generation}
+    elif op == 'knn':
+        # picks up indexes rebuilt by genvpdbs or added to by ingest since the last request
+        index.refresh()
+        return {'results': index.knn(request['values'], int(request.get('k', 5)))}
+    elif op == 'batch':
+        index.refresh()
+        return {'results': index.batch(request['values'], int(request.get('k', 1)))}
+    raise ValueError("Unknown op '%s'" % op)
+
+class SearchRequestHandler(socketserver.StreamRequestHandler):
+    """Answers JSON line requests until the client closes the connection"""
+
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                response = handle_request(self.server.index, json.loads(line.decode('utf-8')))
+            except Exception as e:
+                response = {'error': "%s: %s" % (type(e).__name__, e)}
+            self.wfile.write((json.dumps(response) + "\n").encode('utf-8'))
+            self.wfile.flush()
+
+class SearchServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, index):
+        self.index = index
+        socketserver.ThreadingTCPServer.__init__(self, address, SearchRequestHandler)
+
+if hasattr(socketserver, 'ThreadingUnixStreamServer'):
+    class UnixSearchServer(socketserver.ThreadingUnixStreamServer):
+        daemon_threads = True
+
+        def __init__(self, path, index):
+            self.index = index
+            if os.path.exists(path):
+                os.remove(path)
+            socketserver.ThreadingUnixStreamServer.__init__(self, path, SearchRequestHandler)
+
+def make_server(address=SEARCH_SERVER_ADDRESS, index=None):
+    """Creates a server listening on a (host, port) tuple, or on a Unix socket when address is a path"""
+    if index is None:
+        index = SearchIndex()
+    if isinstance(address, str):
+        return UnixSearchServer(address, index)
+    return SearchServer(tuple(address), index)
+
+class SearchClient(object):
+    """Thin client for a running search server; one connection can be reused for many queries"""
+
+    def __init__(self, address=SEARCH_SERVER_ADDRESS):
+        if isinstance(address, str):
+            self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        else:
+            self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            address = tuple(address)
+        self._sock.connect(address)
+        self._file = self._sock.makefile('rwb')
+
+    def request(self, request):
+        "send one request and wait for its response"
+        self._file.write((json.dumps(request) + "\n").encode('utf-8'))
+        self._file.flush()
+        response = json.loads(self._file.readline().decode('utf-8'))
+        if 'error' in response:
+            raise ValueError("Search server error: %s" % response['error'])
+        return response
+
+    def knn(self, ts, k=5):
+        "k most similar light curves to time series ts (already on the shared grid)"
+        values = ts.values().tolist() if hasattr(ts, 'values') else list(ts)
+        return [tuple(r) for r in self.request({'op': 'knn', 'values': values, 'k': k})['results']]
+
+    def batch(self, values, k=1):
+        "k most similar light curves to each row of a (Q x TS_LENGTH) array"
+        return [[tuple(r) for r in result]
+                for result in self.request({'op': 'batch', 'values': np.asarray(values).tolist(), 'k': k})['results']]
+
+    def close(self):
+        self._file.close()
+        self._sock.close()
+
+if __name__ == "__main__":
+    """Starts the server and serves until interrupted."""
+    need_help = False
+    address = SEARCH_SERVER_ADDRESS
+
+    args = sys.argv[1:]
+    for i, arg in enumerate(args):
+        if arg.lower() in ['-h','--help', 'help']: need_help = True
+        elif arg.lower() == '--port' and i + 1 < len(args): address = (SEARCH_SERVER_ADDRESS[0], int(args[i + 1]))
+        elif arg.lower() == '--unix' and i + 1 < len(args): address = args[i + 1]
+
+    while(True):
+        if need_help:
+            print (HELP_MESSAGE)
+            break
+        print("Loading indexes...", end="")
+        server = make_server(address)
+        print("Done.\nListening on %s" % (address,))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            print("\nShutting down.")
+        finally:
+            server.server_close()
+        break
@@ -102,3 +102,618 @@ def test_ccorr():
     assert(kernel_dist(t1,t1) == 0)
 
 
+
+def test_kernel_dist_many():
+    from makelcs import tsmaker, random_ts
+    from crosscorr import kernel_dist, kernel_dist_many, standardize, standardize_values
+    query = standardize(tsmaker(0.5, 0.1, 0.2))
+    others = [tsmaker(0.5, 0.2, 0.5), random_ts(3), tsmaker(0.3, 0.05, 0.01)]
+    candidates = standardize_values([ts.values() for ts in others])
+    dists = kernel_dist_many(query, candidates)
+    assert(len(dists) == 3)
+    for d, ts in zip(dists, others):
+        assert(abs(d - kernel_dist(query, standardize(ts))) < 1e-9)
+    # both paths snap rounding-level distances to zero the same way
+    assert(kernel_dist_many(query, [query.values()])[0] == kernel_dist(query, query) == 0)
+    try:
+        kernel_dist_many(query, [ts.values() for ts in others])
+    except ValueError:
+        pass
+    else:
+        assert False, "unstandardized candidates should raise"
+
+def test_self_kernels():
+    import lcstore
+    from crosscorr import kernel_dist, kernel_dist_many, self_kernel, standardize, standardize_values
+    lc_dir = TEMP_DIR + "self_kernels/"
+    makelcs.make_lc_files(10, lc_dir)
+    ts_dict = genvpdbs.load_ts(lc_dir)
+    saved = lcstore.save_self_kernels(ts_dict, lc_dir)
+    cached = lcstore.load_self_kernels(lc_dir)
+    assert(cached == saved and len(cached) == 10)
+    assert(lcstore.load_self_kernels(lc_dir, mult=2) == {})
+
+    keys = sorted(ts_dict)
+    s1, s2 = standardize(ts_dict[keys[0]]), standardize(ts_dict[keys[1]])
+    assert(abs(cached[keys[0]] - self_kernel(s1)) < 1e-9)
+    assert(abs(kernel_dist(s1, s2, k11=cached[keys[0]], k22=cached[keys[1]]) - kernel_dist(s1, s2)) < 1e-9)
+
+    candidates = standardize_values([ts_dict[k].values() for k in keys])
+    cand_self = lcstore.lookup_self_kernels(keys, cached)
+    assert(np.allclose(kernel_dist_many(s1, candidates, cand_self=cand_self), kernel_dist_many(s1, candidates)))
+    assert(lcstore.lookup_self_kernels(keys + ["ts-missing.txt"], cached) is None)
+    clear_dir(TEMP_DIR,recreate=False)
+
+def test_spectral_store():
+    import lcstore
+    from crosscorr import kernel_dist_many, kernel_dist_spectra, spectrum, standardize, standardize_values
+    lc_dir = TEMP_DIR + "spectra/"
+    makelcs.make_lc_files(10, lc_dir)
+    ts_dict = genvpdbs.load_ts(lc_dir)
+    assert(not lcstore.has_spectra(lc_dir))
+    lcstore.save_spectra(ts_dict, lc_dir)
+    assert(lcstore.has_spectra(lc_dir))
+
+    store = lcstore.SpectralStore(lc_dir)
+    assert(len(store) == 10 and store.length == 100)
+    assert("ts-3.txt" in store and "ts-10.txt" not in store)
+
+    keys = ["ts-1.txt", "ts-7.txt", "ts-4.txt"]
+    query = standardize(ts_dict["ts-0.txt"])
+    expected = kernel_dist_many(query, standardize_values([ts_dict[k].values() for k in keys]))
+    assert(np.allclose(kernel_dist_spectra(spectrum(query), store.spectra(keys), store.length), expected))
+    assert(np.allclose(store.spectrum("ts-0.txt"), spectrum(query)))
+    try:
+        kernel_dist_spectra(spectrum(ts_dict["ts-0.txt"]), store.spectra(keys), store.length)
+    except ValueError:
+        pass
+    else:
+        assert False, "unstandardized query should raise"
+    clear_dir(TEMP_DIR,recreate=False)
+
+def test_curve_store():
+    import lcstore
+    lc_dir = TEMP_DIR + "curves/"
+    makelcs.make_lc_files(12, lc_dir, text=True)
+    store = lcstore.CurveStore(lc_dir)
+    assert(len(store) == 12 and store.length == 100 and "ts-11.txt" in store)
+    assert(store.ids == ["ts-%d.txt" % i for i in range(12)])
+    ts = store.timeseries("ts-5.txt")
+    assert(isinstance(ts, ats.ArrayTimeSeries) and np.allclose(ts.times(), np.arange(0.0, 1.0, 0.01)))
+    assert(np.allclose(store.values_many(["ts-3.txt", "ts-1.txt"])[1], store.values("ts-1.txt")))
+
+    # the text files hold the same curves, to the precision they are written with
+    text = genvpdbs.load_ts(lc_dir) # reads the packed store
+    packed = lcstore.import_text_curves(lc_dir, dtype=np.float32, remove=True)
+    assert(len(packed) == 12 and packed.values("ts-5.txt").dtype == np.float32)
+    assert(np.allclose(packed.values("ts-5.txt"), text["ts-5.txt"].values(), atol=1e-5))
+    assert(lcstore.text_curve_files(lc_dir) == [])
+
+    new_ts = makelcs.random_ts(1)
+    lcstore.append_curve(lc_dir, "ts-12.txt", new_ts)
+    store = lcstore.CurveStore(lc_dir)
+    assert(len(store) == 13 and np.allclose(store.values("ts-12.txt"), new_ts.values(), atol=1e-6))
+    for bad in [("ts-12.txt", new_ts), ("ts-13.txt", ats.ArrayTimeSeries(times=range(100), values=range(100)))]:
+        try:
+            lcstore.append_curve(lc_dir, *bad)
+            assert(False)
+        except ValueError:
+            pass
+    clear_dir(TEMP_DIR,recreate=False)
+
+def test_distance_matrix():
+    import lcstore
+    import distmatrix
+    from crosscorr import kernel_dist, standardize
+    lc_dir = TEMP_DIR + "matrix/"
+    makelcs.make_lc_files(12, lc_dir)
+    ts_dict = genvpdbs.load_ts(lc_dir)
+    lcstore.save_spectra(ts_dict, lc_dir)
+
+    # all-pairs, tiled and run on a pool
+    path = TEMP_DIR + "all_pairs.npy"
+    matrix = distmatrix.build_distance_matrix(lc_dir, path, block=5, workers=2)
+    assert(matrix.shape == (12, 12))
+    assert(distmatrix.has_distance_matrix(path))
+    values = np.array(matrix.values)
+    assert(np.allclose(values, values.T) and np.all(np.diag(values) == 0))
+    s3, s8 = standardize(ts_dict["ts-3.txt"]), standardize(ts_dict["ts-8.txt"])
+    assert(abs(matrix.distance("ts-3.txt", "ts-8.txt") - kernel_dist(s3, s8)) < 1e-9)
+
+    # many-to-many against a few rows, computed in process
+    rows = ["ts-8.txt", "ts-3.txt"]
+    vp_matrix = distmatrix.build_distance_matrix(lc_dir, TEMP_DIR + "vps.npy", rows=rows, block=5, workers=1)
+    assert(vp_matrix.shape == (2, 12))
+    assert(np.allclose(vp_matrix.row("ts-3.txt"), matrix.row("ts-3.txt")))
+    assert(vp_matrix.distance("ts-8.txt", "ts-8.txt") == 0)
+    pairs = genvpdbs.matrix_distances("ts-8.txt", vp_matrix)
+    assert(len(pairs) == 11 and "ts-8.txt" not in [k for d, k in pairs])
+    clear_dir(TEMP_DIR,recreate=False)
+
+def test_parallel_vp_dbs():
+    import lcstore
+    import distmatrix
+    lc_dir = TEMP_DIR + "parallel/"
+    db_dir = TEMP_DIR + "parallel_dbs/"
+    makelcs.make_lc_files(20, lc_dir)
+    ts_dict = genvpdbs.load_ts(lc_dir)
+    store = lcstore.save_spectra(ts_dict, lc_dir)
+    lcstore.save_self_kernels(ts_dict, lc_dir, store=store)
+    vps = ["ts-2.txt", "ts-5.txt", "ts-11.txt"]
+    clear_dir(db_dir)
+    distmatrix.build_distance_matrix(lc_dir, db_dir + "vps.npy", rows=vps, workers=1)
+    genvpdbs.save_all_vp_dbs(vps, db_dir + "vps.npy", workers=2, db_dir=db_dir)
+
+    serial = genvpdbs.calc_distances("ts-5.txt", ts_dict)
+    db = unbalancedDB.connect(db_dir + "ts-5.dbdb")
+    stored = db.chop(10)
+    db.close()
+    assert(len(stored) == 19)
+    assert(sorted(k for d, k in stored) == sorted(k for d, k in serial))
+    expected = dict((k, d) for d, k in serial)
+    assert(all(abs(expected[k] - d) < 1e-9 for d, k in stored))
+    clear_dir(TEMP_DIR,recreate=False)
+
+def test_vp_strategies():
+    import lcstore
+    import distmatrix
+    import vpselect
+    lc_dir = TEMP_DIR + "strategies/"
+    makelcs.make_lc_files(40, lc_dir)
+    ts_dict = genvpdbs.load_ts(lc_dir)
+    store = lcstore.save_spectra(ts_dict, lc_dir)
+    matrix = distmatrix.build_distance_matrix(lc_dir, TEMP_DIR + "all.npy", workers=1)
+
+    for strategy in ["random", "farthest", "spread"]:
+        vps = genvpdbs.pick_vantage_points(ts_dict, 5, strategy, store)
+        assert(len(vps) == 5 and len(set(vps)) == 5 and all(vp in ts_dict for vp in vps))
+        assert(len(vpselect.pick_vps(store, 5, strategy, matrix)) == 5)
+
+    # every farthest-first vp is the curve farthest from the ones picked before it
+    vps = vpselect.farthest_first_vps(store, 4, matrix)
+    rows = vpselect.vp_distance_rows(store, vps)
+    assert(np.allclose(rows, vpselect.vp_distance_rows(store, vps, matrix)))
+    for i in range(1, 4):
+        min_dists = rows[:i].min(axis=0)
+        assert(abs(min_dists[matrix.col_index(vps[i])] - min_dists.max()) < 1e-9)
+
+    results = vpselect.compare_strategies(store, 5, matrix, n_queries=20)
+    assert(sorted(results) == sorted(["random", "farthest", "spread"]))
+    # at most every curve but the vp and the query
+    assert(all(0 <= expected <= 38 for vps, rows, expected in results.values()))
+    try:
+        vpselect.pick_vps(store, 5, "nonsense")
+    except ValueError:
+        pass
+    else:
+        assert False, "unknown strategy should raise"
+    clear_dir(TEMP_DIR,recreate=False)
+
+def test_add_light_curve():
+    import ingest
+    import lcstore
+    import distmatrix
+    from crosscorr import kernel_dist, standardize
+    from settings import VP_DIST_MATRIX_FILE
+    lc_dir = TEMP_DIR + "ingest/"
+    db_dir = TEMP_DIR + "ingest_dbs/"
+    makelcs.make_lc_files(20, lc_dir)
+    ts_dict = genvpdbs.load_ts(lc_dir)
+    store = lcstore.save_spectra(ts_dict, lc_dir)
+    lcstore.save_self_kernels(ts_dict, lc_dir, store=store)
+    vps = ["ts-2.txt", "ts-9.txt"]
+    clear_dir(db_dir)
+    distmatrix.build_distance_matrix(lc_dir, db_dir + VP_DIST_MATRIX_FILE, rows=vps, workers=1)
+    genvpdbs.save_all_vp_dbs(vps, db_dir + VP_DIST_MATRIX_FILE, workers=1, db_dir=db_dir)
+
+    from cache import index_generation, bump_index_generation
+    assert(index_generation(db_dir) == 0)
+    new_ts = makelcs.tsmaker(0.4, 0.1, 0.05)
+    ts_fn, vp_dists = ingest.add_light_curve(new_ts, lc_dir, db_dir)
+    assert(index_generation(db_dir) == 1)
+    # the row indexes written by the build are only appended to
+    from settings import SPECTRA_IDS_FILE, CURVES_IDS_FILE, SELF_KERNELS_FILE
+    for index_path in [lc_dir + SPECTRA_IDS_FILE, lc_dir + CURVES_IDS_FILE, lc_dir + SELF_KERNELS_FILE,
+                       db_dir + VP_DIST_MATRIX_FILE[:-4] + "_ids.pkl"]:
+        assert(os.path.getsize(index_path[:-4] + ".log") > 0)
+    assert(ts_fn == "ts-20.txt" and ts_fn in lcstore.CurveStore(lc_dir))
+    assert(np.allclose(lcstore.CurveStore(lc_dir).values(ts_fn), new_ts.values()))
+
+    store = lcstore.SpectralStore(lc_dir)
+    assert(len(store) == 21 and ts_fn in store)
+    assert(ts_fn in lcstore.load_self_kernels(lc_dir))
+    matrix = distmatrix.DistanceMatrix(db_dir + VP_DIST_MATRIX_FILE)
+    assert(matrix.shape == (2, 21) and matrix.col_ids[-1] == ts_fn)
+    assert(np.allclose(matrix.row("ts-2.txt")[:20], distmatrix.DistanceMatrix(db_dir + VP_DIST_MATRIX_FILE).row("ts-2.txt")[:20]))
+    for vp in vps:
+        expected = kernel_dist(standardize(ts_dict[vp]), standardize(new_ts))
+        assert(abs(vp_dists[vp] - expected) < 1e-9)
+        assert(abs(matrix.distance(vp, ts_fn) - expected) < 1e-9)
+        db = unbalancedDB.connect(db_dir + vp[:-4] + ".dbdb")
+        assert(db.get(vp_dists[vp]) == ts_fn)
+        assert(len(db.chop(10)) == 20)
+        db.close()
+
+    assert(ingest.add_light_curve(new_ts, lc_dir, db_dir)[0] == "ts-21.txt")
+    assert(ingest.add_light_curve(new_ts, lc_dir, db_dir, ts_fn="star-1")[0] == "star-1")
+    assert("star-1" in lcstore.CurveStore(lc_dir) and "star-1" in lcstore.SpectralStore(lc_dir))
+    assert(lcstore.SpectralStore(lc_dir).next_num == 22)
+    assert(index_generation(db_dir) == 3 and bump_index_generation(db_dir, previous=7) == 8)
+    try:
+        ingest.add_light_curve(new_ts, lc_dir, db_dir, ts_fn="star-1")
+        assert(False)
+    except ValueError:
+        pass
+    clear_dir(TEMP_DIR,recreate=False)
+
+def test_db_bulk_load():
+    db_fname = TEMP_DIR + "bulk.dbdb"
+    os.makedirs(TEMP_DIR, exist_ok=True)
+    db = unbalancedDB.connect(db_fname)
+    # sorted input would make repeated set() calls degenerate into a linked list
+    input_data = [(float(i), "v%d" % i) for i in range(100)] + [(7.0, "seven")]
+    db.bulk_load(input_data)
+    db.close()
+
+    db = unbalancedDB.connect(db_fname)
+    assert db.get(42.0) == "v42"
+    assert db.get(7.0) == "seven" # later pairs win, like set()
+    assert db.get_min() == "v0"
+    assert sorted(db.chop(9.5)) == [(float(i), "v%d" % i if i != 7 else "seven") for i in range(10)]
+
+    tree = db._tree
+    def height(node):
+        if node is None:
+            return 0
+        return 1 + max(height(tree._follow(node.left_ref)), height(tree._follow(node.right_ref)))
+    assert height(tree._follow(tree._tree_ref)) == 7 # ceil(log2(101))
+
+    # still an ordinary database afterwards
+    db.set(100.5, "extra")
+    db.commit()
+    db.close()
+    db = unbalancedDB.connect(db_fname)
+    assert db.get(100.5) == "extra"
+    db.bulk_load([])
+    assert db.chop(1000) == []
+    db.close()
+    clear_dir(TEMP_DIR,recreate=False)
+
+def build_test_index(name, num_lcs=60, vps=("ts-2.txt", "ts-9.txt", "ts-17.txt", "ts-33.txt")):
+    """Helper to build a small light curve collection and vp index under TEMP_DIR"""
+    import lcstore
+    import distmatrix
+    from settings import VP_DIST_MATRIX_FILE
+    lc_dir = TEMP_DIR + name + "/"
+    db_dir = TEMP_DIR + name + "_dbs/"
+    makelcs.make_lc_files(num_lcs, lc_dir)
+    ts_dict = genvpdbs.load_ts(lc_dir)
+    store = lcstore.save_spectra(ts_dict, lc_dir)
+    self_kernels = lcstore.save_self_kernels(ts_dict, lc_dir, store=store)
+    clear_dir(db_dir)
+    vp_matrix = distmatrix.build_distance_matrix(lc_dir, db_dir + VP_DIST_MATRIX_FILE, rows=list(vps), workers=1)
+    genvpdbs.save_all_vp_dbs(list(vps), db_dir + VP_DIST_MATRIX_FILE, workers=1, db_dir=db_dir)
+    return lc_dir, db_dir, ts_dict, store, self_kernels, vp_matrix
+
+def brute_force_knn(ts, ts_dict, k):
+    """Helper to find the exact top k by scoring every light curve"""
+    from crosscorr import kernel_dist, standardize
+    s_ts = standardize(ts)
+    return sorted((kernel_dist(s_ts, standardize(lc)), fn) for fn, lc in ts_dict.items())[:k]
+
+def test_knn_search():
+    lc_dir, db_dir, ts_dict, store, self_kernels, vp_matrix = build_test_index("knn")
+    for query in [makelcs.tsmaker(0.5, 0.1, 0.3), makelcs.random_ts(2), ts_dict["ts-40.txt"]]:
+        for k in [1, 5, 12]:
+            results = simsearch.knn_search(query, k, self_kernels, store, vp_matrix)
+            expected = brute_force_knn(query, ts_dict, k)
+            assert(len(results) == k)
+            assert([fn for d, fn in results] == [fn for d, fn in expected])
+            assert(np.allclose([d for d, fn in results], [d for d, fn in expected]))
+    assert(simsearch.knn_search(ts_dict["ts-40.txt"], 1, self_kernels, store, vp_matrix)[0][1] == "ts-40.txt")
+    assert(len(simsearch.knn_search(ts_dict["ts-40.txt"], 100, self_kernels, store, vp_matrix)) == 60)
+    clear_dir(TEMP_DIR,recreate=False)
+
+def test_batch_search():
+    lc_dir, db_dir, ts_dict, store, self_kernels, vp_matrix = build_test_index("batch", num_lcs=80)
+    queries = [makelcs.tsmaker(0.5, 0.1, 0.3), makelcs.random_ts(2), ts_dict["ts-70.txt"], makelcs.tsmaker(0.2, 0.3, 0.1)]
+    values = np.array([q.values() for q in queries])
+    for k in [1, 4]:
+        names, results = simsearch.batch_search(values, k, self_kernels, store, vp_matrix)
+        assert(names == [0, 1, 2, 3] and len(results) == 4)
+        for query, result in zip(queries, results):
+            expected = brute_force_knn(query, ts_dict, k)
+            assert([fn for d, fn in result] == [fn for d, fn in expected])
+            assert(result == simsearch.knn_search(query, k, self_kernels, store, vp_matrix))
+
+    # a directory of input files
+    names, results = simsearch.batch_search("sample_data", 2, self_kernels, store, vp_matrix)
+    assert(len(names) == len(results) == 4 and all(len(r) == 2 for r in results))
+    assert(names == sorted(names) and names[0].endswith("169975.dat_folded"))
+    clear_dir(TEMP_DIR,recreate=False)
+
+def test_search_server():
+    import threading
+    import simserver
+    lc_dir, db_dir, ts_dict, store, self_kernels, vp_matrix = build_test_index("server")
+    server = simserver.make_server(("localhost", 0), simserver.SearchIndex(lc_dir, db_dir))
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    try:
+        client = simserver.SearchClient(server.server_address)
+        assert(client.request({'op': 'ping'})['ok'])
+        queries = [makelcs.tsmaker(0.5, 0.1, 0.3), ts_dict["ts-40.txt"]]
+        for query in queries:
+            expected = simsearch.knn_search(query, 5, self_kernels, store, vp_matrix)
+            results = client.knn(query, 5)
+            assert([fn for d, fn in results] == [fn for d, fn in expected])
+            assert(np.allclose([d for d, fn in results], [d for d, fn in expected]))
+        results = client.batch(np.array([q.values() for q in queries]), 2)
+        assert([r[0][1] for r in results] == [client.knn(q, 1)[0][1] for q in queries])
+        assert(client.request({'op': 'reload'})['ok'])
+
+        # an ingested curve is found without a reload
+        import ingest
+        new_ts = makelcs.tsmaker(0.3, 0.05, 0.2)
+        ts_fn = ingest.add_light_curve(new_ts, lc_dir, db_dir)[0]
+        assert(client.knn(new_ts, 1)[0][1] == ts_fn)
+        assert(client.batch(np.array([new_ts.values()]), 1)[0][0][1] == ts_fn)
+        try:
+            client.request({'op': 'nope'})
+            assert(False)
+        except ValueError:
+            pass
+        # the connection survives an error
+        assert(client.knn(ts_dict["ts-40.txt"], 1)[0][1] == "ts-40.txt")
+        client.close()
+    finally:
+        server.shutdown()
+        server.server_close()
+    clear_dir(TEMP_DIR,recreate=False)
+
+def test_row_index_log():
+    import lcstore
+    index_dir = TEMP_DIR + "row_index/"
+    os.makedirs(index_dir, exist_ok=True)
+    path = index_dir + "ids.pkl"
+    lcstore.write_index(path, {'ids': ["a", "b", "c", "d"]})
+    snapshot = os.path.getsize(path)
+    min_log, lcstore.INDEX_LOG_MIN = lcstore.INDEX_LOG_MIN, 2
+    try:
+        for ts_fn in ["e", "f", "g", "h"]:
+            # logged, not rewritten, until the log is as long as the index
+            assert(os.path.getsize(path) == snapshot)
+            index, appended = lcstore.load_index(path)
+            assert(index['ids'][-1] == chr(ord(ts_fn) - 1) and len(appended) == len(index['ids']) - 4)
+            lcstore.append_index(path, index, len(appended), ts_fn)
+        assert(not os.path.exists(index_dir + "ids.log"))
+        assert(lcstore.load_index(path) == ({'ids': list("abcdefgh")}, []))
+    finally:
+        lcstore.INDEX_LOG_MIN = min_log
+
+    # a record repeating a row the index has (left by a fold that was cut short), and a record
+    # cut short, are skipped
+    lcstore._append_log(path, (1, "b"))
+    with open(index_dir + "ids.log", 'ab') as f:
+        f.write(b"\x80\x05\x95")
+    assert(lcstore.load_index(path) == ({'ids': list("abcdefgh")}, []))
+    clear_dir(TEMP_DIR,recreate=False)
+
+def test_lru_cache():
+    from cache import LRUCache
+    cache = LRUCache(300, sizeof=lambda a: a.nbytes)
+    a, b, c = np.zeros(10), np.ones(10), np.arange(20.0)
+    cache.put("a", a)
+    cache.put("b", b)
+    assert(cache.get("a") is a and cache.get("c") is None)
+    cache.put("c", c) # 160 + 80 + 80 > 300, so the least recently used ("b") goes
+    assert("b" not in cache and "a" in cache and "c" in cache)
+    assert(cache.bytes == 240 and cache.evictions == 1)
+    cache.put("big", np.zeros(100)) # larger than the whole cache
+    assert("big" not in cache and len(cache) == 2)
+    loads = []
+    assert(cache.get_or_load("d", lambda k: loads.append(k) or np.zeros(5)).shape == (5,))
+    assert(cache.get_or_load("d", lambda k: loads.append(k) or np.zeros(5)).shape == (5,))
+    assert(loads == ["d"])
+    stats = cache.stats()
+    assert(stats['hits'] == 2 and stats['misses'] == 2 and stats['entries'] == 3)
+    cache.clear()
+    assert(len(cache) == 0 and cache.bytes == 0)
+
+def test_load_ts_cache():
+    lc_dir = TEMP_DIR + "cache/"
+    makelcs.make_lc_files(3, lc_dir, text=True)
+    simsearch.lc_cache.clear()
+    first = simsearch.lc_cache.get_or_load(lc_dir + "ts-1.txt", simsearch.read_ts)
+    assert(np.allclose(first.values(), genvpdbs.load_ts(lc_dir)["ts-1.txt"].values(), atol=1e-5))
+    hits = simsearch.lc_cache.hits
+    assert(simsearch.lc_cache.get_or_load(lc_dir + "ts-1.txt", simsearch.read_ts) is first)
+    assert(simsearch.lc_cache.hits == hits + 1)
+    assert(simsearch.lc_cache.bytes == simsearch.ts_nbytes(first))
+    simsearch.lc_cache.clear()
+    clear_dir(TEMP_DIR,recreate=False)
+
+def test_db_range():
+    db_fname = TEMP_DIR + "range.dbdb"
+    os.makedirs(TEMP_DIR, exist_ok=True)
+    db = unbalancedDB.connect(db_fname)
+    keys = random.sample(range(200), 200)
+    for key in keys:
+        db.set(key / 10.0, "v%d" % key)
+    db.commit()
+    assert(list(db.range(3.05, 4.0)) == [(i / 10.0, "v%d" % i) for i in range(31, 41)])
+    assert(list(db.range(-1, 0.0)) == [(0.0, "v0")])
+    assert(list(db.range(50, 60)) == [] and list(db.range(4.0, 3.0)) == [])
+    assert(len(list(db.range(-np.inf, np.inf))) == 200)
+    db.close()
+    db = unbalancedDB.connect(TEMP_DIR + "empty.dbdb")
+    assert(list(db.range(0, 1)) == [])
+    db.close()
+    clear_dir(TEMP_DIR,recreate=False)
+
+def test_range_search():
+    lc_dir, db_dir, ts_dict, store, self_kernels, vp_matrix = build_test_index("range", num_lcs=80)
+    query = makelcs.tsmaker(0.5, 0.1, 0.3)
+    all_dists = brute_force_knn(query, ts_dict, 80)
+    for radius in [all_dists[0][0] - 1e-6, all_dists[4][0] + 1e-9, all_dists[30][0] + 1e-9, 2.0]:
+        expected = [fn for d, fn in all_dists if d <= radius]
+        for matrix in [vp_matrix, None]:
+            results = list(simsearch.range_search(query, radius, self_kernels, store, matrix, db_dir))
+            assert(sorted(fn for d, fn in results) == sorted(expected))
+            assert(all(d <= radius for d, fn in results))
+    clear_dir(TEMP_DIR,recreate=False)
+
+def test_approx_search():
+    lc_dir, db_dir, ts_dict, store, self_kernels, vp_matrix = build_test_index("approx", num_lcs=200)
+    query = makelcs.tsmaker(0.5, 0.1, 0.3)
+    exact = brute_force_knn(query, ts_dict, 5)
+    results, bound = simsearch.approx_search(query, 5, None, self_kernels, store, vp_matrix)
+    assert(results == simsearch.knn_search(query, 5, self_kernels, store, vp_matrix))
+    assert([fn for d, fn in results] == [fn for d, fn in exact] and bound >= results[-1][0])
+
+    calls = []
+    calc_dists_to = simsearch.calc_dists_to
+    def counting(s_ts, ts_fns, *args):
+        calls.append(len(ts_fns))
+        return calc_dists_to(s_ts, ts_fns, *args)
+    simsearch.calc_dists_to = counting
+    try:
+        for budget in [0, 10, 70]:
+            del calls[:]
+            results, bound = simsearch.approx_search(query, 5, budget, self_kernels, store, vp_matrix)
+            assert(sum(calls) <= budget + 4) # the vantage points are always scored
+            assert(len(results) == min(5, budget + 4) and results == sorted(results))
+            # nothing unscored can beat the bound, so every exact match closer than it was found
+            found = [fn for d, fn in results]
+            assert(all(fn in found for d, fn in exact if d < bound))
+            assert(bound <= brute_force_knn(query, {fn: ts for fn, ts in ts_dict.items() if fn not in found}, 1)[0][0] + 1e-9)
+    finally:
+        simsearch.calc_dists_to = calc_dists_to
+    try:
+        simsearch.approx_search(query, 5, -1, self_kernels, store, vp_matrix)
+    except ValueError:
+        pass
+    else:
+        assert False, "a negative budget should raise"
+    clear_dir(TEMP_DIR,recreate=False)
+
+def test_search_stats():
+    import json
+    from searchstats import SearchStats, stage, count
+    lc_dir, db_dir, ts_dict, store, self_kernels, vp_matrix = build_test_index("stats")
+    stats = SearchStats(query="test", k=3)
+    query = makelcs.tsmaker(0.5, 0.1, 0.3)
+    results = simsearch.knn_search(query, 3, self_kernels, store, vp_matrix, stats)
+    assert(results == simsearch.knn_search(query, 3, self_kernels, store, vp_matrix))
+    scored = stats.counters['distance_evals'] - 4
+    assert(scored >= 0 and scored + stats.counters['pruned'] == 56)
+    assert(set(stats.timings) == {'vp_distances', 'lower_bounds', 'candidate_load', 'candidate_scoring'} or scored == 0)
+    assert(all(t >= 0 for t in stats.timings.values()))
+
+    # batch searches record totals over the batch
+    batch_stats = SearchStats()
+    values = np.array([query.values(), ts_dict["ts-40.txt"].values()])
+    names, results = simsearch.batch_search(values, 3, self_kernels, store, vp_matrix, batch_stats)
+    assert(results == simsearch.batch_search(values, 3, self_kernels, store, vp_matrix)[1])
+    scored = batch_stats.counters['distance_evals'] - 2 * 4
+    assert(scored >= 0 and scored + batch_stats.counters['pruned'] == 2 * 56)
+    assert({'input_load', 'vp_distances', 'lower_bounds'} <= set(batch_stats.timings))
+
+    # stage() and count() are no-ops without stats
+    with stage(None, 'db_chop'):
+        count(None, 'pruned')
+    stats.write_jsonl(TEMP_DIR + "stats.jsonl")
+    stats.write_jsonl(TEMP_DIR + "stats.jsonl")
+    with open(TEMP_DIR + "stats.jsonl") as f:
+        lines = [json.loads(line) for line in f]
+    assert(len(lines) == 2 and lines[0] == stats.as_dict() and lines[0]['info'] == {'query': "test", 'k': 3})
+    assert("total" in stats.summary())
+    clear_dir(TEMP_DIR,recreate=False)
+
+def test_benchmark():
+    import benchmark
+    import lcstore
+    assert([benchmark.parse_size(s) for s in ["1000", "10k", "1M", "2.5k"]] == [1000, 10000, 1000000, 2500])
+    queries = benchmark.make_queries(6, 1)
+    assert(len(queries) == 6 and np.allclose(queries[0].values(), benchmark.make_queries(6, 1)[0].values()))
+    result = benchmark.run_size(60, queries, k=3, budget=5, vps=4, workers=1, work_dir=TEMP_DIR + "bench/")
+    assert(result['num_lcs'] == 60 and result['index_bytes'] > 0 and result['store_bytes'] > 0)
+    assert(sorted(result['modes']) == ['approx', 'brute', 'knn', 'tree', 'vpdb'])
+    for mode in benchmark.EXACT_MODES:
+        assert(result['modes'][mode]['recall'] == 1.0)
+    assert(all(m['p99_ms'] >= m['p50_ms'] > 0 for m in result['modes'].values()))
+    assert(result['ingest']['p99_ms'] >= result['ingest']['p50_ms'] > 0)
+    assert(len(lcstore.SpectralStore(TEMP_DIR + "bench/" + LIGHT_CURVES_DIR)) == 66)
+
+    results = {'results': [result]}
+    assert(benchmark.find_regressions(results) == [])
+    slower = {'results': [dict(result, modes={mode: dict(m, p50_ms=m['p50_ms'] / 10) for mode, m in result['modes'].items()})]}
+    assert(len(benchmark.find_regressions(results, slower)) == 5)
+    slower['results'][0]['ingest'] = dict(result['ingest'], p50_ms=result['ingest']['p50_ms'] / 10)
+    assert(len(benchmark.find_regressions(results, slower)) == 6)
+    clear_dir(TEMP_DIR,recreate=False)
+
+def test_brute_force_search():
+    lc_dir, db_dir, ts_dict, store, self_kernels, vp_matrix = build_test_index("brute", num_lcs=100)
+    queries = [makelcs.tsmaker(0.5, 0.1, 0.3), makelcs.random_ts(2), ts_dict["ts-70.txt"]]
+    for query in queries:
+        for k in [1, 7]:
+            expected = simsearch.knn_search(query, k, self_kernels, store, vp_matrix)
+            for block in [16, 33, 1024]:
+                results = simsearch.brute_force_search(query, k, self_kernels, store, block)
+                assert(results == expected)
+            # without cached normalizers
+            results = simsearch.brute_force_search(query, k, None, store, 16)
+            assert([fn for d, fn in results] == [fn for d, fn in expected])
+    assert(len(simsearch.brute_force_search(queries[0], 500, self_kernels, store, 16)) == 100)
+    assert(simsearch.use_brute_force(store) and not simsearch.use_brute_force(None))
+    clear_dir(TEMP_DIR,recreate=False)
+
+def test_load_external_ts():
+    os.makedirs(TEMP_DIR, exist_ok=True)
+    times = np.round(np.random.uniform(-0.1, 1.1, 500), 3) # repeated and out of order
+    values = np.random.randn(500)
+    np.savetxt(TEMP_DIR + "input.dat_folded", np.column_stack([times, values, values * 2, np.ones(500)]))
+    _, first = np.unique(times, return_index=True)
+    expected = ats.ArrayTimeSeries(times=times[first], values=values[first]).interpolate(np.arange(0.0, 1.0, 0.01))
+    ts = simsearch.load_external_ts(TEMP_DIR + "input.dat_folded")
+    assert(np.allclose(ts.times(), expected.times()) and np.allclose(ts.values(), expected.values()))
+
+    # values beyond the ends are held, like ArrayTimeSeries.interpolate
+    grid = np.array([0.0, 0.25, 0.5, 1.0])
+    assert(np.allclose(simsearch.resample(np.array([0.5, 0.1, 0.5, 0.3]), np.array([4.0, 1.0, 9.0, 2.0]), grid),
+                       [1.0, 1.75, 4.0, 4.0]))
+    for fn in os.listdir("sample_data"):
+        assert(len(simsearch.load_external_ts("sample_data/" + fn)) == 100)
+    clear_dir(TEMP_DIR,recreate=False)
+
+def test_vp_tree():
+    import lcstore
+    import vptree
+    from crosscorr import standardize
+    from searchstats import SearchStats
+    lc_dir, db_dir, ts_dict, store, self_kernels, vp_matrix = build_test_index("tree", num_lcs=100)
+    assert(not vptree.has_vp_tree(db_dir))
+    tree = vptree.build_vp_tree(store, db_dir, self_kernels, leaf_size=4)
+    assert(vptree.has_vp_tree(db_dir) and len(tree) == 100 and tree.matches(store))
+    assert(simsearch.open_vp_tree(store, db_dir) is not None)
+    queries = [makelcs.tsmaker(0.5, 0.1, 0.3), makelcs.random_ts(2), ts_dict["ts-70.txt"]]
+    for query in queries:
+        for k in [1, 6]:
+            stats = SearchStats()
+            results = tree.knn(query, k, store, self_kernels, stats)
+            expected = simsearch.brute_force_search(query, k, self_kernels, store)
+            assert([fn for d, fn in results] == [fn for d, fn in expected])
+            assert(np.allclose([d for d, fn in results], [d for d, fn in expected]))
+            assert(stats.counters['distance_evals'] + stats.counters['pruned'] == 100)
+    assert(tree.knn(ts_dict["ts-70.txt"], 1, store, self_kernels)[0] == (0.0, "ts-70.txt"))
+    assert(len(vptree.VPTree(db_dir).knn(queries[0], 500, store)) == 100)
+
+    # curves added after the build are scored directly
+    new_ts = makelcs.tsmaker(0.3, 0.2, 0.1)
+    lcstore.append_spectrum(lc_dir, "new.txt", standardize(new_ts).values())
+    store = lcstore.SpectralStore(lc_dir)
+    assert(tree.matches(store))
+    assert(tree.knn(new_ts, 1, store)[0][1] == "new.txt")
+    clear_dir(TEMP_DIR,recreate=False)
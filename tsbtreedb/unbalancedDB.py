@@ -150,6 +150,34 @@ class BinaryTree(object):
         self._tree_ref = self._insert(node, key, value_ref)
 
 
+    def bulk_load(self, items):
+        "replace the tree with a height-balanced tree of (key, value) pairs in one append pass"
+        #later pairs win when a key repeats, as with repeated set() calls
+        pairs = sorted(dict(items).items(), key=lambda pair: pair[0])
+        self._storage.lock()
+        #subtrees are written bottom-up, so every node is appended exactly once
+        #and the only other write is the single root commit
+        root_address = self._write_balanced(pairs, 0, len(pairs))
+        self._storage.commit_root_address(root_address)
+        self._refresh_tree_ref()
+
+    def _write_balanced(self, pairs, lo, hi):
+        "write the balanced subtree for pairs[lo:hi] to storage and return its address"
+        if lo >= hi:
+            return 0
+        mid = (lo + hi) // 2
+        left_address = self._write_balanced(pairs, lo, mid)
+        right_address = self._write_balanced(pairs, mid + 1, hi)
+        key, value = pairs[mid]
+        node_ref = BinaryNodeRef(referent=BinaryNode(
+            BinaryNodeRef(address=left_address),
+            key,
+            ValueRef(value),
+            BinaryNodeRef(address=right_address)))
+        #stores the value and then the node itself; children are already on disk
+        node_ref.store(self._storage)
+        return node_ref.address
+
     def _insert(self, node, key, value_ref):
         "insert a new node creating a new path from root"
         #create a tree ifnthere was none so far
@@ -297,6 +325,9 @@ class BinaryTree(object):
             self._refresh_tree_ref()
         #get the top level node
         node = self._follow(self._tree_ref)
+        #an empty tree (e.g. bulk loaded with no pairs) has nothing to chop
+        if node is None:
+            return []
         #traverse until you find appropriate node
         while node is not None:
             parent_node = node
@@ -320,6 +351,25 @@ class BinaryTree(object):
             out = out + self.traverse_in_order(self._follow(node.left_ref))
         return out
 
+    # NEW METHOD 6
+    def range(self, lo, hi):
+        "yield (key, value) pairs with lo <= key <= hi, in key order"
+        # only descends into subtrees that can hold keys in range, so the cost is the
+        # depth of the tree plus the number of matches
+        if not self._storage.locked:
+            self._refresh_tree_ref()
+        stack = []
+        node = self._follow(self._tree_ref)
+        while stack or node is not None:
+            if node is not None:
+                stack.append(node)
+                node = self._follow(node.left_ref) if lo < node.key else None
+            else:
+                node = stack.pop()
+                if lo <= node.key <= hi:
+                    yield (node.key, self._follow(node.value_ref))
+                node = self._follow(node.right_ref) if node.key < hi else None
+
 class Storage(object):
     SUPERBLOCK_SIZE = 4096
     INTEGER_FORMAT = "!Q"
@@ -447,6 +497,11 @@ class DBDB(object):
         self._assert_not_closed()
         return self._tree.delete(key)
 
+    def bulk_load(self, items):
+        "replace the database contents with (key, value) pairs as a balanced tree, committed once"
+        self._assert_not_closed()
+        return self._tree.bulk_load(items)
+
     # NEW METHOD 1
     def get_min(self):
         self._assert_not_closed()
@@ -473,6 +528,11 @@ class DBDB(object):
         self._assert_not_closed()
         return self._tree.chop(chop_key)
 
+    # NEW METHOD 6
+    def range(self, lo, hi):
+        self._assert_not_closed()
+        return self._tree.range(lo, hi)
+
 def connect(dbname):
     try:
         f = open(dbname, 'r+b')
@@ -0,0 +1,128 @@
+#!/usr/local/bin/python3
+# -*- coding: utf-8 -*-
+#
+# CS207 Group Project Part 7
+# Created by Team 2 (Jonne Seleva, Nathaniel Burbank, Nicholas Ruta, Rohan Thavarajah) for Team 4
+
+# Vantage point selection strategies, and an estimate of how many candidates a query has to
+# score with a given set of vantage points (the size of db.chop(2*dist_to_vp) in search_vpdb).
+
+import random
+import numpy as np
+
+from crosscorr import kernel_dist_spectra, kernel_dist_matrix, self_kernels_spectra
+from settings import VP_STRATEGIES
+
+def pick_vps(store, n, strategy='random', matrix=None):
+    """
+    Selects n light curves from a SpectralStore to serve as vantage points.
+
+    Args:
+        store: SpectralStore with every light curve
+        n: number of vantage points
+        strategy: one of VP_STRATEGIES
+            random   - uniform random sample
+            farthest - farthest-first traversal: each vp is the curve farthest from all vps picked so far
+            spread   - from a random pool of candidates, the curves whose distances to a sample of
+                       the collection have the largest variance
+        matrix: optional all-pairs DistanceMatrix to read distances from instead of computing them
+    Returns:
+        List of light curve filenames
+    """
+    if strategy not in VP_STRATEGIES:
+        raise ValueError("Unknown vantage point strategy '%s' (choose from %s)" % (strategy, ", ".join(VP_STRATEGIES)))
+    if n > len(store):
+        raise ValueError("Cannot pick %d vantage points from %d light curves" % (n, len(store)))
+
+    if strategy == 'random':
+        return random.sample(store.ids, n)
+    elif strategy == 'farthest':
+        return farthest_first_vps(store, n, matrix)
+    else:
+        return max_spread_vps(store, n, matrix)
+
+def farthest_first_vps(store, n, matrix=None):
+    """Farthest-first traversal starting from a random light curve"""
+    ids = store.ids
+    dists_from = _dists_from(store, matrix)
+    vps = [random.choice(ids)]
+    min_dists = dists_from(vps[0])
+    while len(vps) < n:
+        vps.append(ids[int(np.argmax(min_dists))])
+        min_dists = np.minimum(min_dists, dists_from(vps[-1]))
+    return vps
+
+def max_spread_vps(store, n, matrix=None, pool_size=None, sample_size=200):
+    """
+    Variance-maximizing selection: a vp whose distances to the rest of the collection are spread
+    out splits it into well separated shells, so the chop around a query stays small.
+    """
+    ids = store.ids
+    pool = random.sample(ids, min(len(ids), pool_size or max(5 * n, 100)))
+    sample = random.sample(ids, min(len(ids), sample_size))
+    if matrix is not None:
+        cols = [matrix.col_index(ts_fn) for ts_fn in sample]
+        dists = np.array([matrix.row(ts_fn)[cols] for ts_fn in pool])
+    else:
+        dists = kernel_dist_matrix(store.spectra(pool), store.spectra(sample), store.length)
+    spread = np.var(dists, axis=1)
+    return [pool[i] for i in np.argsort(-spread)[:n]]
+
+def vp_distance_rows(store, vps, matrix=None):
+    """(len(vps) x N) array of distances from each vantage point to every stored curve, in store order"""
+    dists_from = _dists_from(store, matrix)
+    return np.array([dists_from(vp) for vp in vps])
+
+def expected_candidates(store, vps, vp_rows=None, n_queries=100):
+    """
+    Estimates the mean number of candidates search_vpdb has to score per query with these vantage points.
+
+    A random sample of stored curves (other than the vantage points) stands in for queries: each
+    one is routed to its closest vp and every curve within twice that distance of the vp counts,
+    except the vp itself (it is not in its own DB) and the sampled curve (a real query is not stored).
+
+    Returns:
+        Float - mean candidate-set size
+    """
+    if vp_rows is None:
+        vp_rows = vp_distance_rows(store, vps)
+    vp_set = set(vps)
+    query_cols = [i for i, ts_fn in enumerate(store.ids) if ts_fn not in vp_set]
+    query_cols = random.sample(query_cols, min(len(query_cols), n_queries))
+    if len(query_cols) == 0:
+        return 0.0
+
+    q_dists = vp_rows[:, query_cols]
+    closest = np.argmin(q_dists, axis=0)
+    radius = 2 * q_dists[closest, np.arange(len(query_cols))]
+    # the vp (at distance 0) and the sampled curve (at half the radius) are always within the radius
+    counts = np.sum(vp_rows[closest] <= radius[:, np.newaxis], axis=1) - 2
+    return float(np.mean(counts))
+
+def compare_strategies(store, n, matrix=None, n_queries=100):
+    """
+    Picks vantage points with every strategy and estimates the candidate-set size of each.
+
+    Returns:
+        Dict keyed to strategy name of (vantage points, vp distance rows, expected candidates)
+    """
+    results = {}
+    for strategy in VP_STRATEGIES:
+        vps = pick_vps(store, n, strategy, matrix)
+        vp_rows = vp_distance_rows(store, vps, matrix)
+        results[strategy] = (vps, vp_rows, expected_candidates(store, vps, vp_rows, n_queries))
+    return results
+
+def _dists_from(store, matrix=None):
+    """Returns a function giving distances from one stored curve to every stored curve, in store order"""
+    if matrix is not None:
+        return lambda ts_fn: np.asarray(matrix.row(ts_fn))
+    all_spectra = store.spectra_at(slice(None))
+    all_self = self_kernels_spectra(all_spectra, store.length)
+    rows = {ts_fn: i for i, ts_fn in enumerate(store.ids)}
+    def dists_from(ts_fn):
+        dists = kernel_dist_spectra(store.spectrum(ts_fn), all_spectra, store.length, cand_self=all_self)
+        # A curve is exactly zero away from itself, whatever the round-off says
+        dists[rows[ts_fn]] = 0
+        return dists
+    return dists_from
@@ -0,0 +1,208 @@
+#!/usr/local/bin/python3
+# -*- coding: utf-8 -*-
+#
+# CS207 Group Project Part 7
+# Created by Team 2 (Jonne Seleva, Nathaniel Burbank, Nicholas Ruta, Rohan Thavarajah) for Team 4
+
+# Vantage point tree over every light curve in a SpectralStore. Each internal node holds a vantage
+# point and splits the curves below it into the half closest to it and the half farthest from it,
+# recording the range of distances to the vantage point in each half; leaves hold small buckets of
+# curves. A query descends best-first and skips every subtree whose distance range, by the triangle
+# inequality, cannot hold anything closer than the current k-th best.
+#
+# The tree is stored next to the vantage point DBs as three files: a structured array of nodes, the
+# store rows of the leaf buckets (with their K(x,x) normalizers) and the filenames it was built from.
+
+import os
+import heapq
+import pickle
+import random
+import numpy as np
+
+from crosscorr import standardize, spectrum, kernel_dist_spectra, self_kernels_spectra
+from lcstore import lookup_self_kernels
+from searchstats import stage, count
+from settings import DB_DIR, VP_TREE_FILE, VP_TREE_LEAVES_FILE, VP_TREE_IDS_FILE, VP_TREE_LEAF_SIZE
+
+# vp is the store row of the vantage point (-1 for a leaf); inner and outer are child node numbers;
+# [in_lo, in_hi] and [out_lo, out_hi] are the distances to vp found in each child; a leaf holds
+# rows start:stop of the leaf bucket array
+NODE_DTYPE = np.dtype([('vp', np.int64), ('vp_self', np.float64), ('inner', np.int64), ('outer', np.int64),
+                       ('in_lo', np.float64), ('in_hi', np.float64), ('out_lo', np.float64), ('out_hi', np.float64),
+                       ('start', np.int64), ('stop', np.int64)])
+LEAF_DTYPE = np.dtype([('row', np.int64), ('self', np.float64)])
+
+# Rows scored per block when computing distances to a vantage point during the build
+BUILD_BLOCK = 65536
+
+def build_vp_tree(store, db_dir=DB_DIR, self_kernels=None, leaf_size=VP_TREE_LEAF_SIZE):
+    """
+    Builds a vantage point tree over every light curve in a SpectralStore and saves it in db_dir.
+
+    Args:
+        store: SpectralStore with every light curve
+        db_dir: directory the tree files are written to
+        self_kernels: optional dict of cached K(x,x) normalizers keyed to filename
+        leaf_size: largest number of light curves in a leaf bucket
+    Returns:
+        The VPTree opened on the new files
+    Notes:
+        - Costs about N log2(N / leaf_size) kernel distances. Vantage points are picked at random,
+          so seed the random module for a reproducible tree.
+    """
+    ids = store.ids
+    row_self = lookup_self_kernels(ids, self_kernels)
+    if row_self is None:
+        row_self = np.concatenate([self_kernels_spectra(store.spectra_at(slice(i, i + BUILD_BLOCK)), store.length)
+                                   for i in range(0, len(ids), BUILD_BLOCK)]) if ids else np.empty(0)
+
+    nodes = []
+    leaves = []
+    num_leaf_rows = [0]
+
+    def dists_to(vp, rows):
+        return np.concatenate([
+            kernel_dist_spectra(store.spectra_at([vp]), store.spectra_at(rows[i:i + BUILD_BLOCK]), store.length,
+                                ts_self=row_self[vp], cand_self=row_self[rows[i:i + BUILD_BLOCK]])
+            for i in range(0, len(rows), BUILD_BLOCK)])
+
+    def build(rows):
+        node = len(nodes)
+        nodes.append(None)
+        if len(rows) <= leaf_size:
+            start = num_leaf_rows[0]
+            leaves.append(rows)
+            num_leaf_rows[0] += len(rows)
+            nodes[node] = (-1, 0.0, -1, -1, 0.0, 0.0, 0.0, 0.0, start, start + len(rows))
+            return node
+        pick = random.randrange(len(rows))
+        vp = rows[pick]
+        rows = np.delete(rows, pick)
+        dists = dists_to(vp, rows)
+        order = np.argsort(dists, kind='stable')
+        half = len(rows) // 2
+        inner_rows, outer_rows = rows[order[:half]], rows[order[half:]]
+        inner_d, outer_d = dists[order[:half]], dists[order[half:]]
+        inner = build(inner_rows) if len(inner_rows) > 0 else -1
+        outer = build(outer_rows)
+        nodes[node] = (vp, row_self[vp], inner, outer,
+                       inner_d[0] if len(inner_d) else 0.0, inner_d[-1] if len(inner_d) else 0.0,
+                       outer_d[0], outer_d[-1], 0, 0)
+        return node
+
+    build(np.arange(len(ids), dtype=np.int64))
+    leaf_rows = np.concatenate(leaves) if leaves else np.empty(0, dtype=np.int64)
+
+    os.makedirs(db_dir, exist_ok=True)
+    np.save(db_dir + VP_TREE_FILE, np.array(nodes, dtype=NODE_DTYPE))
+    leaf_array = np.empty(len(leaf_rows), dtype=LEAF_DTYPE)
+    leaf_array['row'] = leaf_rows
+    leaf_array['self'] = row_self[leaf_rows]
+    np.save(db_dir + VP_TREE_LEAVES_FILE, leaf_array)
+    with open(db_dir + VP_TREE_IDS_FILE, 'wb') as f:
+        pickle.dump({'ids': ids, 'length': store.length, 'leaf_size': leaf_size}, f, protocol=pickle.HIGHEST_PROTOCOL)
+    return VPTree(db_dir)
+
+def has_vp_tree(db_dir=DB_DIR):
+    """Helper to determine whether a vantage point tree has been built in db_dir"""
+    return all(os.path.isfile(db_dir + fn) for fn in [VP_TREE_FILE, VP_TREE_LEAVES_FILE, VP_TREE_IDS_FILE])
+
+class VPTree(object):
+    """
+    A vantage point tree saved by build_vp_tree. Nodes are read into memory; the light curves
+    themselves are read from the SpectralStore the tree was built over.
+
+    Light curves appended to the store after the build (e.g. by ingest) are not in the tree; searches
+    score them directly, so results stay exact until the tree is rebuilt.
+    """
+
+    def __init__(self, db_dir=DB_DIR):
+        nodes = np.load(db_dir + VP_TREE_FILE)
+        # Plain lists are much faster than numpy scalars for the node by node descent
+        self._vp = nodes['vp'].tolist()
+        self._vp_self = nodes['vp_self'].tolist()
+        self._children = list(zip(nodes['inner'].tolist(), nodes['in_lo'].tolist(), nodes['in_hi'].tolist(),
+                                  nodes['outer'].tolist(), nodes['out_lo'].tolist(), nodes['out_hi'].tolist()))
+        self._start = nodes['start'].tolist()
+        self._stop = nodes['stop'].tolist()
+        leaves = np.load(db_dir + VP_TREE_LEAVES_FILE)
+        self._leaf_rows = leaves['row']
+        self._leaf_self = leaves['self']
+        with open(db_dir + VP_TREE_IDS_FILE, 'rb') as f:
+            index = pickle.load(f)
+        self.ids = index['ids']
+        self.length = index['length']
+
+    def __len__(self):
+        return len(self.ids)
+
+    def matches(self, store):
+        "whether store holds the light curves the tree was built over, in the same rows"
+        return store.length == self.length and store.ids[:len(self.ids)] == self.ids
+
+    def knn(self, ts, k, store, self_kernels=None, stats=None):
+        """
+        Searches for the k most similar light curves.
+
+        Args:
+            ts: time series to search on.
+            k: number of light curves to return.
+            store: the SpectralStore the tree was built over (see matches)
+            self_kernels: optional dict of cached K(x,x) normalizers, used for curves added after the build
+            stats: optional SearchStats to record stage timings and counters into
+        Returns:
+            List of (distance, filename) tuples for the k closest light curves, closest first
+        """
+        q = spectrum(standardize(ts))
+        q_self = self_kernels_spectra(q, store.length)
+        best = []
+        evals = 0
+
+        def push(dist, row):
+            if len(best) < k:
+                heapq.heappush(best, (-dist, row))
+            elif dist < -best[0][0]:
+                heapq.heapreplace(best, (-dist, row))
+
+        def score(rows, cand_self):
+            with stage(stats, 'candidate_load'):
+                spectra = store.spectra_at(rows)
+            with stage(stats, 'candidate_scoring'):
+                return kernel_dist_spectra(q, spectra, store.length, ts_self=q_self, cand_self=cand_self)
+
+        # Curves added after the build are scored directly
+        if len(store) > len(self.ids):
+            extra = np.arange(len(self.ids), len(store))
+            cand_self = lookup_self_kernels(store.ids_at(extra), self_kernels)
+            for dist, row in zip(score(extra, cand_self).tolist(), extra.tolist()):
+                push(dist, row)
+            evals += len(extra)
+
+        queue = [(0.0, 0)] if self._vp else []
+        while queue:
+            bound, node = heapq.heappop(queue)
+            if len(best) == k and bound >= -best[0][0]:
+                break
+            vp = self._vp[node]
+            if vp < 0:
+                start, stop = self._start[node], self._stop[node]
+                rows = self._leaf_rows[start:stop]
+                for dist, row in zip(score(rows, self._leaf_self[start:stop]).tolist(), rows.tolist()):
+                    push(dist, row)
+                evals += stop - start
+                continue
+            dist = float(score([vp], [self._vp_self[node]])[0])
+            push(dist, vp)
+            evals += 1
+            kth = -best[0][0] if len(best) == k else np.inf
+            inner, in_lo, in_hi, outer, out_lo, out_hi = self._children[node]
+            for child, lo, hi in ((inner, in_lo, in_hi), (outer, out_lo, out_hi)):
+                if child >= 0:
+                    child_bound = max(lo - dist, dist - hi, bound)
+                    if child_bound < kth:
+                        heapq.heappush(queue, (child_bound, child))
+
+        count(stats, 'distance_evals', evals)
+        count(stats, 'pruned', len(store) - evals)
+        results = sorted((-neg_dist, row) for neg_dist, row in best)
+        return [(dist, fn) for (dist, row), fn in zip(results, store.ids_at([row for dist, row in results]))]